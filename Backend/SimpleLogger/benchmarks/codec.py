@@ -0,0 +1,37 @@
+"""
+Benchmark der Nachrichtenformate aus dem Modul `simplelogger.codec`. Misst die
+Zeit zum Kodieren und Dekodieren sowie die Anzahl Bytes je Messwert, jeweils
+für einzelne Messwerte und für Batches. Aufruf im Verzeichnis `SimpleLogger`:
+
+    python -m benchmarks.codec
+"""
+
+import timeit
+from datetime import datetime
+from simplelogger import codec
+
+def main():
+    measurement = {"distance_m": 0.43, "datetime_iso": datetime.now().isoformat()}
+
+    messages = {
+        "Einzelwert": ({"command": "MEASUREMENT", "data": measurement}, 1),
+        "Batch (10)": ({"command": "MEASUREMENT_BATCH", "data": [measurement] * 10}, 10),
+        "Batch (100)": ({"command": "MEASUREMENT_BATCH", "data": [measurement] * 100}, 100),
+    }
+
+    print(f"{'Nachricht':<12} {'Format':<8} {'Bytes/Wert':>10} {'Kodieren µs/Wert':>17} {'Dekodieren µs/Wert':>19}")
+
+    for label, (message, count) in messages.items():
+        for c in codec.CODECS.values():
+            payload = c.encode(message)
+
+            number, encode_s = timeit.Timer(lambda: c.encode(message)).autorange()
+            encode_us = encode_s / number / count * 1e6
+
+            number, decode_s = timeit.Timer(lambda: codec.decode(payload)).autorange()
+            decode_us = decode_s / number / count * 1e6
+
+            print(f"{label:<12} {c.name:<8} {len(payload) / count:>10.1f} {encode_us:>17.2f} {decode_us:>19.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Ende-zu-Ende-Benchmark für Device und Backend ohne Hardware, Broker und
+Datenbankserver. Die simulierten Devices aus `parkdistance.simulation` senden
+über einen `LoopbackBroker` direkt an die `LoopbackMQTT` des SimpleLoggers,
+dessen `MongoDBHandler` in eine `mongomock://`-Datenbank schreibt. Gemessen
+werden:
+
+    * Latenz von der Abfrage im `DistanceSensor` bis zum Schreiben des
+      Messwerts durch den `MongoDBHandler` (p50/p99)
+    * Latenz eines Alarms vom Broadcast des `AlarmHandler` über den
+      `MQTTHandler` des Devices bis zur Ausgabe durch den `LedBeeper` (p50/p99)
+    * Verarbeitete Nachrichten je Sekunde und je Sekunde Rechenzeit, also
+      je voll ausgelastetem CPU-Kern
+    * Speicherbedarf je simuliertem Device
+
+Die Ergebnisse können als JSON-Datei gespeichert und mit einem früheren Lauf
+verglichen werden. Bei einer Verschlechterung um mehr als die Toleranz endet
+das Programm mit dem Status 1. Aufruf im Verzeichnis `SimpleLogger`, wobei
+zusätzlich die Abhängigkeiten des Raspberry Pi (gpiozero) installiert sein
+müssen:
+
+    python -m benchmarks.pipeline --output vorher.json
+    python -m benchmarks.pipeline --compare vorher.json
+"""
+
+import os, sys
+
+# Quellcode des Devices liegt im Nachbarverzeichnis des Repositories
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Raspberrypi"))
+
+import argparse, configparser, json, logging, platform, queue, subprocess, threading, time, tracemalloc
+from datetime import datetime
+from parkdistance.device import Device
+from parkdistance.actors.led_beeper import LedBeeper
+from parkdistance.actors.mqtt import MQTTHandler
+from parkdistance.simulation import use_mock_pins, Fleet, LoopbackBroker, ParkingProfile, SimulatedDistanceSensor
+from simplelogger.dispatcher import Dispatcher
+from simplelogger.loopback import LoopbackMQTT
+from simplelogger.handlers.alarm import AlarmHandler
+from simplelogger.handlers.mongodb import MongoDBHandler
+
+# Kennzahlen mit Beschriftung, Einheit, ob ein größerer Wert besser ist und
+# kleinster Unterschied, der beim Vergleich nicht als Messrauschen gilt
+METRICS = {
+    "uplink_latency_p50_ms":   ("Latenz Sensor → Datenbank p50", "ms",  False, 5),
+    "uplink_latency_p99_ms":   ("Latenz Sensor → Datenbank p99", "ms",  False, 5),
+    "alarm_latency_p50_ms":    ("Latenz Alarm → LedBeeper p50",  "ms",  False, 1),
+    "alarm_latency_p99_ms":    ("Latenz Alarm → LedBeeper p99",  "ms",  False, 1),
+    "messages_per_s":          ("Nachrichten je Sekunde",        "1/s", True,  0),
+    "messages_per_cpu_s":      ("Nachrichten je CPU-Sekunde",    "1/s", True,  0),
+    "memory_per_device_bytes": ("Speicher je Device",            "B",   False, 64),
+}
+
+class TimedDistanceSensor(SimulatedDistanceSensor):
+    """
+    Simulierter Abstandssensor, der sich für jeden gespeicherten Messwert den
+    Zeitpunkt der Abfrage laut `time.perf_counter_ns()` merkt.
+    """
+
+    def __init__(self, topic, started, **kwargs):
+        """
+        Konstruktor. Parameter sind das Topic des Devices und ein gemeinsames
+        Dictionary, in dem die Zeitpunkte je Topic und Zeitstempel landen.
+        """
+        super().__init__(**kwargs)
+        self._topic = topic
+        self._started = started
+
+    def __call__(self, device):
+        start_ns = time.perf_counter_ns()
+        ringbuffer = device.parameters["distance_measurement_ringbuffer"]
+        count = ringbuffer.count
+
+        super().__call__(device)
+
+        if ringbuffer.count != count:
+            self._started[(self._topic, ringbuffer[-1].timestamp_ms)] = start_ns
+
+class TimedFleet(Fleet):
+    """
+    `Fleet` mit `TimedDistanceSensor` statt des einfachen simulierten Sensors.
+    """
+
+    def __init__(self, *args, started, **kwargs):
+        self._started = started
+        super().__init__(*args, **kwargs)
+
+    def _create_device(self, index, config, seed):
+        device = Device()
+        device.add_sensor_actor(TimedDistanceSensor(config["topic_send"], self._started, profile=ParkingProfile(seed=seed), **self._sensor_options))
+        device.add_sensor_actor(MQTTHandler(device, config, client=self._broker.client()))
+        return device
+
+class TimedMongoDBHandler(MongoDBHandler):
+    """
+    `MongoDBHandler`, der nach jedem geschriebenen Stapel die Latenz seit der
+    Abfrage des Sensors für jeden enthaltenen Messwert festhält.
+    """
+
+    def __init__(self, config, started):
+        super().__init__(config)
+        self._started = started
+        self.latencies_ns = []
+        self.stored = 0
+
+    def _write_batch(self, batch, written=None):
+        result = super()._write_batch(batch, written)
+        now_ns = time.perf_counter_ns()
+
+        for document in batch:
+            data = document.get("data")
+
+            if data is None:
+                continue
+
+            timestamp_ms = round(datetime.fromisoformat(data["datetime_iso"]).timestamp() * 1000)
+            start_ns = self._started.pop((document["device"], timestamp_ms), None)
+
+            if start_ns is not None:
+                self.latencies_ns.append(now_ns - start_ns)
+
+            self.stored += 1
+
+        return result
+
+class RecordingDriver:
+    """
+    Treiber für den `LedBeeper`, der statt der Ausgänge zu schalten nur den
+    Zeitpunkt und das Muster jeder Änderung festhält.
+    """
+
+    def __init__(self):
+        self.applied = queue.Queue()
+
+    def apply(self, pattern):
+        self.applied.put((time.perf_counter_ns(), pattern))
+
+    def close(self):
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ende-zu-Ende-Benchmark für Device und Backend")
+    parser.add_argument("--devices", type=int, default=100, help="Anzahl simulierter Devices")
+    parser.add_argument("--duration", type=float, default=10, help="Dauer der Durchsatzmessung in Sekunden")
+    parser.add_argument("--sample-rate", type=float, default=10, help="Abfragen des Sensors je Sekunde")
+    parser.add_argument("--report-interval", type=float, default=1.0, help="Sekunden zwischen zwei gesendeten Messwerten")
+    parser.add_argument("--codec", default="json", help="Nachrichtenformat der Messwerte: json oder binary")
+    parser.add_argument("--workers", type=int, default=4, help="Worker-Threads des Dispatchers")
+    parser.add_argument("--batch-max-age", type=float, default=1.0, help="Maximale Wartezeit eines Messwerts im MongoDBHandler")
+    parser.add_argument("--alarms", type=int, default=20, help="Anzahl gemessener Alarme (je ein- und ausschalten)")
+    parser.add_argument("--output", default="", help="Ergebnisse als JSON in diese Datei schreiben")
+    parser.add_argument("--compare", default="", help="Ergebnisse mit einer früheren JSON-Datei vergleichen")
+    parser.add_argument("--tolerance", type=float, default=10, help="Erlaubte Verschlechterung in Prozent beim Vergleich")
+    args = parser.parse_args(argv)
+
+    # Warnungen der Handler (zum Beispiel bei jedem Alarm) verfälschen die Messung
+    logging.disable(logging.WARNING)
+    use_mock_pins()
+
+    print(f"{args.devices} Devices, {args.sample_rate} Abfragen/s, Messwert alle {args.report_interval} s, {args.duration} s")
+
+    metrics = {}
+    metrics.update(measure_uplink(args))
+    metrics.update(measure_alarm(args))
+    metrics.update(measure_memory(args))
+
+    for key, (label, unit, higher_is_better, noise) in METRICS.items():
+        print(f"{label:<32} {metrics[key]:>12.2f} {unit}")
+
+    result = {
+        "revision": git_revision(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")},
+        "metrics": metrics,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=4)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        if compare(baseline, result, args.tolerance):
+            sys.exit(1)
+
+def mqtt_config(args, topic_send):
+    """
+    Konfiguration für den `MQTTHandler` der simulierten Devices.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict({"mqtt": {
+        "host":          "loopback",
+        "port":          1883,
+        "keepalive":     60,
+        "topic_send":    topic_send,
+        "topic_receive": "wahlmodul-iot/broadcast",
+        "codec":         args.codec,
+    }})
+
+    return config["mqtt"]
+
+def backend_config(args):
+    """
+    Konfiguration für den `Dispatcher` und `MongoDBHandler` des Backends.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict({
+        "dispatcher": {"workers": args.workers, "queue_size": 10000, "stats_interval": 0},
+        "mongodb": {"connection": "mongomock://", "batch_max_age": args.batch_max_age},
+    })
+
+    return config
+
+def measure_uplink(args):
+    """
+    Alle Devices für die angegebene Dauer Messwerte an das Backend senden lassen.
+    Liefert die Latenz bis zum Speichern und den Durchsatz.
+    """
+    started = {}
+    config = backend_config(args)
+
+    mqtt = LoopbackMQTT(Dispatcher(config["dispatcher"]))
+    handler = TimedMongoDBHandler(config["mongodb"], started)
+    mqtt.add_handler(handler)
+
+    broker = LoopbackBroker(sink=mqtt.publish)
+    fleet = TimedFleet(
+        args.devices,
+        mqtt_config(args, "wahlmodul-iot/bench-{device}/measurements"),
+        broker,
+        sensor_options = {"sample_rate": args.sample_rate, "report_interval_s": args.report_interval},
+        seed           = 1,
+        started        = started,
+    )
+
+    start_s = time.monotonic()
+    start_cpu_s = time.process_time()
+
+    fleet.run(args.duration, update_frequency=args.sample_rate)
+    mqtt.close()
+
+    cpu_time_s = time.process_time() - start_cpu_s
+    total_time_s = time.monotonic() - start_s
+    latencies_ms = sorted(latency_ns / 1e6 for latency_ns in handler.latencies_ns)
+
+    print(f"Gesendet: {broker.published}, gespeichert: {handler.stored}, verworfen: {mqtt.dropped}")
+
+    return {
+        "uplink_latency_p50_ms": percentile(latencies_ms, 50),
+        "uplink_latency_p99_ms": percentile(latencies_ms, 99),
+        "messages_per_s": broker.published / total_time_s,
+        "messages_per_cpu_s": broker.published / cpu_time_s,
+    }
+
+def measure_alarm(args):
+    """
+    Alarme über den `AlarmHandler` auslösen und beenden und die Zeit bis zur
+    Ausgabe durch den `LedBeeper` eines Devices messen. Das Device läuft dabei
+    wie auf dem Raspberry Pi mit `loop_forever()` in einem eigenen Thread.
+    """
+    config = mqtt_config(args, "wahlmodul-iot/bench-alarm/measurements")
+    broker = LoopbackBroker()
+    driver = RecordingDriver()
+
+    device = Device()
+    device.add_sensor_actor(LedBeeper(led1_pin=7, led2_pin=8, buzzer_pin=13, driver=driver))
+    device.add_sensor_actor(MQTTHandler(device, config, client=broker.client()))
+    threading.Thread(target=device.loop_forever, args=(args.sample_rate,), daemon=True).start()
+
+    mqtt = LoopbackMQTT(Dispatcher(backend_config(args)["dispatcher"]))
+    sent_ns = []
+
+    def forward(message):
+        sent_ns.append(time.perf_counter_ns())
+        broker.deliver(config["topic_receive"], json.dumps(message).encode())
+
+    mqtt.subscribe(forward)
+    mqtt.add_handler(AlarmHandler(mqtt))
+
+    payload = json.dumps({"command": "MEASUREMENT", "data": {"distance_m": 0.5, "datetime_iso": datetime.now().isoformat()}})
+    latencies_ms = []
+
+    for i in range(args.alarms):
+        for count, alarm in ((AlarmHandler.ALARM_ON_COUNT, True), (AlarmHandler.ALARM_OFF_COUNT, False)):
+            for j in range(count):
+                mqtt.publish(config["topic_send"], payload)
+
+            # Muster vor dem Alarm, zum Beispiel beim Start des Devices, überspringen
+            applied_ns, pattern = driver.applied.get(timeout=5)
+
+            while pattern.led1 != alarm:
+                applied_ns, pattern = driver.applied.get(timeout=5)
+
+            latencies_ms.append((applied_ns - sent_ns[-1]) / 1e6)
+
+    mqtt.close()
+    latencies_ms.sort()
+
+    return {
+        "alarm_latency_p50_ms": percentile(latencies_ms, 50),
+        "alarm_latency_p99_ms": percentile(latencies_ms, 99),
+    }
+
+def measure_memory(args):
+    """
+    Speicherbedarf der Devices samt Sensor, Filter, Ringpuffer und `MQTTHandler`
+    nach kurzer Laufzeit mit `tracemalloc` messen.
+    """
+    tracemalloc.start()
+    before, peak = tracemalloc.get_traced_memory()
+
+    fleet = Fleet(
+        args.devices,
+        mqtt_config(args, "wahlmodul-iot/bench-{device}/measurements"),
+        LoopbackBroker(),
+        sensor_options = {"sample_rate": args.sample_rate, "report_interval_s": args.report_interval},
+        seed           = 1,
+    )
+
+    fleet.run(2, update_frequency=args.sample_rate)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"memory_per_device_bytes": (after - before) / len(fleet.devices)}
+
+def compare(baseline, result, tolerance):
+    """
+    Kennzahlen mit einem früheren Lauf vergleichen und die Abweichungen
+    ausgeben. Rückgabewert ist die Liste der Kennzahlen, die sich um mehr als
+    `tolerance` Prozent und mehr als das Messrauschen verschlechtert haben.
+    """
+    print()
+    print(f"Vergleich mit {baseline.get('revision') or 'unbekannter Revision'} vom {baseline.get('date', '?')}")
+
+    if baseline.get("parameters") != result["parameters"]:
+        print("Achtung: Der frühere Lauf wurde mit anderen Parametern gemessen")
+
+    regressions = []
+
+    for key, (label, unit, higher_is_better, noise) in METRICS.items():
+        old, new = baseline["metrics"].get(key), result["metrics"][key]
+
+        if not old:
+            continue
+
+        change = 100 * (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = ""
+
+        if worse > tolerance and abs(new - old) > noise:
+            regressions.append(key)
+            mark = "  << schlechter"
+
+        print(f"{label:<32} {old:>12.2f} → {new:>12.2f} {unit:<3} {change:>+7.1f} %{mark}")
+
+    return regressions
+
+def git_revision():
+    """
+    Aktuelle Git-Revision oder `None`, wenn sie nicht ermittelt werden kann.
+    """
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except:
+        return None
+
+def percentile(values, p):
+    """
+    Perzentil einer sortierten Liste, 0 bei einer leeren Liste.
+    """
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+if __name__ == "__main__":
+    main()
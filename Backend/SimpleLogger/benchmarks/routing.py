@@ -0,0 +1,142 @@
+"""
+Benchmark der Verteilung einer Nachricht an die Handler im Dispatcher. Misst
+die Kosten je Nachricht für das Dekodieren, das Prüfen mit `messages.parse()`
+und die Suche der zuständigen Handler mit dem `messages.Router`, jeweils ohne
+Warteschlangen und Threads. Zum Vergleich wird die bisherige Verteilung
+gemessen, bei der jeder Handler jede Nachricht erhält und ihr Kommando
+selbst prüft. Wie im Dispatcher wird dabei jeder Aufruf eines Handlers mit
+der Metrik `simplelogger_handler_seconds` gemessen. Aufruf im Verzeichnis
+`SimpleLogger`:
+
+    python -m benchmarks.routing
+"""
+
+import argparse, json, time, timeit
+from datetime import datetime
+from simplelogger import codec, messages, metrics
+
+class FilteringHandler:
+    """
+    Handler, der wie bisher jede Nachricht erhält und selbst prüft, ob er für
+    ihr Kommando zuständig ist. Mit `routed = True` meldet er seine Kommandos
+    über das Attribut `commands` an den Router.
+    """
+
+    def __init__(self, commands, routed, topics=None):
+        self.accepted = frozenset(commands)
+        self.calls = 0
+
+        if routed:
+            self.commands = commands
+
+            if topics is not None:
+                self.topics = topics
+
+    def __call__(self, topic, message):
+        if message.get("command", "") not in self.accepted:
+            return
+
+        self.calls += 1
+
+def create_handlers(routed, topic_filter):
+    """
+    Handler wie in `main.py`: Datenbank, Regeln, Anwesenheit und optional
+    ein Handler, der nur die Statusmeldungen der Devices erhält.
+    """
+    measurements = ("MEASUREMENT", "MEASUREMENT_BATCH", "MEASUREMENT_SUMMARY")
+
+    handlers = [
+        FilteringHandler(measurements, routed),
+        FilteringHandler(measurements, routed),
+        FilteringHandler(measurements + ("ONLINE", "OFFLINE"), routed),
+    ]
+
+    if topic_filter:
+        handlers.append(FilteringHandler(("ONLINE", "OFFLINE"), routed, topics=("+/+/status",)))
+
+    return handlers
+
+def payloads():
+    """
+    Typische Mischung: überwiegend Messwerte, einige Statusmeldungen und die
+    über das gemeinsame Abo zurückkommenden Kommandos an die Devices.
+    """
+    measurement = {"distance_m": 0.43, "datetime_iso": datetime.now().isoformat()}
+
+    return (
+        [("wahlmodul-iot/device1/measurements", json.dumps({"command": "MEASUREMENT", "data": measurement}).encode())] * 8
+        + [("wahlmodul-iot/device1/status", b'{"command": "ONLINE"}')]
+        + [("wahlmodul-iot/device1/commands", b'{"command": "ALARM_ON"}')]
+    )
+
+def measure(function, count, repeat=5):
+    """
+    Laufzeit je Nachricht in Nanosekunden, als bester von mehreren Durchläufen,
+    damit andere Prozesse das Ergebnis möglichst wenig verfälschen.
+    """
+    timer = timeit.Timer(function)
+    number, seconds = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number / count * 1e9
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kosten der Nachrichtenverteilung je Nachricht")
+    parser.add_argument("--topic-filter", action="store_true", help="Zusätzlichen Handler mit Topicfilter registrieren")
+    args = parser.parse_args(argv)
+
+    items = payloads()
+    decoded = [(topic, codec.decode(payload)) for topic, payload in items]
+    parsed = [messages.parse(topic, message) for topic, message in decoded]
+
+    handler_seconds = metrics.HANDLER_SECONDS.labels("benchmark")
+    legacy = [(handler, handler_seconds) for handler in create_handlers(False, args.topic_filter)]
+    router = messages.Router()
+
+    for handler in create_handlers(True, args.topic_filter):
+        router.add(handler, handler_seconds)
+
+    def dispatch_legacy():
+        for topic, payload in items:
+            message = codec.decode(payload)
+
+            for handler, seconds in legacy:
+                start_s = time.perf_counter()
+                handler(topic, message)
+                seconds.observe(time.perf_counter() - start_s)
+
+    def dispatch_routed():
+        for topic, payload in items:
+            message = messages.parse(topic, codec.decode(payload))
+
+            for handler, seconds in router.route(message):
+                start_s = time.perf_counter()
+                handler(topic, message)
+                seconds.observe(time.perf_counter() - start_s)
+
+    def route_only():
+        for message in parsed:
+            router.route(message)
+
+    def parse_only():
+        for topic, message in decoded:
+            messages.parse(topic, message)
+
+    def decode_only():
+        for topic, payload in items:
+            codec.decode(payload)
+
+    results = [
+        ("Dekodieren", measure(decode_only, len(items))),
+        ("Prüfen (parse)", measure(parse_only, len(items))),
+        ("Handler suchen (route)", measure(route_only, len(items))),
+        ("Gesamt bisher", measure(dispatch_legacy, len(items))),
+        ("Gesamt mit Router", measure(dispatch_routed, len(items))),
+    ]
+
+    print(f"{len(legacy)} Handler, {len(items)} Nachrichten je Durchlauf")
+    print(f"{'Schritt':<24} {'ns/Nachricht':>13}")
+
+    for label, ns in results:
+        print(f"{label:<24} {ns:>13.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+#! /usr/bin/env python
+from simplelogger.tools.replay import main
+
+if __name__ == "__main__":
+    main()
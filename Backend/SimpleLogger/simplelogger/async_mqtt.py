@@ -0,0 +1,314 @@
+# Vgl. https://pypi.org/project/aiomqtt/
+
+import aiomqtt
+import asyncio, inspect, json, logging, os, ssl, time, traceback, zlib
+from simplelogger import codec, messages, metrics
+from simplelogger.mqtt import subscription_topic
+
+class AsyncMQTT:
+    """
+    Alternative zur Klasse `MQTT`, bei der Empfang und Verarbeitung der Nachrichten
+    vollständig in einer asyncio Event Loop laufen. Anstatt für jede Aufgabe einen
+    eigenen Thread zu verwenden, warten hier viele Coroutinen gleichzeitig auf
+    das Netzwerk, so dass auch mit einem einzigen Prozessorkern sehr viele
+    Devices gleichzeitig bedient werden können.
+
+    Handler dürfen hier Coroutinen sein, also `async def __call__(self, topic, message)`
+    besitzen. Herkömmliche Handler wie der `AlarmHandler` werden automatisch in
+    einen `SyncHandlerAdapter` verpackt und in einem Thread-Pool ausgeführt.
+    """
+
+    def __init__(self, config, dispatcher_config):
+        """
+        Konstruktor. Im ersten Parameter muss dasselbe Konfigurationsobjekt wie bei
+        der Klasse `MQTT` übergeben werden, zusätzlich mit folgender Property:
+
+            * reconnect_interval: Sekunden bis zum erneuten Verbindungsaufbau (optional)
+
+        Der zweite Parameter ist die Konfiguration des Dispatchers. Es werden dieselben
+        Properties wie bei der Klasse `Dispatcher` unterstützt.
+        """
+        self._config = config
+        self._log_every = int(config.get("log_every", 1))
+        self._received = 0
+        self._dispatcher = AsyncDispatcher(dispatcher_config)
+        self._client = None
+        self._loop = None
+
+    def add_handler(self, handler):
+        """
+        Fügt einen weiteren Handler zum Verarbeiten der via MQTT empfangenen
+        Nachrichten hinzu. Siehe `MQTT.add_handler()`. Der Handler darf eine
+        Coroutine sein.
+        """
+        if not is_async_handler(handler):
+            handler = SyncHandlerAdapter(handler)
+
+        self._dispatcher.add_handler(handler)
+
+    def loop_forever(self):
+        """
+        Ausführung der asyncio Event Loop im aktuellen Thread starten.
+        """
+        asyncio.run(self.run())
+
+    async def run(self):
+        """
+        Coroutine zum Empfangen der Nachrichten. Baut die Verbindung bei einem
+        Abbruch automatisch wieder auf und verarbeitet beim Beenden alle noch
+        wartenden Nachrichten.
+        """
+        self._loop = asyncio.get_running_loop()
+        await self._dispatcher.start()
+
+        config = self._config
+        reconnect_interval_s = float(config.get("reconnect_interval", 5))
+
+        tls_params = None
+
+        if config.getboolean("tls_enable", False):
+            logging.info("Aktiviere TLS-Verschlüsselung für die MQTT-Kommunikation")
+            tls_params = aiomqtt.TLSParameters(tls_version=ssl.PROTOCOL_TLS)
+
+        host = os.getenv("MQTT_HOST") or config["host"]
+
+        try:
+            while True:
+                logging.info(f"Stelle Verbindung zum MQTT-Server her: {host}, Port {config['port']}")
+
+                try:
+                    async with aiomqtt.Client(
+                        hostname     = host,
+                        port         = int(config["port"]),
+                        keepalive    = int(config["keepalive"]),
+                        username     = config.get("username", "") or None,
+                        password     = config.get("password", "") or None,
+                        tls_params   = tls_params,
+                        tls_insecure = True if tls_params else None,
+                    ) as client:
+                        self._client = client
+
+                        topic = subscription_topic(config)
+                        logging.info(f"Aboniere MQTT-Topic {topic}")
+                        await client.subscribe(topic)
+
+                        async for message in client.messages:
+                            self._on_message(str(message.topic), message.payload)
+                except aiomqtt.MqttError as error:
+                    logging.warning(f"Verbindung zum MQTT-Broker unterbrochen: {error}")
+                finally:
+                    self._client = None
+
+                await asyncio.sleep(reconnect_interval_s)
+        finally:
+            await self._dispatcher.close()
+
+    def broadcast(self, message):
+        """
+        Sendet eine Broadcast-Meldung an alle Devices. Kann wie bei der Klasse
+        `MQTT` aus jedem beliebigen Thread heraus aufgerufen werden.
+        """
+        self.send(self._config["topic_send"], message)
+
+    def send(self, topic, message, qos=0):
+        """
+        Sendet eine Nachricht an ein einzelnes Topic, zum Beispiel an das
+        Kommando-Topic eines bestimmten Devices. Kann wie `broadcast()` aus
+        jedem beliebigen Thread heraus aufgerufen werden.
+        """
+        asyncio.run_coroutine_threadsafe(self.publish(topic, message, qos), self._loop)
+
+    async def publish(self, topic, message, qos=0):
+        """
+        Coroutine zum Senden einer Nachricht an das übergebene Topic.
+        """
+        if self._client is None:
+            logging.warning(f"Keine Verbindung zum MQTT-Broker, verwerfe Nachricht an {topic}")
+            return
+
+        await self._client.publish(topic, payload=json.dumps(message), qos=qos)
+
+    def _on_message(self, topic, payload):
+        """
+        Reicht eine über MQTT empfangene Nachricht an den Dispatcher weiter.
+        """
+        self._received += 1
+
+        # Bei vielen Devices kostet eine Logzeile je Nachricht spürbar Durchsatz
+        if self._log_every and self._received % self._log_every == 0:
+            logging.info(f"Empfange Nachricht Nr. {self._received}: {payload}")
+
+        if not self._dispatcher.submit(topic, payload):
+            logging.warning(f"Warteschlange voll, verwerfe Nachricht von {topic}")
+
+class AsyncDispatcher:
+    """
+    Gegenstück zur Klasse `Dispatcher` für die asyncio Event Loop. Anstelle von
+    Worker-Threads werden hier Worker-Coroutinen verwendet, wobei auch hier die
+    Nachrichten eines Topics immer von derselben Coroutine verarbeitet werden,
+    um ihre Reihenfolge zu erhalten.
+    """
+
+    def __init__(self, config):
+        """
+        Konstruktor. Erwartet dieselbe Konfiguration wie die Klasse `Dispatcher`.
+        """
+        self._workers = int(config.get("workers", 4))
+        self._queue_size = int(config.get("queue_size", 1000))
+        self._stats_interval_s = float(config.get("stats_interval", 60))
+
+        self._handlers = []
+        self._router = messages.Router()
+        self._queues = []
+        self._tasks = []
+        self._processed = 0
+        self._dropped = 0
+
+    def add_handler(self, handler):
+        """
+        Fügt einen weiteren Handler hinzu. Dieser muss eine Coroutine sein.
+        """
+        self._handlers.append(handler)
+        self._router.add(handler, metrics.HANDLER_SECONDS.labels(metrics.handler_name(handler)))
+
+    async def start(self):
+        """
+        Warteschlangen und Worker-Coroutinen anlegen und alle Handler starten,
+        die hierfür eine Coroutine `start()` besitzen.
+        """
+        for handler in self._handlers:
+            if hasattr(handler, "start"):
+                await handler.start()
+
+        self._queues = [asyncio.Queue(maxsize=self._queue_size) for i in range(self._workers)]
+        self._tasks = [asyncio.create_task(self._worker_main(q)) for q in self._queues]
+
+        if self._stats_interval_s > 0:
+            self._tasks.append(asyncio.create_task(self._stats_main()))
+
+        metrics.QUEUE_DEPTH.set_function(lambda: sum(q.qsize() for q in self._queues))
+
+    def submit(self, topic, payload):
+        """
+        Nachricht zur Verarbeitung einreihen. Rückgabewert ist `False`, wenn die
+        Nachricht wegen einer vollen Warteschlange verworfen wurde.
+        """
+        q = self._queues[zlib.crc32(topic.encode()) % len(self._queues)]
+        metrics.MESSAGES_RECEIVED.labels(topic).inc()
+
+        try:
+            q.put_nowait((topic, payload))
+            return True
+        except asyncio.QueueFull:
+            self._dropped += 1
+            metrics.MESSAGES_DROPPED.inc()
+            return False
+
+    def stats(self):
+        """
+        Aktuelle Kennzahlen der Verarbeitung, siehe `Dispatcher.stats()`.
+        """
+        depths = [q.qsize() for q in self._queues] or [0]
+
+        return {
+            "queue_depth": sum(depths),
+            "queue_depth_max": max(depths),
+            "processed": self._processed,
+            "dropped": self._dropped,
+        }
+
+    async def close(self):
+        """
+        Alle noch wartenden Nachrichten abarbeiten und danach alle Handler
+        schließen, die hierfür eine Methode `close()` besitzen.
+        """
+        for q in self._queues:
+            await q.join()
+
+        for task in self._tasks:
+            task.cancel()
+
+        for handler in self._handlers:
+            if hasattr(handler, "close"):
+                try:
+                    await handler.close()
+                except:
+                    traceback.print_exc()
+
+    async def _worker_main(self, q):
+        """
+        Worker-Coroutine zum Dekodieren der Nachrichten und Aufrufen der Handler.
+        """
+        while True:
+            topic, payload = await q.get()
+
+            try:
+                message = messages.parse(topic, codec.decode(payload))
+
+                for handler, handler_seconds in self._router.route(message):
+                    start_s = time.perf_counter()
+
+                    try:
+                        await handler(topic, message)
+                    except:
+                        traceback.print_exc()
+
+                    handler_seconds.observe(time.perf_counter() - start_s)
+
+                self._processed += 1
+            except ValueError as error:
+                metrics.MESSAGES_INVALID.inc()
+                logging.warning(f"Ungültige Nachricht von {topic} verworfen: {error}")
+            finally:
+                q.task_done()
+
+    async def _stats_main(self):
+        """
+        Coroutine zur regelmäßigen Ausgabe der Kennzahlen im Log.
+        """
+        while True:
+            await asyncio.sleep(self._stats_interval_s)
+
+            stats = self.stats()
+            logging.info(
+                f"Warteschlange: {stats['queue_depth']} (max. {stats['queue_depth_max']} je Worker), "
+                f"verarbeitet: {stats['processed']}, verworfen: {stats['dropped']}"
+            )
+
+class SyncHandlerAdapter:
+    """
+    Adapter, um einen herkömmlichen Handler wie den `AlarmHandler` oder den
+    `MongoDBHandler` als Coroutine aufrufen zu können. Der Handler wird dabei
+    im Standard-Thread-Pool der Event Loop ausgeführt, damit er die Event Loop
+    nicht blockieren kann.
+    """
+
+    def __init__(self, handler):
+        """
+        Konstruktor. Parameter ist der zu verpackende Handler.
+        """
+        self._handler = handler
+        self.name = metrics.handler_name(handler)
+        self.commands = getattr(handler, "commands", None)
+        self.topics = getattr(handler, "topics", None)
+
+    async def __call__(self, topic, message):
+        """
+        Handler im Thread-Pool aufrufen und auf sein Ende warten.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._handler, topic, message)
+
+    async def close(self):
+        """
+        Handler im Thread-Pool schließen, falls er eine Methode `close()` besitzt.
+        """
+        if hasattr(self._handler, "close"):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._handler.close)
+
+def is_async_handler(handler):
+    """
+    Prüft, ob der übergebene Handler eine Coroutine ist.
+    """
+    return inspect.iscoroutinefunction(handler) or inspect.iscoroutinefunction(getattr(handler, "__call__", None))
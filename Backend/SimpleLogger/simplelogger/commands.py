@@ -0,0 +1,280 @@
+import itertools, json, logging, os, threading, time
+from collections import deque
+from simplelogger import metrics
+
+class Delivery:
+    """
+    Zustellung eines Kommandos an ein Device oder eine Gruppe. `pending`
+    enthält die Devices, deren Bestätigung noch aussteht, `acked` die Devices,
+    die den Empfang bereits bestätigt haben, und `failed` die Devices, die
+    auch nach allen Wiederholungen nicht geantwortet haben.
+    """
+
+    __slots__ = ("id", "command", "data", "target", "pending", "acked", "failed", "sent_s", "deadline_s", "attempts", "done")
+
+    def __init__(self, id, command, data, target, devices, now_s, timeout_s):
+        self.id = id
+        self.command = command
+        self.data = data
+        self.target = target
+        self.pending = set(devices)
+        self.acked = set()
+        self.failed = set()
+        self.sent_s = now_s
+        self.deadline_s = now_s + timeout_s
+        self.attempts = 1
+        self.done = threading.Event()
+
+        if not self.pending:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """
+        Warten, bis alle Devices den Empfang bestätigt haben oder die
+        Zustellung endgültig gescheitert ist. Rückgabewert ist `True`, wenn
+        alle Devices bestätigt haben.
+        """
+        self.done.wait(timeout)
+        return self.done.is_set() and not self.pending and not self.failed
+
+class CommandService:
+    """
+    Versand von Kommandos an einzelne Devices oder an Gruppen von Devices.
+    Anders als beim Broadcast über `MQTT.broadcast()` erhalten nur die Devices
+    das Kommando, für die es bestimmt ist:
+
+        * Ein einzelnes Device erhält es auf seinem Kommando-Topic `topic_command`.
+        * Eine Gruppe erhält es mit einer einzigen Nachricht auf dem Topic
+          `topic_group`, das nur die Devices der Gruppe abonniert haben. Der
+          Broker stellt die Nachricht somit nur an diese Devices zu.
+
+    Jedes Kommando erhält eine eindeutige `id`, die das Device mit dem Kommando
+    `ACK` auf seinem Antwort-Topic bestätigt. Fehlt die Bestätigung eines Devices
+    nach `ack_timeout` Sekunden, wird das Kommando bis zu `retries` Mal direkt an
+    dieses Device wiederholt. Welche Devices zu einer Gruppe gehören, melden
+    die Devices selbst mit ihrer Statusmeldung `ONLINE`.
+
+    Wiederholte Kommandos werden zusammengefasst: Wird dasselbe Kommando mit
+    denselben Daten an dasselbe Ziel gesendet, während das vorige noch nicht
+    bestätigt ist oder vor weniger als `coalesce_interval` Sekunden gesendet
+    wurde, wird keine neue Nachricht gesendet. Ist für ein Device ein neueres
+    Kommando unterwegs, wird ein älteres nicht mehr wiederholt.
+
+    Die Klasse ist zugleich ein Handler für den Dispatcher, um die Bestätigungen
+    und Statusmeldungen der Devices zu empfangen.
+
+    THREADING: Alle Methoden dürfen aus beliebigen Threads aufgerufen werden.
+    """
+
+    # Vom Dispatcher nur für diese Kommandos aufrufen
+    commands = ("ACK", "ONLINE")
+
+    def __init__(self, mqtt, config):
+        """
+        Konstruktor. Benötigt im ersten Parameter das globale MQTT-Objekt zum
+        Senden der Kommandos. Im zweiten Parameter muss ein Konfigurationsobjekt
+        mit folgenden Properties übergeben werden:
+
+            * topic_command: Kommando-Topic eines Devices, wobei `{device}` durch das
+              Topic seiner Nachrichten ohne den letzten Abschnitt ersetzt wird (optional)
+            * topic_group: Kommando-Topic einer Gruppe mit dem Platzhalter `{group}` (optional)
+            * ack_timeout: Sekunden bis zur Wiederholung eines unbestätigten Kommandos (optional)
+            * retries: Maximale Anzahl Wiederholungen je Device (optional)
+            * coalesce_interval: Sekunden, in denen gleiche Kommandos zusammengefasst werden (optional)
+        """
+        self._mqtt = mqtt
+        self._topic_command = config.get("topic_command", "{device}/commands")
+        self._topic_group = config.get("topic_group", "wahlmodul-iot/groups/{group}/commands")
+        self._ack_timeout_s = float(config.get("ack_timeout", 5))
+        self._retries = int(config.get("retries", 2))
+        self._coalesce_interval_s = float(config.get("coalesce_interval", 1.0))
+
+        # Eindeutige Kennungen auch über Neustarts und mehrere Instanzen hinweg
+        self._ids = (f"{os.urandom(4).hex()}-{n}" for n in itertools.count(1))
+
+        self._groups = {}
+        self._deliveries = {}
+        self._latest = {}
+        self._last_sent = {}
+        self._deadlines = deque()
+        self._lock = threading.Lock()
+
+        metrics.COMMANDS_PENDING.set_function(lambda: len(self._deliveries))
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    def send(self, device, command, data=None):
+        """
+        Kommando an ein einzelnes Device senden, das über sein Topic-Präfix,
+        zum Beispiel `wahlmodul-iot/device1`, angegeben wird. Rückgabewert ist
+        die `Delivery`, bei zusammengefassten Kommandos die bereits laufende.
+        """
+        return self._send(("device", device), [device], self._topic_command.replace("{device}", device), command, data)
+
+    def send_group(self, group, command, data=None):
+        """
+        Kommando mit einer einzigen Nachricht an alle Devices einer Gruppe
+        senden. Bestätigungen werden von allen Devices erwartet, die sich
+        bis jetzt mit dieser Gruppe gemeldet haben.
+        """
+        with self._lock:
+            devices = list(self._groups.get(group, ()))
+
+        return self._send(("group", group), devices, self._topic_group.replace("{group}", group), command, data)
+
+    def members(self, group):
+        """
+        Alle Devices, die sich mit der übergebenen Gruppe gemeldet haben.
+        """
+        with self._lock:
+            return set(self._groups.get(group, ()))
+
+    def __call__(self, topic, message):
+        """
+        Verarbeitung einer Bestätigung `ACK` oder einer Statusmeldung `ONLINE`,
+        die die Gruppen des Devices unter `data.groups` enthalten kann.
+
+        THREADING: Diese Methode läuft parallel in mehreren Worker-Threads
+        des Dispatchers.
+        """
+        device = topic.rsplit("/", 1)[0]
+        data = message.get("data")
+
+        if not isinstance(data, dict):
+            return
+
+        if message.get("command") == "ACK":
+            self._acknowledge(device, data.get("id"))
+        elif isinstance(data.get("groups"), list):
+            self._join(device, data["groups"])
+
+    def close(self):
+        """
+        Hintergrundthread für die Wiederholungen beenden.
+        """
+        self._stopped.set()
+        self._thread.join()
+
+    def _send(self, target, devices, topic, command, data):
+        """
+        Kommando an ein Topic senden, sofern es nicht mit dem zuletzt an dasselbe
+        Ziel gesendeten Kommando zusammengefasst werden kann.
+        """
+        key = (command, json.dumps(data, sort_keys=True))
+        now_s = time.monotonic()
+
+        with self._lock:
+            last = self._last_sent.get(target)
+
+            if last is not None and last[0] == key:
+                delivery = last[1]
+
+                if not delivery.done.is_set() or now_s - delivery.sent_s < self._coalesce_interval_s:
+                    metrics.COMMANDS_COALESCED.inc()
+                    return delivery
+
+            delivery = Delivery(next(self._ids), command, data, target, devices, now_s, self._ack_timeout_s)
+            self._last_sent[target] = (key, delivery)
+
+            for device in devices:
+                self._latest[device] = delivery.id
+
+            if not delivery.done.is_set():
+                self._deliveries[delivery.id] = delivery
+                self._deadlines.append(delivery)
+
+        metrics.COMMANDS_SENT.labels(target[0]).inc()
+        self._publish(topic, delivery)
+        return delivery
+
+    def _publish(self, topic, delivery):
+        message = {"command": delivery.command, "id": delivery.id}
+
+        if delivery.data is not None:
+            message["data"] = delivery.data
+
+        self._mqtt.send(topic, message, qos=1)
+
+    def _acknowledge(self, device, id):
+        """
+        Bestätigung eines Devices für das Kommando mit der übergebenen `id`.
+        """
+        with self._lock:
+            delivery = self._deliveries.get(id)
+
+            if delivery is None or device not in delivery.pending:
+                return
+
+            delivery.pending.discard(device)
+            delivery.acked.add(device)
+
+            if not delivery.pending:
+                del self._deliveries[id]
+                delivery.done.set()
+
+        metrics.COMMAND_ACK_SECONDS.observe(time.monotonic() - delivery.sent_s)
+
+    def _join(self, device, groups):
+        """
+        Gruppenzugehörigkeit eines Devices aus seiner Statusmeldung übernehmen.
+        """
+        with self._lock:
+            for members in self._groups.values():
+                members.discard(device)
+
+            for group in groups:
+                self._groups.setdefault(str(group), set()).add(device)
+
+    def _expire(self):
+        """
+        Unbestätigte Kommandos, deren Frist abgelaufen ist, an die fehlenden
+        Devices wiederholen oder endgültig als gescheitert melden. Da die Frist
+        für alle Kommandos gleich lang ist, liegen die abgelaufenen immer am
+        Anfang der Warteschlange.
+        """
+        now_s = time.monotonic()
+        retries = []
+        failed = []
+
+        with self._lock:
+            while self._deadlines and self._deadlines[0].deadline_s <= now_s:
+                delivery = self._deadlines.popleft()
+
+                if delivery.done.is_set():
+                    continue
+
+                # Devices mit einem neueren Kommando benötigen dieses nicht mehr
+                superseded = {device for device in delivery.pending if self._latest.get(device) != delivery.id}
+                delivery.pending -= superseded
+
+                if delivery.pending and delivery.attempts <= self._retries:
+                    delivery.attempts += 1
+                    delivery.deadline_s = now_s + self._ack_timeout_s
+                    self._deadlines.append(delivery)
+                    retries.extend((device, delivery) for device in delivery.pending)
+                    continue
+
+                delivery.failed = set(delivery.pending)
+                delivery.pending = set()
+                del self._deliveries[delivery.id]
+                delivery.done.set()
+
+                if delivery.failed:
+                    failed.append(delivery)
+
+        for device, delivery in retries:
+            metrics.COMMANDS_RETRIED.inc()
+            self._publish(self._topic_command.replace("{device}", device), delivery)
+
+        for delivery in failed:
+            metrics.COMMANDS_FAILED.inc(len(delivery.failed))
+            logging.warning(f"Kommando {delivery.command} an {delivery.target[1]} nicht bestätigt von: {', '.join(sorted(delivery.failed))}")
+
+    def _thread_main(self):
+        """
+        Hintergrundthread zum regelmäßigen Prüfen der Fristen.
+        """
+        while not self._stopped.wait(min(self._ack_timeout_s / 4, 1.0)):
+            self._expire()
@@ -0,0 +1,77 @@
+import logging, os, threading
+from pymongo import ReturnDocument
+from simplelogger.database import connect
+
+class LocalCounter:
+    """
+    Einfacher, threadsicherer Zähler für den Betrieb mit nur einer Instanz
+    des SimpleLoggers.
+    """
+
+    def __init__(self):
+        """
+        Konstruktor.
+        """
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        """
+        Zähler um eins erhöhen und den neuen Wert zurückgeben.
+        """
+        with self._lock:
+            self._value += 1
+            return self._value
+
+class MongoCounter:
+    """
+    Zähler, der von mehreren Instanzen des SimpleLoggers gemeinsam verwendet
+    werden kann. Der Zählerstand liegt hierfür in der Collection `coordination`
+    der Mongo-Datenbank und wird dort atomar hochgezählt. Dadurch erhält jede
+    Instanz eindeutige Zählerstände und jeder Zählerstand wird genau einmal
+    vergeben, egal wie viele Instanzen gleichzeitig zählen.
+
+    Um die Datenbank zu entlasten, kann sich jede Instanz mit einem Zugriff
+    gleich einen ganzen Block von Zählerständen reservieren, den sie dann
+    lokal aufbraucht.
+    """
+
+    def __init__(self, config, name, block_size=1):
+        """
+        Konstruktor. Parameter:
+            * config: Konfiguration der Datenbankverbindung wie beim `MongoDBHandler`
+            * name: Eindeutiger Name des Zählers
+            * block_size: Anzahl je Datenbankzugriff reservierter Zählerstände
+        """
+        connection = os.getenv("MONGO_DB_CONNECTION") or config['connection']
+        logging.info(f"Benutze gemeinsamen Zähler {name} in der Datenbank")
+
+        self._mongo = connect(connection)
+        self._collection = self._mongo.get_database("sensor_db").get_collection("coordination")
+
+        self._name = name
+        self._block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        """
+        Nächsten Zählerstand zurückgeben. Reserviert einen neuen Block, wenn
+        der aktuelle Block aufgebraucht ist.
+        """
+        with self._lock:
+            if self._next >= self._end:
+                document = self._collection.find_one_and_update(
+                    {"_id": self._name},
+                    {"$inc": {"value": self._block_size}},
+                    upsert = True,
+                    return_document = ReturnDocument.AFTER,
+                )
+
+                self._end  = document["value"] + 1
+                self._next = self._end - self._block_size
+
+            value = self._next
+            self._next += 1
+            return value
@@ -0,0 +1,25 @@
+import threading
+from pymongo import MongoClient
+
+_mongomock_clients = {}
+_mongomock_lock = threading.Lock()
+
+def connect(connection, **kwargs):
+    """
+    Verbindung zur Mongo-Datenbank herstellen. Beginnt die URL mit `mongomock://`,
+    wird statt einer echten Datenbank eine In-Memory-Datenbank aus dem Paket
+    `mongomock` verwendet, zum Beispiel für Tests und Lastmessungen ohne
+    laufenden MongoDB-Server. Alle Verbindungen mit derselben URL teilen sich
+    dabei innerhalb des Prozesses dieselben Daten. Weitere Parameter werden an
+    den Client übergeben.
+    """
+    if connection.startswith("mongomock://"):
+        import mongomock
+
+        with _mongomock_lock:
+            if not connection in _mongomock_clients:
+                _mongomock_clients[connection] = mongomock.MongoClient(**kwargs)
+
+            return _mongomock_clients[connection]
+
+    return MongoClient(connection, **kwargs)
@@ -0,0 +1,174 @@
+import logging, queue, threading, time, traceback, zlib
+from simplelogger import codec, messages, metrics
+
+class Dispatcher:
+    """
+    Entkoppelt den Empfang der MQTT-Nachrichten von ihrer Verarbeitung. Der
+    MQTT-Thread legt die empfangenen Nachrichten nur noch in einer Warteschlange
+    ab, während mehrere Worker-Threads die Nachrichten dekodieren (JSON oder
+    Binärformat, siehe Modul `codec`) und an die Handler übergeben. Ein langsamer
+    Handler hält somit nicht mehr den Empfang weiterer Nachrichten auf.
+
+    Jede Nachricht wird dabei nur einmal dekodiert und geprüft (siehe Modul
+    `messages`) und nur an die Handler übergeben, die sich für ihr Kommando
+    und Topic registriert haben.
+
+    Jeder Worker besitzt eine eigene, in der Größe begrenzte Warteschlange. Die
+    Nachrichten eines Topics landen immer beim selben Worker, so dass sie in
+    der Reihenfolge des Empfangs verarbeitet werden. Nachrichten unterschiedlicher
+    Devices werden hingegen parallel verarbeitet. Ist eine Warteschlange voll,
+    wird die Nachricht verworfen und mitgezählt.
+    """
+
+    # Markierung in den Warteschlangen, um die Worker zu beenden
+    _STOP = object()
+
+    def __init__(self, config):
+        """
+        Konstruktor. Im ersten Parameter muss ein Konfigurationsobjekt mit folgenden
+        Properties übergeben werden:
+
+            * workers: Anzahl paralleler Worker-Threads (optional)
+            * queue_size: Maximale Anzahl wartender Nachrichten je Worker (optional)
+            * stats_interval: Sekunden zwischen zwei Statistik-Ausgaben, 0 = aus (optional)
+        """
+        workers = int(config.get("workers", 4))
+        queue_size = int(config.get("queue_size", 1000))
+
+        self._handlers = []
+        self._router = messages.Router()
+        self._queues = [queue.Queue(maxsize=queue_size) for i in range(workers)]
+        self._processed = [0] * workers
+        self._dropped = 0
+
+        self._worker_threads = []
+
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker_thread_main, args=(index,), daemon=True)
+            thread.start()
+            self._worker_threads.append(thread)
+
+        self._stats_interval_s = float(config.get("stats_interval", 60))
+        self._stopped = threading.Event()
+
+        if self._stats_interval_s > 0:
+            self._stats_thread = threading.Thread(target=self._stats_thread_main, daemon=True)
+            self._stats_thread.start()
+
+        metrics.QUEUE_DEPTH.set_function(lambda: sum(q.qsize() for q in self._queues))
+
+    def add_handler(self, handler):
+        """
+        Fügt einen weiteren Handler zum Verarbeiten der Nachrichten hinzu. Der
+        Handler muss sich als Funktion mit zwei Parametern aufrufen lassen:
+
+            * Name des Topics
+            * Empfangene Nachricht als `Message`-Objekt
+
+        Mit den Attributen `commands` und `topics` kann der Handler die Nachrichten
+        einschränken, für die er aufgerufen wird. Siehe `messages.Router`.
+        """
+        self._handlers.append(handler)
+        self._router.add(handler, metrics.HANDLER_SECONDS.labels(metrics.handler_name(handler)))
+
+    def submit(self, topic, payload):
+        """
+        Nachricht zur Verarbeitung einreihen. Blockiert niemals, sondern verwirft
+        die Nachricht, wenn die Warteschlange des zuständigen Workers voll ist.
+        Rückgabewert ist `True`, wenn die Nachricht angenommen wurde.
+
+        THREADING: Diese Methode läuft im MQTT-Thread.
+        """
+        index = zlib.crc32(topic.encode()) % len(self._queues)
+        metrics.MESSAGES_RECEIVED.labels(topic).inc()
+
+        try:
+            self._queues[index].put_nowait((topic, payload))
+            return True
+        except queue.Full:
+            self._dropped += 1
+            metrics.MESSAGES_DROPPED.inc()
+            return False
+
+    def stats(self):
+        """
+        Aktuelle Kennzahlen der Verarbeitung als Dictionary:
+
+            * queue_depth: Anzahl aktuell wartender Nachrichten
+            * queue_depth_max: Länge der vollsten Warteschlange
+            * processed: Anzahl bisher verarbeiteter Nachrichten
+            * dropped: Anzahl bisher verworfener Nachrichten
+        """
+        depths = [q.qsize() for q in self._queues]
+
+        return {
+            "queue_depth": sum(depths),
+            "queue_depth_max": max(depths),
+            "processed": sum(self._processed),
+            "dropped": self._dropped,
+        }
+
+    def close(self):
+        """
+        Alle noch wartenden Nachrichten abarbeiten, die Worker beenden und
+        danach alle Handler schließen, die hierfür eine Methode `close()`
+        besitzen.
+        """
+        self._stopped.set()
+
+        for q in self._queues:
+            q.put(self._STOP)
+
+        for thread in self._worker_threads:
+            thread.join()
+
+        for handler in self._handlers:
+            if hasattr(handler, "close"):
+                try:
+                    handler.close()
+                except:
+                    traceback.print_exc()
+
+    def _worker_thread_main(self, index):
+        """
+        Hintergrundthread zum Dekodieren der Nachrichten und Aufrufen der Handler.
+        """
+        q = self._queues[index]
+
+        while True:
+            item = q.get()
+
+            if item is self._STOP:
+                return
+
+            topic, payload = item
+
+            try:
+                message = messages.parse(topic, codec.decode(payload))
+            except ValueError as error:
+                metrics.MESSAGES_INVALID.inc()
+                logging.warning(f"Ungültige Nachricht von {topic} verworfen: {error}")
+                continue
+
+            for handler, handler_seconds in self._router.route(message):
+                start_s = time.perf_counter()
+
+                try:
+                    handler(topic, message)
+                except:
+                    traceback.print_exc()
+
+                handler_seconds.observe(time.perf_counter() - start_s)
+
+            self._processed[index] += 1
+
+    def _stats_thread_main(self):
+        """
+        Hintergrundthread zur regelmäßigen Ausgabe der Kennzahlen im Log.
+        """
+        while not self._stopped.wait(self._stats_interval_s):
+            stats = self.stats()
+            logging.info(
+                f"Warteschlange: {stats['queue_depth']} (max. {stats['queue_depth_max']} je Worker), "
+                f"verarbeitet: {stats['processed']}, verworfen: {stats['dropped']}"
+            )
@@ -0,0 +1,148 @@
+# Vgl. https://arrow.apache.org/docs/python/parquet.html
+
+import gzip, json, logging
+from simplelogger.storage import parse_timestamp, parse_values
+
+try:
+    import pyarrow, pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+def _require_pyarrow():
+    """
+    Parquet-Dateien benötigen das optionale Paket `pyarrow`.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Für Parquet-Dateien muss das Paket pyarrow installiert sein")
+
+class ParquetExporter:
+    """
+    Schreibt Messwerte fortlaufend in eine komprimierte Parquet-Datei für
+    Auswertungen mit Pandas, DuckDB, Spark usw. Die Messwerte werden spaltenweise
+    gesammelt und je `row_group_size` Messwerte als eine Row Group geschrieben,
+    so dass der Speicherbedarf unabhängig von der Größe des Exports ist.
+
+    Spalten der Datei:
+
+        * device: Topic des Devices (als Dictionary kodiert, da sich die Werte
+          ständig wiederholen)
+        * timestamp: Zeitstempel in Millisekunden, UTC
+        * distance_m: Abstand in Metern
+        * confidence: Konfidenz des Messwerts oder leer
+    """
+
+    def __init__(self, path, row_group_size=100000, compression="zstd"):
+        """
+        Konstruktor. Parameter:
+            * path: Name der zu schreibenden Datei
+            * row_group_size: Anzahl Messwerte je Row Group (optional)
+            * compression: Kompressionsverfahren, zum Beispiel "zstd" oder "snappy" (optional)
+        """
+        _require_pyarrow()
+
+        self._schema = pyarrow.schema([
+            ("device", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ("timestamp", pyarrow.timestamp("ms", tz="UTC")),
+            ("distance_m", pyarrow.float64()),
+            ("confidence", pyarrow.float64()),
+        ])
+
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression=compression)
+        self._row_group_size = row_group_size
+        self._columns = ([], [], [], [])
+
+        self.count = 0
+        self.skipped = 0
+
+    def write(self, device, data):
+        """
+        Einen Messwert (Dictionary wie vom Device gesendet) anhängen.
+        """
+        try:
+            timestamp = parse_timestamp(data)
+            values = parse_values(data)
+        except (KeyError, TypeError, ValueError):
+            self.skipped += 1
+            return
+
+        devices, timestamps, distances, confidences = self._columns
+        devices.append(device)
+        timestamps.append(timestamp)
+        distances.append(values["distance_m"])
+        confidences.append(values.get("confidence"))
+
+        if len(devices) >= self._row_group_size:
+            self._flush()
+
+    def close(self):
+        """
+        Restliche Messwerte schreiben und die Datei abschließen.
+        """
+        self._flush()
+        self._writer.close()
+
+    def _flush(self):
+        """
+        Gesammelte Messwerte als Row Group schreiben.
+        """
+        devices, timestamps, distances, confidences = self._columns
+
+        if not devices:
+            return
+
+        self._writer.write_table(pyarrow.Table.from_arrays([
+            pyarrow.array(devices, pyarrow.string()).dictionary_encode(),
+            pyarrow.array(timestamps, self._schema.field("timestamp").type),
+            pyarrow.array(distances, pyarrow.float64()),
+            pyarrow.array(confidences, pyarrow.float64()),
+        ], schema=self._schema))
+
+        self.count += len(devices)
+        self._columns = ([], [], [], [])
+
+def read_file(path, batch_size=10000):
+    """
+    Messwerte aus einer exportierten Datei als Tupel aus Device und Messwert
+    (Dictionary wie vom Device gesendet) in der Reihenfolge der Datei lesen.
+    Unterstützt werden Parquet-Dateien des `ParquetExporter` (`.parquet`) und
+    JSON-Lines-Dateien mit je einem Dokument der Collection `measurements` je
+    Zeile (`.jsonl` oder `.jsonl.gz`), wie sie `mongoexport` erzeugt.
+    """
+    if path.endswith(".parquet"):
+        return _read_parquet(path, batch_size)
+
+    return _read_jsonl(path)
+
+def _read_parquet(path, batch_size):
+    """
+    Parquet-Datei stapelweise lesen, so dass nie die ganze Datei im Speicher liegt.
+    """
+    _require_pyarrow()
+
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size, columns=["device", "timestamp", "distance_m", "confidence"]):
+        columns = batch.to_pydict()
+
+        for device, timestamp, distance_m, confidence in zip(columns["device"], columns["timestamp"], columns["distance_m"], columns["confidence"]):
+            data = {"distance_m": distance_m, "datetime_iso": timestamp.isoformat()}
+
+            if confidence is not None:
+                data["confidence"] = confidence
+
+            yield device, data
+
+def _read_jsonl(path):
+    """
+    JSON-Lines-Datei zeilenweise lesen, mit der Endung `.gz` komprimiert.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+
+    with opener(path, "rt", encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+
+            try:
+                document = json.loads(line)
+                yield document["device"], document["data"]
+            except (KeyError, TypeError, ValueError):
+                logging.warning(f"Ungültige Zeile {number} in {path} übersprungen")
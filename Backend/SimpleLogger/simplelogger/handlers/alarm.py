@@ -1,43 +1,49 @@
 import logging
+from simplelogger.coordination import LocalCounter
 
 class AlarmHandler:
     """"
     Handler-Klasse zum Auslösen eines globalen Alarms auf allen Devices.
     Löst einfach für jede 30ste empfangene Nachricht einen Alarm aus
     und beendet diesen wieder nach 10 weiteren Nachrichten. :-)
+
+    Die Nachrichten werden mit einem austauschbaren Zähler gezählt. Laufen
+    mehrere Instanzen des SimpleLoggers parallel, teilen sie sich einen
+    `MongoCounter`, so dass der Alarm trotzdem nur einmal ausgelöst wird.
     """
 
     ALARM_ON_COUNT = 30
     ALARM_OFF_COUNT = 10
-    
-    def __init__(self, mqtt):
+
+    def __init__(self, mqtt, counter=None):
         """
         Konstruktor. Benötigt im ersten Parameter das globale MQTT-Objekt,
-        um Broadcasts an die Devices senden zu können.
+        um Broadcasts an die Devices senden zu können. Der zweite Parameter
+        ist der zu verwendende Zähler, standardmäßig ein `LocalCounter`.
         """
         self._mqtt = mqtt
-        self._alarm = False
-        self._counter = 0
-    
+        self._counter = counter or LocalCounter()
+
     def __call__(self, topic, message):
         """
         Verarbeitung einer via MQTT empfangenen Nachricht.
+
+        Da jeder Zählerstand nur einmal vergeben wird, entscheidet allein der
+        Zählerstand darüber, ob der Alarm ausgelöst oder beendet werden muss.
+        Hierfür ist kein weiterer gemeinsamer Zustand notwendig, und es sendet
+        immer nur genau die Instanz den Broadcast, die den passenden Zählerstand
+        erhalten hat.
+
+        THREADING: Diese Methode läuft parallel in mehreren Worker-Threads
+        des Dispatchers. Der Zähler ist threadsicher.
         """
-        self._counter += 1
+        count = self._counter.increment() % (self.ALARM_ON_COUNT + self.ALARM_OFF_COUNT)
 
-        if not self._alarm and self._counter == self.ALARM_ON_COUNT:
+        if count == self.ALARM_ON_COUNT:
             # Alarm auslösen
             logging.info("Löse Alarm aus")
-
-            self._counter = 0
-            self._alarm   = True
-
             self._mqtt.broadcast({"command": "ALARM_ON"})
-        elif self._alarm and self._counter == self.ALARM_OFF_COUNT:
+        elif count == 0:
             # Alarm beenden
             logging.info("Beende Alarm")
-
-            self._counter = 0
-            self._alarm   = False
-
-            self._mqtt.broadcast({"command": "ALARM_OFF"})
\ No newline at end of file
+            self._mqtt.broadcast({"command": "ALARM_OFF"})
@@ -0,0 +1,49 @@
+import threading, time
+from simplelogger.handlers.mongodb import MongoDBHandler
+
+class MemorySink:
+    """
+    Handler, der die empfangenen Messwerte nur im Hauptspeicher ablegt. Ersetzt
+    den `MongoDBHandler` bei Tests und Lastmessungen ohne Datenbank.
+
+    Enthält ein Messwert das Feld `sent_ns` mit dem Sendezeitpunkt laut
+    `time.perf_counter_ns()`, wird zusätzlich die Latenz vom Senden bis zur
+    Verarbeitung in Nanosekunden festgehalten. Dies funktioniert nur, wenn
+    Sender und Empfänger im selben Prozess laufen.
+    """
+
+    # Vom Dispatcher nur für diese Kommandos aufrufen
+    commands = MongoDBHandler.commands
+
+    def __init__(self, keep_documents=True):
+        """
+        Konstruktor. Parameter:
+            * keep_documents: Dokumente aufbewahren oder nur zählen
+        """
+        self._keep_documents = keep_documents
+        self._lock = threading.Lock()
+
+        self.documents = []
+        self.latencies_ns = []
+        self.count = 0
+
+    def __call__(self, topic, message):
+        """
+        Verarbeitung einer via MQTT empfangenen Nachricht.
+
+        THREADING: Diese Methode läuft in einem Worker-Thread des Dispatchers.
+        """
+        now_ns = time.perf_counter_ns()
+        documents = MongoDBHandler.to_documents(topic, message)
+
+        with self._lock:
+            self.count += len(documents)
+
+            for document in documents:
+                sent_ns = document.get("data", {}).get("sent_ns")
+
+                if sent_ns is not None:
+                    self.latencies_ns.append(now_ns - sent_ns)
+
+            if self._keep_documents:
+                self.documents.extend(documents)
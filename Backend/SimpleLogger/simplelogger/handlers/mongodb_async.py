@@ -0,0 +1,146 @@
+# Vgl. https://pypi.org/project/motor/
+
+import asyncio, logging, os, time, traceback
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, CollectionInvalid
+from simplelogger import metrics
+from simplelogger.handlers.mongodb import MongoDBHandler, parse_timeout
+from simplelogger.rollups import Rollups
+from simplelogger.storage import SummaryStorage, WindowStorage, batch_writes, get_storage
+
+class AsyncMongoDBHandler:
+    """
+    Gegenstück zum `MongoDBHandler` für den asyncio-Betrieb mit `AsyncMQTT`.
+    Verwendet den asynchronen MongoDB-Treiber Motor, so dass das Speichern der
+    Messwerte keinen eigenen Thread benötigt, sondern in derselben Event Loop
+    wie der Empfang der Nachrichten läuft. Die Messwerte werden auch hier
+    gesammelt und stapelweise gespeichert.
+    """
+
+    # Vom Dispatcher nur für diese Kommandos aufrufen
+    commands = MongoDBHandler.commands
+
+    def __init__(self, config):
+        """
+        Konstruktor. Erwartet dieselbe Konfiguration wie der `MongoDBHandler`.
+        """
+        self._connection = os.getenv("MONGO_DB_CONNECTION") or config['connection']
+        self._storage = get_storage(config.get("storage", "documents"))
+        self._rollups = Rollups() if config.getboolean("rollups", False) else None
+        self._summaries = SummaryStorage()
+        self._windows = WindowStorage()
+
+        self._batch_size = int(config.get("batch_size", 500))
+        self._batch_max_age_s = float(config.get("batch_max_age", 1.0))
+        self._backpressure_timeout_s = parse_timeout(config.get("backpressure_timeout", 0.1))
+        self._buffer_size = int(config.get("buffer_size", 10000))
+
+        self._mongo = None
+        self._measurements = None
+        self._collections = None
+        self._buffer = None
+        self._writer_task = None
+        self._dropped = 0
+
+    async def start(self):
+        """
+        Verbindung zur Datenbank herstellen und die Schreib-Coroutine starten.
+        Muss innerhalb der laufenden Event Loop aufgerufen werden.
+        """
+        logging.info(f"Stelle Verbindung zur Datenbank her: {self._connection}")
+
+        self._mongo = AsyncIOMotorClient(self._connection)
+        database = self._mongo.get_database("sensor_db")
+        name = self._storage.collection
+
+        if self._storage.options:
+            try:
+                await database.create_collection(name, **self._storage.options)
+                logging.info(f"Collection {name} angelegt")
+            except CollectionInvalid:
+                pass
+
+        self._measurements = database.get_collection(name)
+        await self._measurements.create_indexes(self._storage.indexes)
+        await database.get_collection(self._summaries.collection).create_indexes(self._summaries.indexes)
+        await database.get_collection(self._windows.collection).create_indexes(self._windows.indexes)
+
+        if self._rollups is not None:
+            for name in self._rollups.collections():
+                await database.get_collection(name).create_indexes(self._rollups.indexes)
+
+        names = [self._summaries.collection, self._windows.collection]
+        names += self._rollups.collections() + [Rollups.LATEST] if self._rollups is not None else []
+
+        self._collections = {name: database.get_collection(name) for name in names}
+        self._collections[self._storage.collection] = self._measurements
+
+        self._buffer = asyncio.Queue(maxsize=self._buffer_size)
+        self._writer_task = asyncio.create_task(self._writer_main())
+
+    async def __call__(self, topic, message):
+        """
+        Verarbeitung einer via MQTT empfangenen Nachricht.
+        """
+        for document in MongoDBHandler.to_documents(topic, message):
+            try:
+                await asyncio.wait_for(self._buffer.put(document), timeout=self._backpressure_timeout_s)
+            except asyncio.TimeoutError:
+                self._dropped += 1
+                metrics.DB_DROPPED.inc()
+                logging.warning(f"Puffer voll, verwerfe Messwert von {topic} (bisher {self._dropped} verworfen)")
+
+    async def close(self):
+        """
+        Alle noch gepufferten Messwerte speichern und die Schreib-Coroutine beenden.
+        """
+        await self._buffer.join()
+        self._writer_task.cancel()
+
+    async def _writer_main(self):
+        """
+        Coroutine zum stapelweisen Speichern der gepufferten Messwerte.
+        """
+        while True:
+            batch = [await self._buffer.get()]
+            deadline_s = time.monotonic() + self._batch_max_age_s
+
+            while len(batch) < self._batch_size:
+                timeout_s = deadline_s - time.monotonic()
+
+                if timeout_s <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self._buffer.get(), timeout=timeout_s))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._write_batch(batch)
+
+            for i in range(len(batch)):
+                self._buffer.task_done()
+
+    async def _write_batch(self, batch):
+        """
+        Einen Stapel Messwerte ungeordnet in die Datenbank schreiben.
+        """
+        logging.info(f"Speichere {len(batch)} Messwerte")
+        metrics.DB_BATCH_SIZE.observe(len(batch))
+
+        writes = batch_writes(batch, self._collections, self._storage, self._rollups)
+
+        for collection, operations in writes:
+            if not operations:
+                continue
+
+            start_s = time.perf_counter()
+
+            try:
+                await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as error:
+                logging.error(f"Fehler beim Schreiben von {len(error.details.get('writeErrors', []))} Dokumenten in {collection.name}")
+            except:
+                traceback.print_exc()
+
+            metrics.DB_WRITE_SECONDS.labels(collection.name).observe(time.perf_counter() - start_s)
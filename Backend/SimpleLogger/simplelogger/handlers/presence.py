@@ -0,0 +1,284 @@
+import logging, math, os, threading, time, traceback
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from simplelogger import metrics
+from simplelogger.database import connect
+
+# Kommandos, die ein Device selbst sendet und die damit als Lebenszeichen zählen
+DEVICE_COMMANDS = {"MEASUREMENT", "MEASUREMENT_BATCH", "MEASUREMENT_SUMMARY", "MEASUREMENT_WINDOW", "ONLINE", "ACK"}
+
+class Presence:
+    """
+    Anwesenheit eines Devices: ob es online ist, wann zuletzt eine Nachricht
+    empfangen wurde, seit wann der aktuelle Zustand besteht und in welchem
+    Fach des Timer-Rads es gerade liegt. Zeitpunkte laut `time.monotonic()`.
+    """
+
+    __slots__ = ("online", "last_seen_s", "since_s", "slot")
+
+    def __init__(self, now_s):
+        self.online = False
+        self.last_seen_s = now_s
+        self.since_s = now_s
+        self.slot = None
+
+class PresenceTracker:
+    """
+    Handler-Klasse, die für jedes Device festhält, wann es zuletzt eine
+    Nachricht gesendet hat, und daraus die Ereignisse ONLINE und OFFLINE
+    ableitet. Ein Device ist offline, wenn es seit `timeout` Sekunden keine
+    Nachricht mehr gesendet hat oder der Broker seinen "Last Will" mit dem
+    Kommando `OFFLINE` zustellt, weil die Verbindung abgebrochen ist.
+
+    Die Devices werden hierfür in einem Timer-Rad einsortiert: einem Ring von
+    Fächern, von denen jede Sekunde (`tick`) eines weitergedreht wird. Ein Device
+    liegt in dem Fach, in dem es frühestens ablaufen kann. Eine neue Nachricht
+    aktualisiert nur den Zeitpunkt im `Presence`-Objekt, ohne das Device
+    umzusortieren. Erst wenn sein Fach an der Reihe ist, wird geprüft, ob es
+    wirklich abgelaufen ist, oder es wird in das passende spätere Fach
+    verschoben. Der Aufwand je Nachricht ist damit konstant und je Sekunde
+    werden nur die Devices eines Fachs betrachtet.
+
+    Geänderte Zustände werden gesammelt alle `flush_interval` Sekunden in
+    der Collection `device_presence` gespeichert, mit dem Topic-Präfix des
+    Devices als `_id`. Beim Start werden die dort als online vermerkten
+    Devices übernommen, so dass sie nach einem Neustart ohne weitere
+    Nachricht ebenfalls als offline erkannt werden.
+    """
+
+    # Vom Dispatcher nur für diese Kommandos aufrufen
+    commands = tuple(DEVICE_COMMANDS) + ("OFFLINE",)
+
+    def __init__(self, config, mongodb_config=None):
+        """
+        Konstruktor. Im ersten Parameter muss ein Konfigurationsobjekt mit
+        folgenden Properties übergeben werden:
+
+            * timeout: Sekunden ohne Nachricht, bis ein Device offline ist (optional)
+            * tick: Sekunden zwischen zwei Prüfungen (optional)
+            * flush_interval: Sekunden zwischen zwei Schreibvorgängen (optional)
+
+        Im zweiten Parameter kann die Konfiguration des `MongoDBHandler` übergeben
+        werden, um die Zustände in der Datenbank zu speichern.
+        """
+        self._timeout_s = float(config.get("timeout", 360))
+        self._tick_s = float(config.get("tick", 1))
+        self._flush_interval_s = float(config.get("flush_interval", 10))
+
+        self._devices = {}
+        self._wheel = [set() for i in range(math.ceil(self._timeout_s / self._tick_s) + 1)]
+        self._position = 0
+        self._dirty = set()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+        self._collection = None
+
+        if mongodb_config is not None:
+            connection = os.getenv("MONGO_DB_CONNECTION") or mongodb_config["connection"]
+            self._collection = connect(connection).get_database("sensor_db").get_collection("device_presence")
+            self._load()
+
+        metrics.PRESENCE_ONLINE.set_function(lambda: sum(1 for presence in list(self._devices.values()) if presence.online))
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    def subscribe(self, callback):
+        """
+        Callback registrieren, der bei jedem Ereignis mit dem Device und `True`
+        für online bzw. `False` für offline aufgerufen wird.
+
+        THREADING: Der Callback läuft in einem Worker-Thread des Dispatchers oder
+        im Hintergrundthread des Trackers.
+        """
+        self._callbacks.append(callback)
+
+    def is_online(self, device):
+        """
+        Prüft, ob das Device mit dem übergebenen Topic-Präfix online ist.
+        """
+        presence = self._devices.get(device)
+        return presence is not None and presence.online
+
+    def __call__(self, topic, message):
+        """
+        Verarbeitung einer via MQTT empfangenen Nachricht. Nur die von den
+        Devices selbst gesendeten Kommandos zählen, nicht die Kommandos des
+        Backends an die Devices.
+
+        THREADING: Diese Methode läuft parallel in mehreren Worker-Threads
+        des Dispatchers.
+        """
+        try:
+            command = message.get("command", "")
+        except AttributeError:
+            return
+
+        if command in DEVICE_COMMANDS:
+            online = True
+        elif command == "OFFLINE":
+            online = False
+        else:
+            return
+
+        device = topic.rsplit("/", 1)[0]
+        now_s = time.monotonic()
+
+        with self._lock:
+            presence = self._devices.get(device)
+
+            if presence is None:
+                presence = self._devices[device] = Presence(now_s)
+                self._dirty.add(device)
+
+            if online:
+                presence.last_seen_s = now_s
+
+            changed = presence.online != online
+
+            if changed:
+                presence.online = online
+                presence.since_s = now_s
+
+                if online:
+                    self._schedule(device, presence, now_s)
+                else:
+                    self._unschedule(device, presence)
+
+            if changed or online:
+                self._dirty.add(device)
+
+        if changed:
+            self._emit(device, online)
+
+    def close(self):
+        """
+        Hintergrundthread beenden und die letzten Änderungen speichern.
+        """
+        self._stopped.set()
+        self._thread.join()
+        self._flush()
+
+    def _schedule(self, device, presence, now_s):
+        """
+        Device in das Fach einsortieren, in dem es frühestens abläuft.
+        """
+        remaining_s = presence.last_seen_s + self._timeout_s - now_s
+        ticks = min(max(1, math.ceil(remaining_s / self._tick_s)), len(self._wheel) - 1)
+
+        presence.slot = (self._position + ticks) % len(self._wheel)
+        self._wheel[presence.slot].add(device)
+
+    def _unschedule(self, device, presence):
+        """
+        Device aus dem Timer-Rad entfernen.
+        """
+        if presence.slot is not None:
+            self._wheel[presence.slot].discard(device)
+            presence.slot = None
+
+    def _advance(self):
+        """
+        Timer-Rad um ein Fach weiterdrehen und die darin liegenden Devices
+        entweder als offline melden oder in ein späteres Fach verschieben.
+        """
+        now_s = time.monotonic()
+        offline = []
+
+        with self._lock:
+            self._position = (self._position + 1) % len(self._wheel)
+            slot, self._wheel[self._position] = self._wheel[self._position], set()
+
+            for device in slot:
+                presence = self._devices[device]
+                presence.slot = None
+
+                if presence.last_seen_s + self._timeout_s <= now_s:
+                    presence.online = False
+                    presence.since_s = now_s
+                    self._dirty.add(device)
+                    offline.append(device)
+                else:
+                    self._schedule(device, presence, now_s)
+
+        for device in offline:
+            self._emit(device, False)
+
+    def _emit(self, device, online):
+        """
+        Ereignis im Log melden und an alle Callbacks übergeben.
+        """
+        event = "ONLINE" if online else "OFFLINE"
+        metrics.PRESENCE_EVENTS.labels(event).inc()
+        logging.info(f"Device {device} ist {event.lower()}")
+
+        for callback in self._callbacks:
+            try:
+                callback(device, online)
+            except:
+                traceback.print_exc()
+
+    def _flush(self):
+        """
+        Alle seit dem letzten Aufruf geänderten Zustände gesammelt speichern.
+        """
+        if self._collection is None:
+            return
+
+        now_s, now = time.monotonic(), datetime.now(timezone.utc)
+
+        def wall_clock(time_s):
+            return datetime.fromtimestamp(now.timestamp() - (now_s - time_s), tz=timezone.utc)
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+            operations = [
+                UpdateOne({"_id": device}, {"$set": {
+                    "online": presence.online,
+                    "last_seen": wall_clock(presence.last_seen_s),
+                    "since": wall_clock(presence.since_s),
+                }}, upsert=True)
+                for device, presence in ((device, self._devices[device]) for device in dirty)
+            ]
+
+        if not operations:
+            return
+
+        try:
+            self._collection.bulk_write(operations, ordered=False)
+        except:
+            traceback.print_exc()
+
+    def _load(self):
+        """
+        Beim letzten Lauf als online gespeicherte Devices übernehmen. Sie gelten
+        ab jetzt als zuletzt gesehen, bis eine neue Nachricht eintrifft.
+        """
+        now_s = time.monotonic()
+
+        try:
+            for document in self._collection.find({"online": True}, {"_id": 1}):
+                presence = self._devices[document["_id"]] = Presence(now_s)
+                presence.online = True
+                self._schedule(document["_id"], presence, now_s)
+        except:
+            traceback.print_exc()
+
+        logging.info(f"{len(self._devices)} Devices aus dem letzten Lauf übernommen")
+
+    def _thread_main(self):
+        """
+        Hintergrundthread zum Weiterdrehen des Timer-Rads und Speichern der
+        Zustände.
+        """
+        next_flush_s = time.monotonic() + self._flush_interval_s
+
+        while not self._stopped.wait(self._tick_s):
+            self._advance()
+
+            if time.monotonic() >= next_flush_s:
+                self._flush()
+                next_flush_s = time.monotonic() + self._flush_interval_s
@@ -0,0 +1,220 @@
+import array, logging, threading, time
+from collections import OrderedDict
+from datetime import datetime
+from simplelogger import metrics
+
+class DeviceState:
+    """
+    Zustand eines Devices für die `RuleEngine`: Die letzten N Abstände mit
+    Zeitstempel in einem kleinen Ringpuffer, ob gerade ein Alarm aktiv ist und
+    wann zuletzt eine Nachricht empfangen wurde. Dank `__slots__` und `array`
+    belegt ein Device nur wenige hundert Bytes.
+    """
+
+    __slots__ = ("distances", "times", "count", "alarm", "last_seen_s")
+
+    def __init__(self, window):
+        """
+        Konstruktor. Parameter ist die Anzahl der betrachteten Messwerte.
+        """
+        self.distances = array.array("d", bytes(8 * window))
+        self.times = array.array("d", bytes(8 * window))
+        self.count = 0
+        self.alarm = False
+        self.last_seen_s = 0.0
+
+    def add(self, distance_m, time_s):
+        """
+        Messwert hinzufügen. Rückgabewert ist die Änderungsrate in Metern je
+        Sekunde gegenüber dem ältesten Messwert im Fenster oder `None`, wenn der
+        Messwert älter als der zuletzt hinzugefügte ist, zum Beispiel weil er
+        nach einem Verbindungsabbruch nachgesendet wurde.
+        """
+        window = len(self.distances)
+
+        if self.count and time_s <= self.times[(self.count - 1) % window]:
+            return None
+
+        index = self.count % window
+        self.distances[index] = distance_m
+        self.times[index] = time_s
+        self.count += 1
+
+        oldest = self.count % window if self.count >= window else 0
+        duration_s = time_s - self.times[oldest]
+
+        return (distance_m - self.distances[oldest]) / duration_s if duration_s > 0 else 0.0
+
+class RuleEngine:
+    """
+    Handler-Klasse, die für jedes Device einzeln entscheidet, ob ein Alarm
+    ausgelöst werden muss, und das Kommando nur an dieses Device sendet. Ersetzt
+    den `AlarmHandler`, der alle Nachrichten aller Devices gemeinsam zählt und
+    jeden Alarm an alle Devices sendet.
+
+    Für jedes Device wird ein `DeviceState` mit den letzten Messwerten geführt
+    und bei jedem Messwert mit konstantem Aufwand fortgeschrieben, so dass die
+    Kosten je Nachricht nicht von der Anzahl der Devices abhängen. Folgende
+    Regeln werden ausgewertet:
+
+        * Abstand: Alarm, sobald der Abstand unter `alarm_distance` fällt. Er
+          endet erst, wenn der Abstand wieder um `hysteresis` darüber liegt.
+
+        * Änderungsrate: Alarm, solange sich ein Auto schneller als mit
+          `max_approach_speed` Metern je Sekunde nähert.
+
+        * Aktualität: Devices, die seit `stale_after` Sekunden keine Nachricht
+          mehr gesendet haben, werden im Log gemeldet und vergessen. Hierfür
+          werden die Devices nach dem Zeitpunkt ihrer letzten Nachricht sortiert
+          gehalten, so dass nur die tatsächlich veralteten Devices geprüft werden.
+          Ein noch aktiver Alarm wird dabei mit `ALARM_OFF` beendet.
+
+    Laufen mehrere Instanzen des SimpleLoggers mit gemeinsamem Abo, muss der
+    Broker die Nachrichten eines Devices immer an dieselbe Instanz zustellen
+    (bei EMQX `shared_subscription_strategy = hash_topic`).
+    """
+
+    # Vom Dispatcher nur für diese Kommandos aufrufen
+    commands = ("MEASUREMENT", "MEASUREMENT_BATCH", "MEASUREMENT_SUMMARY")
+
+    def __init__(self, commands, config):
+        """
+        Konstruktor. Benötigt im ersten Parameter den `CommandService`, um
+        Kommandos an die Devices senden zu können. Im zweiten Parameter muss ein
+        Konfigurationsobjekt mit folgenden Properties übergeben werden:
+
+            * alarm_distance: Abstand in Metern, unter dem Alarm ausgelöst wird (optional)
+            * hysteresis: Zusätzlicher Abstand in Metern zum Beenden des Alarms (optional)
+            * max_approach_speed: Maximale Annäherung in Metern je Sekunde, 0 = aus (optional)
+            * window: Anzahl der Messwerte für die Änderungsrate (optional)
+            * stale_after: Sekunden ohne Nachricht bis ein Device als veraltet gilt, 0 = aus (optional)
+        """
+        self._commands = commands
+        self._alarm_distance_m = float(config.get("alarm_distance", 0.1))
+        self._hysteresis_m = float(config.get("hysteresis", 0.05))
+        self._max_approach_m_s = float(config.get("max_approach_speed", 0))
+        self._window = int(config.get("window", 5))
+        self._stale_after_s = float(config.get("stale_after", 600))
+
+        # Devices in der Reihenfolge ihrer letzten Nachricht, älteste zuerst
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stale_thread = None
+
+        metrics.RULE_DEVICES.set_function(lambda: len(self._devices))
+
+        if self._stale_after_s > 0:
+            self._stale_thread = threading.Thread(target=self._stale_thread_main, daemon=True)
+            self._stale_thread.start()
+
+    def __call__(self, topic, message):
+        """
+        Verarbeitung einer via MQTT empfangenen Nachricht. Zusammenfassungen
+        zurückgehaltener Messwerte zählen nur als Lebenszeichen.
+
+        THREADING: Diese Methode läuft parallel in mehreren Worker-Threads des
+        Dispatchers. Da die Nachrichten eines Topics immer vom selben Worker
+        verarbeitet werden, greift auf den `DeviceState` eines Devices immer nur
+        ein Thread gleichzeitig zu. Nur die gemeinsame Liste der Devices ist
+        durch eine Sperre geschützt.
+        """
+        try:
+            command = message.get("command", "")
+        except AttributeError:
+            return
+
+        if command == "MEASUREMENT":
+            data = [message.get("data")]
+        elif command == "MEASUREMENT_BATCH":
+            data = message.get("data") or []
+        elif command == "MEASUREMENT_SUMMARY":
+            data = []
+        else:
+            return
+
+        with self._lock:
+            state = self._devices.get(topic)
+
+            if state is None:
+                state = self._devices[topic] = DeviceState(self._window)
+            else:
+                self._devices.move_to_end(topic)
+
+            state.last_seen_s = time.monotonic()
+
+        for d in data:
+            if isinstance(d, dict):
+                self._evaluate(topic, state, d)
+
+    def close(self):
+        """
+        Hintergrundthread zum Erkennen veralteter Devices beenden.
+        """
+        self._stopped.set()
+
+        if self._stale_thread is not None:
+            self._stale_thread.join()
+
+    def _evaluate(self, topic, state, data):
+        """
+        Regeln für einen einzelnen Messwert auswerten und bei einer Änderung
+        des Alarmzustands das passende Kommando an das Device senden.
+        """
+        try:
+            distance_m = float(data["distance_m"])
+            time_s = datetime.fromisoformat(data["datetime_iso"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return
+
+        rate_m_s = state.add(distance_m, time_s)
+
+        if rate_m_s is None:
+            return
+
+        approaching = self._max_approach_m_s > 0 and rate_m_s <= -self._max_approach_m_s
+
+        if not state.alarm:
+            if distance_m < self._alarm_distance_m or approaching:
+                state.alarm = True
+                logging.info(f"Löse Alarm für {topic} aus: {distance_m} m, {rate_m_s:.2f} m/s")
+                self._send(topic, "ALARM_ON")
+        elif distance_m > self._alarm_distance_m + self._hysteresis_m and not approaching:
+            state.alarm = False
+            logging.info(f"Beende Alarm für {topic}: {distance_m} m")
+            self._send(topic, "ALARM_OFF")
+
+    def _send(self, topic, command):
+        """
+        Kommando an das Device senden, von dem die Nachricht auf `topic` stammt.
+        """
+        metrics.RULE_COMMANDS.labels(command).inc()
+        self._commands.send(topic.rsplit("/", 1)[0], command)
+
+    def _stale_thread_main(self):
+        """
+        Hintergrundthread, der regelmäßig die Devices ohne aktuelle Nachricht
+        meldet und vergisst.
+        """
+        while not self._stopped.wait(min(self._stale_after_s / 4, 60)):
+            deadline_s = time.monotonic() - self._stale_after_s
+            stale = []
+
+            with self._lock:
+                while self._devices:
+                    topic, state = next(iter(self._devices.items()))
+
+                    if state.last_seen_s > deadline_s:
+                        break
+
+                    del self._devices[topic]
+                    stale.append((topic, state))
+
+            for topic, state in stale:
+                metrics.RULE_STALE_DEVICES.inc()
+                logging.warning(f"Keine Nachricht von {topic} seit mehr als {self._stale_after_s:.0f} s")
+
+                # Ein neuer Zustand beginnt ohne Alarm und würde ihn nie beenden
+                if state.alarm:
+                    logging.info(f"Beende Alarm für veraltetes Device {topic}")
+                    self._send(topic, "ALARM_OFF")
@@ -0,0 +1,297 @@
+import logging, mmap, os, struct, threading, time, zlib
+from simplelogger import metrics
+
+# Kopf eines Eintrags: Länge von Topic und Nutzdaten, CRC32 darüber, Länge des Topics
+_HEADER = struct.Struct("<IIH")
+
+class Journal:
+    """
+    Dauerhaftes Eingangsjournal für alle empfangenen Nachrichten. Jede Nachricht
+    wird noch im MQTT-Thread, also vor der Bestätigung an den Broker, unverändert
+    mit Topic und Nutzdaten angehängt. Der `MongoDBHandler` liest die Nachrichten
+    anschließend in seinem eigenen Tempo wieder aus und bestätigt mit `commit()`
+    die gespeicherten Einträge. Ist die Datenbank langsam oder nicht erreichbar,
+    wächst nur das Journal, während der Empfang ungebremst weiterläuft.
+
+    Das Journal besteht aus Segmenten fester Größe im Verzeichnis `directory`,
+    die per `mmap` in den Speicher eingeblendet werden. Ein Eintrag kostet so
+    nur eine Kopie in den Seitencache des Betriebssystems und übersteht damit
+    einen Absturz des Programms. Gegen Stromausfall werden die Segmente
+    zusätzlich alle `sync_interval` Sekunden auf die Platte geschrieben.
+
+    Die Leseposition wird nach jedem `commit()` in der Datei `checkpoint`
+    gespeichert. Vollständig gelesene Segmente werden dabei gelöscht, so dass
+    das Journal nur so groß wie der noch nicht gespeicherte Rückstand ist.
+    Höchstens `max_size` Bytes werden belegt, danach werden neue Nachrichten
+    verworfen. Beim Start wird nur das letzte Segment nach dem Ende des
+    letzten vollständigen Eintrags durchsucht, so dass der Neustart auch mit
+    großem Rückstand schnell geht.
+
+    THREADING: `append()` läuft im MQTT-Thread, `read()` und `commit()` im
+    Schreib-Thread des `MongoDBHandler`. Alle Zugriffe sind durch eine Sperre
+    geschützt, die nur für das Kopieren eines Eintrags gehalten wird.
+    """
+
+    def __init__(self, config):
+        """
+        Konstruktor. Im ersten Parameter muss ein Konfigurationsobjekt mit folgenden
+        Properties übergeben werden:
+
+            * directory: Verzeichnis für die Segmente
+            * segment_size: Größe eines Segments in MiB (optional)
+            * max_size: Maximale Größe aller Segmente in MiB (optional)
+            * sync_interval: Sekunden zwischen zwei Schreibvorgängen auf die Platte,
+              0 = dem Betriebssystem überlassen (optional)
+        """
+        self._directory = config["directory"]
+        self._segment_size = int(float(config.get("segment_size", 16)) * 1024 * 1024)
+        self._max_segments = max(2, int(float(config.get("max_size", 1024)) * 1024 * 1024) // self._segment_size)
+        self._sync_interval_s = float(config.get("sync_interval", 1.0))
+        self._last_sync_s = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._dropped = 0
+
+        os.makedirs(self._directory, exist_ok=True)
+        self._recover()
+
+        metrics.JOURNAL_BACKLOG.set_function(self.backlog)
+        metrics.JOURNAL_SEGMENTS.set_function(lambda: self._write_segment - self._read_segment + 1)
+
+    def append(self, topic, payload):
+        """
+        Nachricht anhängen. Rückgabewert ist `False`, wenn das Journal voll ist
+        oder die Nachricht nicht in ein Segment passt.
+
+        THREADING: Diese Methode läuft im MQTT-Thread.
+        """
+        topic = topic.encode()
+        length = len(topic) + len(payload)
+        size = _HEADER.size + length
+
+        with self._lock:
+            if self._write_offset + size > self._segment_size and not self._roll(size):
+                self._dropped += 1
+                metrics.JOURNAL_DROPPED.inc()
+                return False
+
+            segment = self._maps[self._write_segment]
+            start = self._write_offset + _HEADER.size
+
+            segment[start:start + len(topic)] = topic
+            segment[start + len(topic):start + length] = payload
+            _HEADER.pack_into(segment, self._write_offset, length, zlib.crc32(payload, zlib.crc32(topic)), len(topic))
+
+            self._write_offset += size
+
+        return True
+
+    def read(self, max_count):
+        """
+        Höchstens `max_count` Nachrichten ab der Leseposition lesen. Rückgabewert
+        ist eine Liste mit Tupeln aus Topic und Nutzdaten sowie die Position nach
+        der letzten Nachricht, die nach dem Speichern an `commit()` übergeben
+        werden muss. Die Leseposition selbst ändert sich erst mit `commit()`.
+
+        THREADING: Diese Methode läuft im Schreib-Thread des `MongoDBHandler`.
+        """
+        self._sync()
+
+        messages = []
+
+        with self._lock:
+            segment, offset = self._read_segment, self._read_offset
+
+            while len(messages) < max_count:
+                if segment == self._write_segment and offset >= self._write_offset:
+                    break
+
+                entry = self._entry(segment, offset)
+
+                if entry is None:
+                    if segment == self._write_segment:
+                        break
+
+                    # Rest des Segments ist leer oder beschädigt, weiter mit dem nächsten
+                    segment, offset = segment + 1, 0
+                    continue
+
+                topic, payload, size = entry
+                messages.append((topic, payload))
+                offset += size
+
+        return messages, (segment, offset)
+
+    def commit(self, position):
+        """
+        Alle Nachrichten vor der von `read()` gelieferten Position als gespeichert
+        markieren, die Position dauerhaft merken und vollständig gelesene Segmente
+        löschen.
+
+        THREADING: Diese Methode läuft im Schreib-Thread des `MongoDBHandler`.
+        """
+        segment, offset = position
+
+        checkpoint = os.path.join(self._directory, "checkpoint")
+
+        with open(checkpoint + ".tmp", "w") as file:
+            file.write(f"{segment} {offset}\n")
+
+        os.replace(checkpoint + ".tmp", checkpoint)
+
+        with self._lock:
+            obsolete = range(self._read_segment, segment)
+            self._read_segment, self._read_offset = segment, offset
+
+            for number in obsolete:
+                self._close_segment(number)
+
+        for number in obsolete:
+            try:
+                os.remove(self._path(number))
+            except FileNotFoundError:
+                pass
+
+    def backlog(self):
+        """
+        Anzahl der Bytes, die noch nicht mit `commit()` bestätigt wurden.
+        """
+        segments = self._write_segment - self._read_segment
+        return segments * self._segment_size + self._write_offset - self._read_offset
+
+    def close(self):
+        """
+        Alle Segmente auf die Platte schreiben und schließen.
+        """
+        with self._lock:
+            for number in list(self._maps):
+                self._maps[number].flush()
+                self._close_segment(number)
+
+    def _recover(self):
+        """
+        Zustand beim Start wiederherstellen: Leseposition aus der Datei
+        `checkpoint`, Schreibposition hinter dem letzten vollständigen Eintrag
+        im letzten Segment. Ein beim Absturz nur teilweise geschriebener
+        Eintrag wird dabei verworfen.
+        """
+        numbers = sorted(int(name.split(".")[0]) for name in os.listdir(self._directory) if name.endswith(".journal"))
+
+        try:
+            with open(os.path.join(self._directory, "checkpoint")) as file:
+                self._read_segment, self._read_offset = (int(value) for value in file.read().split())
+        except FileNotFoundError:
+            self._read_segment, self._read_offset = (numbers[0] if numbers else 0), 0
+
+        for number in numbers:
+            if number < self._read_segment:
+                os.remove(self._path(number))
+
+        numbers = [number for number in numbers if number >= self._read_segment]
+
+        if not numbers:
+            self._write_segment, self._write_offset = self._read_segment, self._read_offset
+            self._open_segment(self._write_segment, create=True)
+            return
+
+        self._write_segment = numbers[-1]
+        self._write_offset = self._read_offset if self._write_segment == self._read_segment else 0
+        self._open_segment(self._write_segment)
+
+        while True:
+            entry = self._entry(self._write_segment, self._write_offset)
+
+            if entry is None:
+                break
+
+            self._write_offset += entry[2]
+
+        segment = self._maps[self._write_segment]
+        segment[self._write_offset:] = bytes(self._segment_size - self._write_offset)
+
+        logging.info(f"Journal in {self._directory} geöffnet, {self.backlog()} Bytes noch nicht gespeichert")
+
+    def _roll(self, size):
+        """
+        Nächstes Segment beginnen, falls die Nachricht in ein leeres Segment
+        passt und die maximale Größe des Journals noch nicht erreicht ist.
+        """
+        if size > self._segment_size:
+            logging.warning(f"Nachricht mit {size} Bytes passt nicht ins Journal")
+            return False
+
+        if self._write_segment - self._read_segment + 1 >= self._max_segments:
+            if self._dropped % 1000 == 0:
+                logging.warning(f"Journal voll, verwerfe Nachrichten (bisher {self._dropped + 1} verworfen)")
+
+            return False
+
+        if self._sync_interval_s:
+            self._maps[self._write_segment].flush()
+
+        if self._write_segment != self._read_segment:
+            self._close_segment(self._write_segment)
+
+        self._write_segment += 1
+        self._write_offset = 0
+        self._open_segment(self._write_segment, create=True)
+        return True
+
+    def _entry(self, number, offset):
+        """
+        Eintrag an der übergebenen Position lesen. Rückgabewert ist ein Tupel
+        aus Topic, Nutzdaten und Größe des Eintrags oder `None`, wenn an dieser
+        Stelle kein vollständiger Eintrag steht.
+        """
+        segment = self._maps.get(number) or self._open_segment(number)
+
+        if offset + _HEADER.size > self._segment_size:
+            return None
+
+        length, crc, topic_length = _HEADER.unpack_from(segment, offset)
+        start = offset + _HEADER.size
+
+        if length == 0 or start + length > self._segment_size:
+            return None
+
+        data = segment[start:start + length]
+
+        if zlib.crc32(data) != crc:
+            return None
+
+        return data[:topic_length].decode(), data[topic_length:], _HEADER.size + length
+
+    def _path(self, number):
+        return os.path.join(self._directory, f"{number:010d}.journal")
+
+    def _open_segment(self, number, create=False):
+        """
+        Segment einblenden und bei Bedarf als leere Datei anlegen.
+        """
+        with open(self._path(number), "w+b" if create else "r+b") as file:
+            if create:
+                file.truncate(self._segment_size)
+
+            self._maps[number] = mmap.mmap(file.fileno(), self._segment_size)
+
+        return self._maps[number]
+
+    def _close_segment(self, number):
+        segment = self._maps.pop(number, None)
+
+        if segment is not None:
+            segment.close()
+
+    def _sync(self):
+        """
+        Segment mit der Schreibposition auf die Platte schreiben, wenn seit dem
+        letzten Mal `sync_interval` Sekunden vergangen sind.
+        """
+        if not self._sync_interval_s or time.monotonic() - self._last_sync_s < self._sync_interval_s:
+            return
+
+        with self._lock:
+            self._maps[self._write_segment].flush()
+
+        self._last_sync_s = time.monotonic()
@@ -0,0 +1,89 @@
+import paho.mqtt.client as mqtt
+import json, logging
+
+class LoopbackMQTT:
+    """
+    Ersatz für die Klasse `MQTT`, der ohne MQTT-Broker auskommt. Nachrichten
+    werden mit `publish()` direkt im selben Prozess an den `Dispatcher`
+    übergeben, so als wären sie vom Broker empfangen worden. Broadcasts an
+    die Devices und mit `send()` an einzelne Topics gesendete Nachrichten
+    werden an die mit `subscribe()` registrierten Callbacks übergeben.
+
+    Dadurch lässt sich die gesamte Verarbeitung der Nachrichten inklusive
+    Dispatcher und Handler testen und vermessen, ohne dass die Messung vom
+    Netzwerk oder Broker verfälscht wird.
+    """
+
+    def __init__(self, dispatcher, journal=None):
+        """
+        Konstruktor. Der Parameter ist der `Dispatcher`, der die Nachrichten an
+        die Handler verteilt. Optional kann wie bei der Klasse `MQTT` ein
+        `Journal` übergeben werden.
+        """
+        self._dispatcher = dispatcher
+        self._journal = journal
+        self._subscribers = []
+        self.dropped = 0
+
+    def add_handler(self, handler):
+        """
+        Fügt einen weiteren Handler zum Verarbeiten der Nachrichten hinzu.
+        """
+        self._dispatcher.add_handler(handler)
+
+    def publish(self, topic, payload):
+        """
+        Nachricht eines Devices einspeisen. Rückgabewert ist `False`, wenn die
+        Nachricht wegen einer vollen Warteschlange verworfen wurde.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        if self._journal is not None:
+            self._journal.append(topic, payload)
+
+        if self._dispatcher.submit(topic, payload):
+            return True
+
+        self.dropped += 1
+        return False
+
+    def subscribe(self, callback, topic=None):
+        """
+        Callback registrieren, der jede Broadcast-Meldung als Dictionary erhält.
+        Wird ein Topic angegeben, erhält er stattdessen alle mit `send()` an
+        dieses Topic gesendeten Nachrichten. Das Topic darf Wildcards enthalten.
+        """
+        self._subscribers.append((topic, callback))
+
+    def broadcast(self, message):
+        """
+        Sendet eine Broadcast-Meldung an alle registrierten Callbacks.
+        """
+        self._deliver(None, message)
+
+    def send(self, topic, message, qos=0):
+        """
+        Sendet eine Nachricht an alle Callbacks, die das Topic aboniert haben.
+        """
+        self._deliver(topic, message)
+
+    def _deliver(self, topic, message):
+        payload = json.loads(json.dumps(message))
+
+        for subscription, callback in self._subscribers:
+            if subscription == topic or (subscription and topic and mqtt.topic_matches_sub(subscription, topic)):
+                callback(payload)
+
+    def stats(self):
+        """
+        Statistik des Dispatchers.
+        """
+        return self._dispatcher.stats()
+
+    def close(self):
+        """
+        Alle noch wartenden Nachrichten verarbeiten und alle Handler beenden.
+        """
+        logging.info("Beende Loopback-Verbindung")
+        self._dispatcher.close()
@@ -1,7 +1,15 @@
 import configparser, logging, os, time
-from simplelogger.mqtt import MQTT
+from simplelogger import metrics
+from simplelogger.commands import CommandService
+from simplelogger.coordination import MongoCounter
+from simplelogger.dispatcher import Dispatcher
+from simplelogger.journal import Journal
+from simplelogger.mqtt import MQTT, shared_group
+from simplelogger.query import QueryService
 from simplelogger.handlers.alarm import AlarmHandler
 from simplelogger.handlers.mongodb import MongoDBHandler
+from simplelogger.handlers.presence import PresenceTracker
+from simplelogger.handlers.rules import RuleEngine
 
 def main():
     """
@@ -24,10 +32,118 @@ def main():
     config = configparser.ConfigParser(interpolation=None)
     config.read(configfile)
 
+    # Metriken für Prometheus bereitstellen
+    if config.getboolean("metrics", "enable", fallback=False):
+        metrics.start_http_server(config["metrics"])
+
+    # Abfrageschnittstelle starten
+    query_service = None
+
+    if config.getboolean("query", "enable", fallback=False):
+        query_service = QueryService(config["mongodb"], config["query"])
+        query_service.start()
+
+    # Betriebsart auswählen
+    mode = os.getenv("SIMPLELOGGER_MODE") or config.get("main", "mode", fallback="threads")
+
+    try:
+        if mode == "asyncio":
+            main_asyncio(config)
+        else:
+            main_threads(config)
+    finally:
+        if query_service is not None:
+            query_service.close()
+
+def main_threads(config):
+    """
+    Klassische Betriebsart: Die MQTT-Bibliothek empfängt die Nachrichten in
+    ihrem eigenen Thread und ein Pool von Worker-Threads verarbeitet sie.
+    """
+    # Eingangsjournal für Ausfälle der Datenbank
+    journal = None
+
+    if config.getboolean("journal", "enable", fallback=False):
+        journal = Journal(config["journal"])
+
     # MQTT Handling konfigurieren
-    mqtt = MQTT(config["mqtt"])
+    mqtt = MQTT(config["mqtt"], Dispatcher(config["dispatcher"]), journal)
+    commands = CommandService(mqtt, section(config, "commands"))
+
+    mqtt.add_handler(commands)
+    mqtt.add_handler(alarm_handler(mqtt, commands, config))
+    mqtt.add_handler(MongoDBHandler(config["mongodb"], journal))
+
+    if config.getboolean("presence", "enable", fallback=False):
+        mqtt.add_handler(PresenceTracker(config["presence"], config["mongodb"]))
+
+    try:
+        mqtt.loop_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mqtt.close()
+
+def main_asyncio(config):
+    """
+    Alternative Betriebsart: Empfang und Verarbeitung der Nachrichten laufen
+    gemeinsam in einer asyncio Event Loop. Benötigt die zusätzlichen Pakete
+    `aiomqtt` und `motor`.
+    """
+    from simplelogger.async_mqtt import AsyncMQTT
+    from simplelogger.handlers.mongodb_async import AsyncMongoDBHandler
+
+    logging.info("Benutze asyncio für den Nachrichtenempfang")
+
+    if config.getboolean("journal", "enable", fallback=False):
+        logging.warning("Das Journal wird nur in der Betriebsart threads unterstützt")
+
+    mqtt = AsyncMQTT(config["mqtt"], config["dispatcher"])
+    commands = CommandService(mqtt, section(config, "commands"))
+
+    mqtt.add_handler(commands)
+    mqtt.add_handler(alarm_handler(mqtt, commands, config))
+    mqtt.add_handler(AsyncMongoDBHandler(config["mongodb"]))
+
+    if config.getboolean("presence", "enable", fallback=False):
+        mqtt.add_handler(PresenceTracker(config["presence"], config["mongodb"]))
+
+    try:
+        mqtt.loop_forever()
+    except KeyboardInterrupt:
+        pass
+
+def alarm_handler(mqtt, commands, config):
+    """
+    Handler zum Auslösen der Alarme erzeugen. Standardmäßig ist dies die
+    `RuleEngine`, die jedes Device einzeln bewertet und die Alarme über den
+    `CommandService` sendet. Mit `enable = False` im Abschnitt `[rules]` wird
+    wieder der einfache `AlarmHandler` mit Broadcasts verwendet.
+    """
+    if config.getboolean("rules", "enable", fallback=True):
+        return RuleEngine(commands, section(config, "rules"))
+
+    return AlarmHandler(mqtt, alarm_counter(config))
+
+def section(config, name):
+    """
+    Abschnitt der Konfigurationsdatei oder ein leeres Dictionary, wenn er
+    fehlt, so dass überall die Standardwerte gelten.
+    """
+    return config[name] if config.has_section(name) else {}
+
+def alarm_counter(config):
+    """
+    Zähler für den `AlarmHandler` erzeugen. Teilen sich mehrere Instanzen die
+    Nachrichten über ein gemeinsames Abo, wird ein in der Datenbank liegender
+    Zähler benötigt, damit der Alarm nicht von jeder Instanz ausgelöst wird.
+    Ansonsten genügt der lokale Standardzähler.
+    """
+    group = shared_group(config["mqtt"])
 
-    mqtt.add_handler(AlarmHandler(mqtt))
-    mqtt.add_handler(MongoDBHandler(config["mongodb"]))
+    if not group:
+        return None
 
-    mqtt.loop_forever()
\ No newline at end of file
+    logging.info(f"Betrieb im Cluster mit der Gruppe {group}")
+    block_size = int(config["mongodb"].get("counter_block_size", 1))
+    return MongoCounter(config["mongodb"], f"alarm_counter_{group}", block_size)
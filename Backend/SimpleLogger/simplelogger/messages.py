@@ -0,0 +1,244 @@
+import re
+
+# Markierung für fehlende Werte in `Message.__getitem__()`
+_MISSING = object()
+
+class Message:
+    """
+    Einmal geprüfte, empfangene Nachricht mit Topic, Kommando und Nutzdaten.
+    Wird vom Dispatcher anstelle des dekodierten Dictionaries an die Handler
+    übergeben. Über `get()` und `[]` lässt sich ein `Message`-Objekt wie das
+    bisherige Dictionary mit den Schlüsseln `command` und `data` lesen, so
+    dass Handler und Funktionen wie `MongoDBHandler.to_documents()` mit
+    beidem umgehen können.
+    """
+
+    __slots__ = ("topic", "command", "data")
+
+    def __init__(self, topic, command, data=None):
+        self.topic = topic
+        self.command = command
+        self.data = data
+
+    def get(self, key, default=None):
+        """
+        Kommando oder Nutzdaten wie bei einem Dictionary lesen.
+        """
+        if key == "command":
+            return self.command
+
+        if key == "data" and self.data is not None:
+            return self.data
+
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+
+        if value is _MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def to_dict(self):
+        """
+        Nachricht als Dictionary wie vom Modul `codec` geliefert.
+        """
+        result = {"command": self.command}
+
+        if self.data is not None:
+            result["data"] = self.data
+
+        return result
+
+    def __repr__(self):
+        return f"Message(topic={self.topic!r}, command={self.command!r}, data={self.data!r})"
+
+def _check_measurement(data):
+    """
+    Einzelner Messwert mit numerischem Abstand und Zeitstempel als Text. Die
+    Typen werden mit `type()` statt `isinstance()` verglichen, da dies im
+    Dispatcher für jeden Messwert läuft und `bool` ausgeschlossen sein muss.
+    """
+    if type(data) is not dict:
+        raise ValueError("Messwert ist kein Objekt")
+
+    distance_m = data.get("distance_m")
+
+    if type(distance_m) is not float and type(distance_m) is not int:
+        raise ValueError("Messwert ohne gültigen Abstand")
+
+    if type(data.get("datetime_iso")) is not str:
+        raise ValueError("Messwert ohne gültigen Zeitstempel")
+
+def _check_batch(data):
+    """
+    Liste einzelner Messwerte.
+    """
+    if type(data) is not list:
+        raise ValueError("Messwerte sind keine Liste")
+
+    for d in data:
+        _check_measurement(d)
+
+def _check_summary(data):
+    """
+    Zusammenfassung zurückgehaltener Messwerte.
+    """
+    if type(data) is not dict:
+        raise ValueError("Zusammenfassung ist kein Objekt")
+
+def _check_window(data):
+    """
+    Statistik eines Zeitfensters mit Anzahl und Zeitraum.
+    """
+    if type(data) is not dict:
+        raise ValueError("Zeitfenster ist kein Objekt")
+
+    if type(data.get("count")) is not int:
+        raise ValueError("Zeitfenster ohne gültige Anzahl")
+
+    if type(data.get("start_iso")) is not str or type(data.get("end_iso")) is not str:
+        raise ValueError("Zeitfenster ohne gültigen Zeitraum")
+
+# Prüfung der Nutzdaten je Kommando. Andere Kommandos werden ohne Prüfung übernommen.
+SCHEMAS = {
+    "MEASUREMENT": _check_measurement,
+    "MEASUREMENT_BATCH": _check_batch,
+    "MEASUREMENT_SUMMARY": _check_summary,
+    "MEASUREMENT_WINDOW": _check_window,
+}
+
+def parse(topic, message):
+    """
+    Dekodierte Nachricht (Dictionary) prüfen und in ein `Message`-Objekt
+    umwandeln. Löst einen `ValueError` aus, wenn die Nachricht kein Kommando
+    besitzt oder ihre Nutzdaten nicht zum Kommando passen.
+    """
+    if type(message) is not dict:
+        raise ValueError("Nachricht ist kein Objekt")
+
+    command = message.get("command")
+
+    if type(command) is not str or not command:
+        raise ValueError("Nachricht ohne Kommando")
+
+    data = message.get("data")
+    check = SCHEMAS.get(command)
+
+    if check is not None:
+        check(data)
+
+    return Message(topic, command, data)
+
+def compile_topic_filter(topic_filter):
+    """
+    MQTT-Topicfilter mit den Platzhaltern `+` und `#` in einen regulären
+    Ausdruck übersetzen, der nur einmal kompiliert werden muss.
+    """
+    parts = []
+
+    for level in topic_filter.split("/"):
+        if level == "+":
+            parts.append("[^/]*")
+        elif level == "#":
+            parts.append("#")
+        else:
+            parts.append(re.escape(level))
+
+    pattern = "/".join(parts)
+
+    # "a/#" passt laut MQTT-Standard auch auf "a" selbst
+    if pattern == "#":
+        pattern = ".*"
+    elif pattern.endswith("/#"):
+        pattern = pattern[:-2] + "(/.*)?"
+
+    return re.compile(pattern + r"\Z")
+
+class Router:
+    """
+    Verteilung der Nachrichten an die Handler über eine vorab berechnete
+    Tabelle. Ein Handler kann mit zwei optionalen Attributen festlegen,
+    welche Nachrichten er erhalten möchte:
+
+        * commands: Liste der Kommandos, zum Beispiel `("MEASUREMENT",)`
+        * topics: Liste von MQTT-Topicfiltern, zum Beispiel `("+/+/status",)`
+
+    Fehlt ein Attribut, erhält der Handler alle Kommandos bzw. Topics. Die
+    Tabelle ordnet jedem Kommando die zuständigen Handler in der Reihenfolge
+    ihrer Registrierung zu und wird bei jedem neuen Handler neu berechnet.
+    Filtert kein Handler nach Topics, kostet die Suche nur einen Zugriff auf
+    ein Dictionary. Ansonsten wird das Ergebnis zusätzlich je Kommando und
+    Topic zwischengespeichert.
+
+    THREADING: `route()` darf parallel in mehreren Threads aufgerufen werden.
+    Handler müssen vor dem Start der Verarbeitung registriert werden.
+    """
+
+    # Maximale Anzahl zwischengespeicherter Kombinationen aus Kommando und Topic
+    CACHE_SIZE = 100000
+
+    def __init__(self):
+        self._routes = []
+        self._table = {}
+        self._default = ()
+        self._filtered = False
+        self._cache = {}
+
+    def add(self, handler, *extra):
+        """
+        Handler registrieren. Weitere Parameter werden mit dem Handler als
+        Tupel von `route()` zurückgegeben, zum Beispiel die Metrik für die
+        Verarbeitungszeit.
+        """
+        commands = getattr(handler, "commands", None)
+        topics = getattr(handler, "topics", None)
+
+        self._routes.append((
+            None if commands is None else frozenset(commands),
+            None if topics is None else [compile_topic_filter(t) for t in topics],
+            (handler, *extra),
+        ))
+
+        self._compile()
+
+    def route(self, message):
+        """
+        Tupel mit den für die Nachricht zuständigen Einträgen aus `add()`.
+        """
+        if not self._filtered:
+            return self._table.get(message.command, self._default)
+
+        key = (message.command, message.topic)
+        entries = self._cache.get(key)
+
+        if entries is None:
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache = {}
+
+            entries = self._cache[key] = tuple(
+                entry for commands, topics, entry in self._routes
+                if (commands is None or message.command in commands)
+                and (topics is None or any(t.match(message.topic) for t in topics))
+            )
+
+        return entries
+
+    def _compile(self):
+        """
+        Tabelle der Handler je Kommando neu berechnen.
+        """
+        commands = set()
+
+        for accepted, topics, entry in self._routes:
+            commands.update(accepted or ())
+
+        self._table = {
+            command: tuple(entry for accepted, topics, entry in self._routes if accepted is None or command in accepted)
+            for command in commands
+        }
+
+        self._default = tuple(entry for accepted, topics, entry in self._routes if accepted is None)
+        self._filtered = any(topics is not None for accepted, topics, entry in self._routes)
+        self._cache = {}
@@ -0,0 +1,113 @@
+# Vgl. https://prometheus.github.io/client_python/
+
+import logging
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+class _NoMetric:
+    """
+    Ersatz für alle Metriken, wenn `prometheus_client` nicht installiert ist.
+    Alle Methoden tun nichts, so dass die Messpunkte im Code unverändert
+    bleiben können.
+    """
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, function):
+        pass
+
+    def observe(self, value):
+        pass
+
+def counter(name, documentation, labels=()):
+    """
+    Zähler anlegen, der nur steigen kann.
+    """
+    return prometheus_client.Counter(name, documentation, labels) if prometheus_client else _NoMetric()
+
+def gauge(name, documentation, labels=()):
+    """
+    Messwert anlegen, der steigen und fallen kann.
+    """
+    return prometheus_client.Gauge(name, documentation, labels) if prometheus_client else _NoMetric()
+
+def histogram(name, documentation, labels=(), buckets=None):
+    """
+    Histogramm für Dauern oder Größen anlegen, optional mit eigenen Grenzen.
+    """
+    if not prometheus_client:
+        return _NoMetric()
+
+    if buckets is None:
+        return prometheus_client.Histogram(name, documentation, labels)
+
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+# Empfang und Verteilung der Nachrichten (Dispatcher)
+MESSAGES_RECEIVED = counter("simplelogger_messages_received_total", "Empfangene Nachrichten je Topic", ["topic"])
+MESSAGES_DROPPED  = counter("simplelogger_messages_dropped_total", "Wegen voller Warteschlange verworfene Nachrichten")
+MESSAGES_INVALID  = counter("simplelogger_messages_invalid_total", "Wegen ungültigem Format oder Inhalt verworfene Nachrichten")
+QUEUE_DEPTH       = gauge("simplelogger_queue_depth", "Wartende Nachrichten in allen Warteschlangen des Dispatchers")
+HANDLER_SECONDS   = histogram("simplelogger_handler_seconds", "Verarbeitungszeit einer Nachricht je Handler", ["handler"],
+                              buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+
+# Speichern in der Datenbank (MongoDBHandler)
+DB_BATCH_SIZE     = histogram("simplelogger_db_batch_size", "Anzahl Dokumente je Schreibvorgang",
+                              buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+DB_WRITE_SECONDS  = histogram("simplelogger_db_write_seconds", "Dauer eines Schreibvorgangs je Collection", ["collection"])
+DB_DROPPED        = counter("simplelogger_db_dropped_total", "Wegen vollem Puffer nicht gespeicherte Messwerte")
+DB_RETRIES        = counter("simplelogger_db_retries_total", "Wegen eines Datenbankfehlers wiederholte Schreibvorgänge")
+
+# Eingangsjournal (Journal)
+JOURNAL_BACKLOG   = gauge("simplelogger_journal_backlog_bytes", "Noch nicht in der Datenbank gespeicherte Bytes im Journal")
+JOURNAL_SEGMENTS  = gauge("simplelogger_journal_segments", "Anzahl der Segmentdateien des Journals")
+JOURNAL_DROPPED   = counter("simplelogger_journal_dropped_total", "Wegen vollem Journal verworfene Nachrichten")
+
+# Regeln je Device (RuleEngine)
+RULE_DEVICES       = gauge("simplelogger_rule_devices", "Anzahl der Devices mit Zustand in der RuleEngine")
+RULE_COMMANDS      = counter("simplelogger_rule_commands_total", "Von der RuleEngine gesendete Kommandos", ["command"])
+RULE_STALE_DEVICES = counter("simplelogger_rule_stale_devices_total", "Devices, die keine Nachrichten mehr senden")
+
+# Kommandos an Devices und Gruppen (CommandService)
+COMMANDS_SENT      = counter("simplelogger_commands_sent_total", "Gesendete Kommandos je Ziel (device oder group)", ["scope"])
+COMMANDS_COALESCED = counter("simplelogger_commands_coalesced_total", "Mit einem laufenden Kommando zusammengefasste Kommandos")
+COMMANDS_RETRIED   = counter("simplelogger_commands_retried_total", "Wegen fehlender Bestätigung wiederholte Kommandos je Device")
+COMMANDS_FAILED    = counter("simplelogger_commands_failed_total", "Auch nach allen Wiederholungen unbestätigte Kommandos je Device")
+COMMANDS_PENDING   = gauge("simplelogger_commands_pending", "Kommandos mit ausstehenden Bestätigungen")
+COMMAND_ACK_SECONDS = histogram("simplelogger_command_ack_seconds", "Zeit vom Senden eines Kommandos bis zur Bestätigung je Device")
+
+# Anwesenheit der Devices (PresenceTracker)
+PRESENCE_ONLINE    = gauge("simplelogger_presence_online", "Anzahl der Devices, die gerade online sind")
+PRESENCE_EVENTS    = counter("simplelogger_presence_events_total", "Gemeldete Wechsel zwischen online und offline", ["event"])
+
+def handler_name(handler):
+    """
+    Name eines Handlers für die Metriken. Verpackte Handler können ihren Namen
+    über ein Attribut `name` angeben, ansonsten wird der Klassenname verwendet.
+    """
+    return getattr(handler, "name", type(handler).__name__)
+
+def start_http_server(config):
+    """
+    HTTP-Schnittstelle für Prometheus in einem Hintergrundthread starten. Das
+    Konfigurationsobjekt enthält die Properties `host` und `port` (optional).
+    Die Metriken können dann unter `http://<host>:<port>/metrics` abgerufen
+    werden.
+    """
+    if not prometheus_client:
+        logging.warning("Metriken sind aktiviert, aber prometheus_client ist nicht installiert")
+        return
+
+    host, port = config.get("host", "0.0.0.0"), int(config.get("port", 9100))
+    logging.info(f"Starte Metrik-Schnittstelle auf {host}, Port {port}")
+    prometheus_client.start_http_server(port, addr=host)
@@ -1,7 +1,7 @@
 # Vgl. https://pypi.org/project/paho-mqtt/
 
 import paho.mqtt.client as mqtt
-import  json, logging, ssl, traceback
+import  json, logging, os, ssl
 
 class MQTT:
     """
@@ -9,9 +9,9 @@ class MQTT:
     der Devices und ruft damit verschiedene Handler zum Verarbeiten auf.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, dispatcher, journal=None):
         """
-        Konstruktor. Im zweiten Parameter muss ein Konfigurationsobjekt mit folgenden
+        Konstruktor. Im ersten Parameter muss ein Konfigurationsobjekt mit folgenden
         Properties übergeben werden:
 
             * host: Hostname oder IP-Adresse des Servers
@@ -22,13 +22,22 @@ class MQTT:
             * tls_enable: Verschlüsselte Verbindung zulassen (optional)
             * topic_send: Topic zum Senden von Broadcasts an die Devices
             * topic_recieve: Topic zum Empfangen von Messwerten aus dem Backend
+            * shared_group: Name der Gruppe für gemeinsame Abos (optional)
+            * log_every: Nur jede N-te empfangene Nachricht loggen, 0 = keine (optional)
+            * qos: QoS des Abos, mit 1 bestätigt der SimpleLogger jede Nachricht (optional)
 
-        Der erste Parameter ist das `Device`-Objekt zu dem der Handler gehört. Wird
-        benötigt, um in den MQTT-Threads auf das Device zugreifen zu können.
+        Der zweite Parameter ist der `Dispatcher`, der die empfangenen Nachrichten
+        außerhalb des MQTT-Threads an die Handler verteilt.
+
+        Optional kann im dritten Parameter ein `Journal` übergeben werden, in das
+        jede Nachricht vor der Weitergabe an den Dispatcher geschrieben wird.
         """
-        self._handlers = []
+        self._dispatcher = dispatcher
+        self._journal = journal
 
         self._config = config
+        self._log_every = int(config.get("log_every", 1))
+        self._received = 0
         self._connected = False
 
         self._mqtt = mqtt.Client()
@@ -36,8 +45,9 @@ class MQTT:
         self._mqtt.on_disconnect = self._on_disconnect
         self._mqtt.on_message    = self._on_message
 
-        logging.info(f"Stelle Verbindung zum MQTT-Server her: {config['host']}, Port {config['port']}")
-        self._mqtt.connect(host=config["host"], port=int(config["port"]), keepalive=int(config["keepalive"]))
+        host = os.getenv("MQTT_HOST") or config["host"]
+        logging.info(f"Stelle Verbindung zum MQTT-Server her: {host}, Port {config['port']}")
+        self._mqtt.connect(host=host, port=int(config["port"]), keepalive=int(config["keepalive"]))
 
         if config.get("tls_enable", False):
             logging.info("Aktiviere TLS-Verschlüsselung für die MQTT-Kommunikation")
@@ -54,6 +64,16 @@ class MQTT:
         """
         self._mqtt.loop_forever()
 
+    def close(self):
+        """
+        Verbindung zum MQTT-Broker trennen, alle noch wartenden Nachrichten
+        verarbeiten und alle Handler beenden, die hierfür eine Methode `close()`
+        besitzen. Dies ermöglicht es den Handlern, noch gepufferte Daten vor dem
+        Programmende zu speichern.
+        """
+        self._mqtt.disconnect()
+        self._dispatcher.close()
+
     def add_handler(self, handler):
         """
         Fügt einen weiteren Handler zum Verarbeiten der via MQTT emfpangenen
@@ -63,15 +83,22 @@ class MQTT:
             * Name des Topics
             * Empfangene Nachricht
         """
-        self._handlers.append(handler)
+        self._dispatcher.add_handler(handler)
     
     def broadcast(self, message):
         """
         Sendet eine Broadcast-Meldung an alle Devices.
         """
+        self.send(self._config["topic_send"], message)
+
+    def send(self, topic, message, qos=0):
+        """
+        Sendet eine Nachricht an ein einzelnes Topic, zum Beispiel an das
+        Kommando-Topic eines bestimmten Devices.
+        """
         self._mqtt.publish(
-            qos = 0,
-            topic = self._config["topic_send"],
+            qos = qos,
+            topic = topic,
             payload = json.dumps(message)
         )
 
@@ -98,8 +125,9 @@ class MQTT:
 
         if rc == 0:
             self._connected = True
-            logging.info(f"Aboniere MQTT-Topic {self._config['topic_receive']}")
-            self._mqtt.subscribe(self._config["topic_receive"])
+            topic = subscription_topic(self._config)
+            logging.info(f"Aboniere MQTT-Topic {topic}")
+            self._mqtt.subscribe(topic, qos=int(self._config.get("qos", 0)))
         else:
             self._connected = False
 
@@ -114,20 +142,47 @@ class MQTT:
 
     def _on_message(self, client, userdata, message):
         """
-        Wertet ein über MQTT empfangenes Kommando zur Fernsteuerung des Devices aus
-        und führt die jeweilige Aktion direkt aus.
+        Reicht eine über MQTT empfangene Nachricht an den Dispatcher weiter,
+        der sie in einem anderen Thread dekodiert und an die Handler verteilt.
+        Mit Journal wird sie vorher dort angehängt. Da die Bibliothek eine
+        Nachricht mit QoS 1 erst nach dieser Methode bestätigt, kann sie danach
+        nicht mehr verloren gehen.
 
         THREADING: Diese Methode läuft im MQTT-Thread.
         """
-        logging.info(f"Empfange Nachricht: {message.payload}")
-
-        payload = json.loads(message.payload)
-        
-        for handler in self._handlers:
-            try:
-                handler(message.topic, payload)
-            except KeyboardInterrupt:
-                self._mqtt.disconnect()
-                return
-            except:
-                traceback.print_exc()
\ No newline at end of file
+        self._received += 1
+
+        # Bei vielen Devices kostet eine Logzeile je Nachricht spürbar Durchsatz
+        if self._log_every and self._received % self._log_every == 0:
+            logging.info(f"Empfange Nachricht Nr. {self._received}: {message.payload}")
+
+        # Ein volles Journal meldet sich selbst, hier würde es das Log fluten
+        if self._journal is not None:
+            self._journal.append(message.topic, message.payload)
+
+        if not self._dispatcher.submit(message.topic, message.payload):
+            logging.warning(f"Warteschlange voll, verwerfe Nachricht von {message.topic}")
+
+def shared_group(config):
+    """
+    Liefert den Namen der Gruppe für gemeinsame Abos aus der Umgebungsvariable
+    `MQTT_SHARED_GROUP` oder der Property `shared_group`. Ein Leerstring
+    bedeutet, dass nur eine Instanz des SimpleLoggers läuft.
+    """
+    return os.getenv("MQTT_SHARED_GROUP") or config.get("shared_group", "")
+
+def subscription_topic(config):
+    """
+    Liefert das zu abonierende Topic. Ist eine Gruppe für gemeinsame Abos
+    konfiguriert, wird ein "Shared Subscription" der Form `$share/<gruppe>/<topic>`
+    daraus. Der Broker verteilt die Nachrichten dann auf alle Instanzen der
+    Gruppe, statt jede Nachricht an jede Instanz zu senden. So können mehrere
+    Instanzen die Last unter sich aufteilen.
+    """
+    topic = config["topic_receive"]
+    group = shared_group(config)
+
+    if group:
+        topic = f"$share/{group}/{topic}"
+
+    return topic
@@ -0,0 +1,257 @@
+import json, logging, os, threading, time, traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from pymongo import ASCENDING
+from simplelogger.database import connect
+from simplelogger.rollups import Rollups
+from simplelogger.storage import get_storage
+
+class QueryService:
+    """
+    Lesezugriff auf die gespeicherten Messwerte über eine kleine HTTP-Schnittstelle,
+    die JSON zurückliefert. Folgende Abfragen werden unterstützt:
+
+        * GET /devices: Alle bekannten Devices mit ihrem neuesten Messwert
+        * GET /latest?device=...: Neuester Messwert eines Devices
+        * GET /raw?device=...&from=...&to=...&limit=...: Einzelne Messwerte
+        * GET /series?device=...&from=...&to=...&resolution=minute|hour:
+          Minimum, Mittelwert und Maximum je Minute oder Stunde
+
+    Die Zeitangaben `from` und `to` werden im ISO-Format erwartet und sind
+    optional. Ohne Angabe wird die letzte Stunde ausgewertet. Die Zeitreihen
+    werden aus den beim Speichern vorberechneten Rollups gelesen, weshalb im
+    Abschnitt `[mongodb]` der Konfiguration `rollups = True` gesetzt sein muss.
+
+    Der neueste Messwert je Device wird sehr häufig abgefragt und deshalb für
+    kurze Zeit im Hauptspeicher gehalten.
+    """
+
+    def __init__(self, mongodb_config, config):
+        """
+        Konstruktor. Im ersten Parameter wird die Konfiguration des `MongoDBHandler`
+        erwartet, um dasselbe Speicherformat lesen zu können. Der zweite Parameter
+        muss ein Konfigurationsobjekt mit folgenden Properties sein:
+
+            * host: IP-Adresse, an der die Schnittstelle erreichbar ist (optional)
+            * port: Portnummer der Schnittstelle (optional)
+            * cache_ttl: Sekunden, für die der neueste Messwert gecached wird (optional)
+            * cache_size: Maximale Anzahl gecachter Devices (optional)
+            * max_limit: Maximale Anzahl Messwerte je Abfrage (optional)
+        """
+        connection = os.getenv("MONGO_DB_CONNECTION") or mongodb_config['connection']
+
+        self._mongo = connect(connection, tz_aware=True)
+        self._database = self._mongo.get_database("sensor_db")
+        self._storage = get_storage(mongodb_config.get("storage", "documents"))
+        self._measurements = self._database.get_collection(self._storage.collection)
+        self._latest = self._database.get_collection(Rollups.LATEST)
+
+        self._cache = LatestCache(float(config.get("cache_ttl", 1.0)), int(config.get("cache_size", 100000)))
+        self._max_limit = int(config.get("max_limit", 10000))
+
+        host = config.get("host", "0.0.0.0")
+        port = int(config.get("port", 8080))
+        logging.info(f"Starte Abfrageschnittstelle auf {host}, Port {port}")
+
+        handler_class = type("RequestHandler", (_RequestHandler,), {"service": self})
+        self._server = ThreadingHTTPServer((host, port), handler_class)
+        self._server.daemon_threads = True
+
+    def start(self):
+        """
+        Schnittstelle in einem Hintergrundthread starten.
+        """
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+    def close(self):
+        """
+        Schnittstelle beenden.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def devices(self, params):
+        """
+        Alle bekannten Devices mit ihrem neuesten Messwert.
+        """
+        return [
+            {"device": document["_id"], "timestamp": document["timestamp"], "distance_m": document["distance_m"]}
+            for document in self._latest.find().sort("_id", ASCENDING)
+        ]
+
+    def latest(self, params):
+        """
+        Neuester Messwert eines Devices.
+        """
+        device = _param(params, "device")
+
+        def load():
+            document = self._latest.find_one({"_id": device})
+
+            if document is None:
+                return None
+
+            return {"device": device, "timestamp": document["timestamp"], "distance_m": document["distance_m"]}
+
+        return self._cache.get(device, load)
+
+    def raw(self, params):
+        """
+        Einzelne Messwerte eines Devices in einem Zeitraum.
+        """
+        device = _param(params, "device")
+        start, end = _time_range(params)
+        limit = min(int(_param(params, "limit", self._max_limit)), self._max_limit)
+
+        return self._storage.query(self._measurements, device, start, end, limit)
+
+    def series(self, params):
+        """
+        Minimum, Mittelwert und Maximum eines Devices je Minute oder Stunde.
+        """
+        device = _param(params, "device")
+        start, end = _time_range(params)
+        resolution = _param(params, "resolution", "minute")
+
+        if not resolution in Rollups.RESOLUTIONS:
+            raise ValueError(f"Unbekannte Auflösung: {resolution}")
+
+        collection, truncate = Rollups.RESOLUTIONS[resolution]
+
+        cursor = self._database.get_collection(collection).find(
+            {"device": device, "start": {"$gte": start.replace(**truncate), "$lt": end}}
+        ).sort("start", ASCENDING).limit(self._max_limit)
+
+        return [
+            {
+                "start": document["start"],
+                "count": document["count"],
+                "min": document["min"],
+                "avg": document["sum"] / document["count"],
+                "max": document["max"],
+            }
+            for document in cursor
+        ]
+
+class LatestCache:
+    """
+    Kleiner Zwischenspeicher für häufig abgefragte Werte. Jeder Eintrag ist nur
+    für eine begrenzte Zeit gültig. Bei zu vielen Einträgen werden die am
+    längsten nicht mehr abgefragten Einträge verworfen.
+    """
+
+    def __init__(self, ttl_s, max_size):
+        """
+        Konstruktor. Parameter:
+            * ttl_s: Gültigkeitsdauer eines Eintrags in Sekunden
+            * max_size: Maximale Anzahl Einträge
+        """
+        self._ttl_s = ttl_s
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Gültigen Eintrag zurückgeben oder mit der übergebenen Funktion neu laden.
+        """
+        now_s = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] > now_s:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = load()
+
+        with self._lock:
+            self._entries[key] = (now_s + self._ttl_s, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+        return value
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Verarbeitung der HTTP-Anfragen an den `QueryService`.
+    """
+
+    service = None
+
+    ROUTES = {
+        "/devices": "devices",
+        "/latest": "latest",
+        "/raw": "raw",
+        "/series": "series",
+    }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = self.ROUTES.get(url.path)
+
+        if route is None:
+            self._send(404, {"error": "Unbekannte Abfrage"})
+            return
+
+        try:
+            result = getattr(self.service, route)(parse_qs(url.query))
+            self._send(200, result)
+        except ValueError as error:
+            self._send(400, {"error": str(error)})
+        except:
+            traceback.print_exc()
+            self._send(500, {"error": "Interner Fehler"})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body, default=_json_default).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def _param(params, name, default=None):
+    """
+    Einzelnen Parameter der Anfrage auslesen.
+    """
+    values = params.get(name)
+
+    if values:
+        return values[0]
+    elif default is not None:
+        return default
+    else:
+        raise ValueError(f"Parameter {name} fehlt")
+
+def _time_range(params):
+    """
+    Zeitraum aus den Parametern `from` und `to` ermitteln. Ohne Angabe endet
+    der Zeitraum jetzt und beginnt eine Stunde vorher.
+    """
+    end = _param(params, "to", "")
+    end = datetime.fromisoformat(end).astimezone(timezone.utc) if end else datetime.now(timezone.utc)
+
+    start = _param(params, "from", "")
+    start = datetime.fromisoformat(start).astimezone(timezone.utc) if start else end - timedelta(hours=1)
+
+    return start, end
+
+def _json_default(value):
+    """
+    Datumswerte für die JSON-Ausgabe umwandeln.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    raise TypeError(f"Nicht serialisierbar: {type(value)}")
@@ -0,0 +1,292 @@
+import logging, os, queue, threading, time, traceback, zlib
+from simplelogger import messages, metrics
+from simplelogger.database import connect
+from simplelogger.export import read_file
+from simplelogger.storage import get_storage, parse_timestamp
+
+def partition(device, count):
+    """
+    Nummer der Partition für ein Device. Wie im `Dispatcher` landen alle
+    Messwerte eines Devices immer in derselben Partition.
+    """
+    return zlib.crc32(device.encode()) % count
+
+class MongoDBSource:
+    """
+    Quelle für das `Replay`: Liest die gespeicherten Messwerte im konfigurierten
+    Speicherformat aus der Datenbank. Jede Partition erhält einen eigenen Cursor
+    über einen Teil der Devices, so dass die Partitionen parallel gelesen
+    werden. Die Datenbank liefert die Dokumente dabei in Stapeln von
+    `batch_size` statt einzeln.
+    """
+
+    def __init__(self, config, start=None, end=None, devices=None, batch_size=1000):
+        """
+        Konstruktor. Im ersten Parameter muss die Konfiguration des `MongoDBHandler`
+        übergeben werden, von der nur `connection` und `storage` benötigt werden.
+        Weitere Parameter:
+            * start: Beginn des Zeitraums mit Zeitzone (optional)
+            * end: Ende des Zeitraums, ausschließlich (optional)
+            * devices: Liste der Devices (Topics), ohne Angabe alle (optional)
+            * batch_size: Anzahl Dokumente je Datenbankzugriff (optional)
+        """
+        connection = os.getenv("MONGO_DB_CONNECTION") or config["connection"]
+
+        self._storage = get_storage(config.get("storage", "documents"))
+        self._collection = connect(connection).get_database("sensor_db").get_collection(self._storage.collection)
+        self._start = start
+        self._end = end
+        self._devices = devices
+        self._batch_size = batch_size
+
+    def partitions(self, count):
+        """
+        Liste mit bis zu `count` Iteratoren über Tupel aus Device und Messwert,
+        jeweils sortiert nach Device und Zeit.
+        """
+        devices = self._devices or self._collection.distinct("device")
+        parts = [[] for i in range(count)]
+
+        for device in devices:
+            parts[partition(device, count)].append(device)
+
+        return [
+            self._storage.scan(self._collection, part, self._start, self._end, self._batch_size)
+            for part in parts if part
+        ]
+
+class FileSource:
+    """
+    Quelle für das `Replay`: Liest die Messwerte aus exportierten Dateien (siehe
+    `export.read_file()`). Die Dateien werden nacheinander in einem eigenen
+    Thread gelesen und die Messwerte in Stapeln an die Partitionen verteilt.
+    Die Messwerte eines Devices müssen daher über alle Dateien hinweg
+    zeitlich sortiert sein, zum Beispiel eine Datei je Monat.
+    """
+
+    def __init__(self, paths, start=None, end=None, devices=None, batch_size=1000, queue_size=16):
+        """
+        Konstruktor. Im ersten Parameter wird die Liste der Dateien übergeben.
+        Die weiteren Parameter entsprechen der `MongoDBSource`, zusätzlich:
+            * queue_size: Maximale Anzahl wartender Stapel je Partition (optional)
+        """
+        self._paths = paths
+        self._start = start
+        self._end = end
+        self._devices = None if devices is None else set(devices)
+        self._batch_size = batch_size
+        self._queue_size = queue_size
+
+    def partitions(self, count):
+        """
+        Liste mit `count` Iteratoren über Tupel aus Device und Messwert.
+        """
+        queues = [queue.Queue(maxsize=self._queue_size) for i in range(count)]
+
+        thread = threading.Thread(target=self._reader_thread_main, args=(queues,), daemon=True)
+        thread.start()
+
+        return [self._read_queue(q) for q in queues]
+
+    def _accept(self, device, data):
+        """
+        Prüfen, ob der Messwert zum gewünschten Zeitraum und den Devices gehört.
+        """
+        if self._devices is not None and device not in self._devices:
+            return False
+
+        if self._start is None and self._end is None:
+            return True
+
+        try:
+            timestamp = parse_timestamp(data)
+        except (KeyError, TypeError, ValueError):
+            return True
+
+        return (self._start is None or timestamp >= self._start) and (self._end is None or timestamp < self._end)
+
+    def _reader_thread_main(self, queues):
+        """
+        Hintergrundthread zum Lesen der Dateien. Ein `None` beendet jede Partition.
+        """
+        count = len(queues)
+        chunks = [[] for i in range(count)]
+
+        try:
+            for path in self._paths:
+                logging.info(f"Lese {path}")
+
+                for device, data in read_file(path, self._batch_size):
+                    if not self._accept(device, data):
+                        continue
+
+                    index = partition(device, count)
+                    chunks[index].append((device, data))
+
+                    if len(chunks[index]) >= self._batch_size:
+                        queues[index].put(chunks[index])
+                        chunks[index] = []
+        except:
+            traceback.print_exc()
+        finally:
+            for index, q in enumerate(queues):
+                if chunks[index]:
+                    q.put(chunks[index])
+
+                q.put(None)
+
+    @staticmethod
+    def _read_queue(q):
+        while True:
+            chunk = q.get()
+
+            if chunk is None:
+                return
+
+            yield from chunk
+
+class Replay:
+    """
+    Erneute Verarbeitung gespeicherter Messwerte mit denselben Handlern wie im
+    Live-Betrieb, zum Beispiel um neue Alarmregeln auf die Messwerte der letzten
+    Monate anzuwenden oder die Messwerte in ein anderes Speicherformat zu
+    kopieren. Die Handler werden wie bei `MQTT.add_handler()` registriert und
+    erhalten die Messwerte als `Message`-Objekt mit dem Kommando
+    `MEASUREMENT_BATCH`, jeweils bis zu `message_size` aufeinanderfolgende
+    Messwerte eines Devices.
+
+    Die Quelle (`MongoDBSource` oder `FileSource`) liefert die Messwerte in
+    Partitionen, die je ein eigener Worker-Thread ohne Pause so schnell wie
+    möglich abarbeitet. Wie im `Dispatcher` gehören alle Messwerte eines Devices
+    zur selben Partition und werden in ihrer zeitlichen Reihenfolge verarbeitet.
+    Nur synchrone Handler werden unterstützt.
+    """
+
+    def __init__(self, workers=4, message_size=100):
+        """
+        Konstruktor. Parameter:
+            * workers: Anzahl paralleler Partitionen (optional)
+            * message_size: Maximale Anzahl Messwerte je Nachricht (optional)
+        """
+        self._workers = workers
+        self._message_size = message_size
+        self._handlers = []
+        self._router = messages.Router()
+
+    def add_handler(self, handler):
+        """
+        Fügt einen weiteren Handler hinzu, siehe `Dispatcher.add_handler()`.
+        """
+        self._handlers.append(handler)
+        self._router.add(handler, metrics.HANDLER_SECONDS.labels(metrics.handler_name(handler)))
+
+    def run(self, source):
+        """
+        Alle Messwerte der Quelle verarbeiten und erst danach zurückkehren.
+        Rückgabewert ist ein Dictionary mit folgenden Kennzahlen:
+
+            * measurements: Anzahl verarbeiteter Messwerte
+            * messages: Anzahl an die Handler übergebener Nachrichten
+            * invalid: Anzahl verworfener, ungültiger Messwerte
+            * errors: Anzahl abgebrochener Partitionen
+            * first, last: Frühester und spätester Zeitstempel oder `None`
+            * seconds: Dauer in Sekunden
+        """
+        start_s = time.monotonic()
+        partitions = source.partitions(self._workers)
+        stats = [{"measurements": 0, "messages": 0, "invalid": 0, "errors": 0, "first": None, "last": None} for p in partitions]
+
+        threads = [
+            threading.Thread(target=self._worker_thread_main, args=(rows, stats[index]), daemon=True)
+            for index, rows in enumerate(partitions)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        first = [s["first"] for s in stats if s["first"] is not None]
+        last = [s["last"] for s in stats if s["last"] is not None]
+
+        return {
+            "measurements": sum(s["measurements"] for s in stats),
+            "messages": sum(s["messages"] for s in stats),
+            "invalid": sum(s["invalid"] for s in stats),
+            "errors": sum(s["errors"] for s in stats),
+            "first": min(first) if first else None,
+            "last": max(last) if last else None,
+            "seconds": time.monotonic() - start_s,
+        }
+
+    def close(self):
+        """
+        Alle Handler schließen, die hierfür eine Methode `close()` besitzen.
+        """
+        for handler in self._handlers:
+            if hasattr(handler, "close"):
+                try:
+                    handler.close()
+                except:
+                    traceback.print_exc()
+
+    def _worker_thread_main(self, rows, stats):
+        """
+        Hintergrundthread, der die Messwerte einer Partition zu Nachrichten
+        zusammenfasst und an die Handler übergibt.
+        """
+        check = messages.SCHEMAS["MEASUREMENT"]
+        topic, chunk = None, []
+
+        try:
+            for device, data in rows:
+                if device != topic or len(chunk) >= self._message_size:
+                    self._deliver(topic, chunk, stats)
+                    topic, chunk = device, []
+
+                try:
+                    check(data)
+                except ValueError:
+                    stats["invalid"] += 1
+                    continue
+
+                chunk.append(data)
+
+            self._deliver(topic, chunk, stats)
+        except:
+            stats["errors"] += 1
+            traceback.print_exc()
+
+    def _deliver(self, topic, chunk, stats):
+        """
+        Messwerte eines Devices als eine Nachricht an die Handler übergeben.
+        """
+        if not chunk:
+            return
+
+        message = messages.Message(topic, "MEASUREMENT_BATCH", chunk)
+
+        for handler, handler_seconds in self._router.route(message):
+            start_s = time.perf_counter()
+
+            try:
+                handler(topic, message)
+            except:
+                traceback.print_exc()
+
+            handler_seconds.observe(time.perf_counter() - start_s)
+
+        stats["messages"] += 1
+        stats["measurements"] += len(chunk)
+
+        try:
+            first, last = parse_timestamp(chunk[0]), parse_timestamp(chunk[-1])
+        except ValueError:
+            return
+
+        if stats["first"] is None or first < stats["first"]:
+            stats["first"] = first
+
+        if stats["last"] is None or last > stats["last"]:
+            stats["last"] = last
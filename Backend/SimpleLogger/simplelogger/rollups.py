@@ -0,0 +1,103 @@
+from datetime import datetime, timezone
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from simplelogger.storage import parse_timestamp
+
+class Rollups:
+    """
+    Vorberechnete Zusammenfassungen der Messwerte, die beim Speichern laufend
+    fortgeschrieben werden. Für jedes Device und jede Minute bzw. Stunde werden
+    Anzahl, Summe, Minimum und Maximum der Messwerte mitgeführt, woraus sich
+    beim Lesen auch der Mittelwert ergibt. Zusätzlich wird der jeweils neueste
+    Messwert jedes Devices in der Collection `latest` gehalten.
+
+    Auswertungen müssen dadurch nie die einzelnen Messwerte lesen, sondern
+    kommen mit einem Dokument je Minute bzw. Stunde aus.
+    """
+
+    RESOLUTIONS = {
+        "minute": ("rollups_minute", {"second": 0, "microsecond": 0}),
+        "hour": ("rollups_hour", {"minute": 0, "second": 0, "microsecond": 0}),
+    }
+
+    LATEST = "latest"
+
+    # Indizes der Rollup-Collections, die Collection `latest` benötigt keine
+    indexes = [
+        IndexModel([("device", ASCENDING), ("start", ASCENDING)], unique=True),
+    ]
+
+    @classmethod
+    def collections(cls):
+        """
+        Namen der Rollup-Collections.
+        """
+        return [collection for collection, truncate in cls.RESOLUTIONS.values()]
+
+    def operations(self, documents):
+        """
+        Schreibvorgänge zum Fortschreiben der Zusammenfassungen für die übergebenen
+        Dokumente. Rückgabewert ist ein Dictionary mit dem Namen der Collection
+        als Schlüssel und einer Liste von Schreibvorgängen für `bulk_write()`.
+        Die Messwerte werden vorab je Device und Zeitraum zusammengefasst, damit
+        je Zeitraum nur ein Schreibvorgang notwendig ist.
+        """
+        samples = []
+
+        for document in documents:
+            try:
+                samples.append((document["device"], parse_timestamp(document["data"]), float(document["data"]["distance_m"])))
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        result = {}
+
+        for resolution, (collection, truncate) in self.RESOLUTIONS.items():
+            groups = {}
+
+            for device, timestamp, distance_m in samples:
+                key = (device, timestamp.replace(**truncate))
+                group = groups.get(key)
+
+                if group is None:
+                    groups[key] = [1, distance_m, distance_m, distance_m]
+                else:
+                    group[0] += 1
+                    group[1] += distance_m
+                    group[2] = min(group[2], distance_m)
+                    group[3] = max(group[3], distance_m)
+
+            result[collection] = [
+                UpdateOne(
+                    {"device": device, "start": start},
+                    {
+                        "$inc": {"count": count, "sum": total},
+                        "$min": {"min": minimum},
+                        "$max": {"max": maximum},
+                    },
+                    upsert = True,
+                )
+                for (device, start), (count, total, minimum, maximum) in groups.items()
+            ]
+
+        latest = {}
+
+        for device, timestamp, distance_m in samples:
+            if not device in latest or latest[device][0] < timestamp:
+                latest[device] = (timestamp, distance_m)
+
+        # Neuesten Messwert nur ersetzen, wenn er wirklich neuer ist
+        result[self.LATEST] = [
+            UpdateOne(
+                {"_id": device},
+                [{"$set": {
+                    "distance_m": {"$cond": [{"$gt": [timestamp, {"$ifNull": ["$timestamp", _EPOCH]}]}, distance_m, "$distance_m"]},
+                    "timestamp": {"$max": ["$timestamp", timestamp]},
+                }}],
+                upsert = True,
+            )
+            for device, (timestamp, distance_m) in latest.items()
+        ]
+
+        return result
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
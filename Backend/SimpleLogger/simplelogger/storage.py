@@ -0,0 +1,425 @@
+import logging
+from datetime import datetime, timezone
+from pymongo import ASCENDING, IndexModel, InsertOne, UpdateOne
+
+class DocumentStorage:
+    """
+    Ursprüngliches Speicherformat: Ein Dokument je Messwert in der Collection
+    `measurements`, so wie es vom Device gesendet wurde. Ist am einfachsten zu
+    verstehen, braucht aber am meisten Speicherplatz.
+    """
+
+    collection = "measurements"
+    options = None
+    indexes = [
+        IndexModel([("device", ASCENDING), ("data.datetime_iso", ASCENDING)]),
+    ]
+
+    def operations(self, documents):
+        """
+        Schreibvorgänge für `bulk_write()` zum Speichern der übergebenen Dokumente.
+        Da der Zeitstempel nur als Text gespeichert, sortiert und verglichen wird,
+        werden Zeitstempel mit Zeitzone, wie sie der binäre Codec in UTC liefert,
+        vorher in lokale Zeit ohne Zeitzone umgerechnet, so wie sie die Devices
+        im JSON-Format senden.
+        """
+        return [InsertOne(self._local_time(document)) for document in documents]
+
+    @staticmethod
+    def _local_time(document):
+        """
+        Dokument mit dem Zeitstempel des Messwerts in lokaler Zeit ohne Zeitzone.
+        Ungültige Zeitstempel bleiben unverändert.
+        """
+        data = document["data"]
+
+        try:
+            timestamp = datetime.fromisoformat(data["datetime_iso"])
+        except (KeyError, TypeError, ValueError):
+            return document
+
+        if timestamp.tzinfo is None:
+            return document
+
+        datetime_iso = timestamp.astimezone().replace(tzinfo=None).isoformat(timespec="milliseconds")
+        return {**document, "data": {**data, "datetime_iso": datetime_iso}}
+
+    def query(self, collection, device, start, end, limit):
+        """
+        Messwerte eines Devices im Zeitraum von `start` bis ausschließlich `end`
+        auslesen. Da der Zeitstempel hier nur als Text vorliegt, wird er als
+        lokale Zeit ohne Zeitzone verglichen (siehe `operations()`).
+        """
+        start_iso = start.astimezone().replace(tzinfo=None).isoformat()
+        end_iso = end.astimezone().replace(tzinfo=None).isoformat()
+
+        cursor = collection.find(
+            {"device": device, "data.datetime_iso": {"$gte": start_iso, "$lt": end_iso}}
+        ).sort("data.datetime_iso", ASCENDING).limit(limit)
+
+        return [
+            {"timestamp": parse_timestamp(document["data"]), **parse_values(document["data"])}
+            for document in cursor
+        ]
+
+    def scan(self, collection, devices, start, end, batch_size):
+        """
+        Alle Messwerte der übergebenen Devices sortiert nach Device und Zeit
+        als Tupel aus Device und Messwert (Dictionary wie vom Device gesendet)
+        liefern. Der Zeitraum von `start` bis ausschließlich `end` ist optional.
+        Die Datenbank liefert die Dokumente in Stapeln von `batch_size`.
+        """
+        query = {"device": {"$in": list(devices)}}
+        period = time_range(
+            start and start.astimezone().replace(tzinfo=None).isoformat(),
+            end and end.astimezone().replace(tzinfo=None).isoformat(),
+        )
+
+        if period:
+            query["data.datetime_iso"] = period
+
+        cursor = collection.find(query, {"_id": 0, "device": 1, "data": 1}).sort(
+            [("device", ASCENDING), ("data.datetime_iso", ASCENDING)]
+        ).batch_size(batch_size)
+
+        for document in cursor:
+            yield document["device"], document["data"]
+
+class TimeSeriesStorage:
+    """
+    Speicherung in einer Time-Series-Collection von MongoDB. Die Datenbank fasst
+    die Messwerte eines Devices dabei intern zu komprimierten Blöcken zusammen,
+    wodurch der Speicherbedarf deutlich sinkt und Abfragen über einen Zeitraum
+    wesentlich schneller werden. Hierfür wird der Zeitstempel als echtes Datum
+    und das Device als Metadatenfeld gespeichert.
+    """
+
+    collection = "measurements_ts"
+    options = {
+        "timeseries": {
+            "timeField": "timestamp",
+            "metaField": "device",
+            "granularity": "seconds",
+        },
+    }
+    indexes = [
+        IndexModel([("device", ASCENDING), ("timestamp", ASCENDING)]),
+    ]
+
+    def operations(self, documents):
+        """
+        Schreibvorgänge für `bulk_write()` zum Speichern der übergebenen Dokumente.
+        """
+        result = []
+
+        for document in documents:
+            try:
+                result.append(InsertOne({
+                    "timestamp": parse_timestamp(document["data"]),
+                    "device": document["device"],
+                    **parse_values(document["data"]),
+                }))
+            except (KeyError, TypeError, ValueError):
+                logging.warning(f"Ungültiger Messwert von {document['device']} verworfen")
+
+        return result
+
+    def query(self, collection, device, start, end, limit):
+        """
+        Messwerte eines Devices im Zeitraum von `start` bis ausschließlich `end`
+        auslesen.
+        """
+        cursor = collection.find(
+            {"device": device, "timestamp": {"$gte": start, "$lt": end}},
+            {"_id": False, "timestamp": True, "distance_m": True, "confidence": True},
+        ).sort("timestamp", ASCENDING).limit(limit)
+
+        return list(cursor)
+
+    def scan(self, collection, devices, start, end, batch_size):
+        """
+        Alle Messwerte der übergebenen Devices sortiert nach Device und Zeit,
+        siehe `DocumentStorage.scan()`.
+        """
+        query = {"device": {"$in": list(devices)}}
+        period = time_range(start, end)
+
+        if period:
+            query["timestamp"] = period
+
+        cursor = collection.find(query, {"_id": 0}).sort(
+            [("device", ASCENDING), ("timestamp", ASCENDING)]
+        ).batch_size(batch_size)
+
+        for document in cursor:
+            yield document["device"], to_data(document)
+
+class BucketStorage:
+    """
+    Speicherung in selbst verwalteten Stunden-Buckets: Alle Messwerte eines
+    Devices innerhalb einer Stunde landen gemeinsam in einem Dokument der
+    Collection `measurement_buckets`. Zusätzlich werden je Bucket die Anzahl,
+    Summe, das Minimum und das Maximum mitgeführt, so dass einfache Auswertungen
+    ohne das Lesen der einzelnen Messwerte möglich sind. Funktioniert auch mit
+    älteren MongoDB-Versionen ohne Time-Series-Collections.
+    """
+
+    collection = "measurement_buckets"
+    options = None
+    indexes = [
+        IndexModel([("device", ASCENDING), ("hour", ASCENDING)], unique=True),
+    ]
+
+    def operations(self, documents):
+        """
+        Schreibvorgänge für `bulk_write()` zum Speichern der übergebenen Dokumente.
+        Die Messwerte werden vorab je Bucket zusammengefasst, so dass für jeden
+        Bucket nur ein Schreibvorgang notwendig ist.
+        """
+        buckets = {}
+
+        for document in documents:
+            try:
+                timestamp = parse_timestamp(document["data"])
+                values = parse_values(document["data"])
+            except (KeyError, TypeError, ValueError):
+                logging.warning(f"Ungültiger Messwert von {document['device']} verworfen")
+                continue
+
+            hour = timestamp.replace(minute=0, second=0, microsecond=0)
+            samples = buckets.setdefault((document["device"], hour), [])
+            samples.append({"timestamp": timestamp, **values})
+
+        return [
+            UpdateOne(
+                {"device": device, "hour": hour},
+                {
+                    "$push": {"samples": {"$each": samples}},
+                    "$inc": {"count": len(samples), "sum": sum(s["distance_m"] for s in samples)},
+                    "$min": {"min": min(s["distance_m"] for s in samples), "first": min(s["timestamp"] for s in samples)},
+                    "$max": {"max": max(s["distance_m"] for s in samples), "last": max(s["timestamp"] for s in samples)},
+                },
+                upsert = True,
+            )
+            for (device, hour), samples in buckets.items()
+        ]
+
+    def query(self, collection, device, start, end, limit):
+        """
+        Messwerte eines Devices im Zeitraum von `start` bis ausschließlich `end`
+        auslesen. Hierfür werden nur die Buckets der betroffenen Stunden gelesen.
+        """
+        cursor = collection.aggregate([
+            {"$match": {"device": device, "hour": {"$gte": start.replace(minute=0, second=0, microsecond=0), "$lt": end}}},
+            {"$unwind": "$samples"},
+            {"$replaceRoot": {"newRoot": "$samples"}},
+            {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+            {"$sort": {"timestamp": ASCENDING}},
+            {"$limit": limit},
+        ])
+
+        return list(cursor)
+
+    def scan(self, collection, devices, start, end, batch_size):
+        """
+        Alle Messwerte der übergebenen Devices sortiert nach Device und Stunde,
+        siehe `DocumentStorage.scan()`. Innerhalb eines Buckets bleiben die
+        Messwerte in der Reihenfolge ihrer Speicherung.
+        """
+        query = {"device": {"$in": list(devices)}}
+
+        if start is not None or end is not None:
+            query["hour"] = time_range(start and start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0), end)
+
+        # Ein Bucket enthält bis zu 3600 Messwerte
+        cursor = collection.find(query, {"_id": 0, "device": 1, "samples": 1}).sort(
+            [("device", ASCENDING), ("hour", ASCENDING)]
+        ).batch_size(max(1, batch_size // 100))
+
+        for document in cursor:
+            for sample in document.get("samples", ()):
+                timestamp = as_utc(sample["timestamp"])
+
+                if start is not None and timestamp < start or end is not None and timestamp >= end:
+                    continue
+
+                yield document["device"], to_data(sample)
+
+class SummaryStorage:
+    """
+    Speicherung der Zusammenfassungen, die ein Device mit dem Kommando
+    `MEASUREMENT_SUMMARY` für nicht einzeln gesendete Messwerte schickt. Jede
+    Zusammenfassung landet als ein Dokument mit Anzahl, Minimum, Maximum und
+    Zeitraum in der Collection `measurement_summaries`, unabhängig vom
+    Speicherformat der einzelnen Messwerte.
+    """
+
+    collection = "measurement_summaries"
+    indexes = [
+        IndexModel([("device", ASCENDING), ("start", ASCENDING)]),
+    ]
+
+    def operations(self, documents):
+        """
+        Schreibvorgänge für `bulk_write()` zum Speichern der übergebenen Dokumente.
+        """
+        result = []
+
+        for document in documents:
+            summary = document["summary"]
+
+            try:
+                result.append(InsertOne({
+                    "device": document["device"],
+                    "start": datetime.fromisoformat(summary["start_iso"]).astimezone(timezone.utc),
+                    "end": datetime.fromisoformat(summary["end_iso"]).astimezone(timezone.utc),
+                    "count": int(summary["count"]),
+                    "min": float(summary["min_m"]),
+                    "max": float(summary["max_m"]),
+                }))
+            except (KeyError, TypeError, ValueError):
+                logging.warning(f"Ungültige Zusammenfassung von {document['device']} verworfen")
+
+        return result
+
+class WindowStorage:
+    """
+    Speicherung der Statistiken, die ein Device mit dem Kommando
+    `MEASUREMENT_WINDOW` je Zeitfenster schickt. Jedes Fenster landet als ein
+    Dokument in der Collection `measurement_windows`, unabhängig vom
+    Speicherformat der einzelnen Messwerte. Da ein Device jedes Fenster nur
+    einmal sendet, identifizieren Device und Beginn das Dokument eindeutig. Mit
+    QoS 1 oder aus dem Journal doppelt empfangene Fenster überschreiben daher
+    nur das bereits gespeicherte Dokument.
+    """
+
+    collection = "measurement_windows"
+    indexes = [
+        IndexModel([("device", ASCENDING), ("start", ASCENDING)], unique=True),
+    ]
+
+    def operations(self, documents):
+        """
+        Schreibvorgänge für `bulk_write()` zum Speichern der übergebenen Dokumente.
+        """
+        result = []
+
+        for document in documents:
+            window = document["window"]
+
+            try:
+                result.append(UpdateOne({
+                    "device": document["device"],
+                    "start": datetime.fromisoformat(window["start_iso"]).astimezone(timezone.utc),
+                }, {"$set": {
+                    "end": datetime.fromisoformat(window["end_iso"]).astimezone(timezone.utc),
+                    "count": int(window["count"]),
+                    "min": float(window["min_m"]),
+                    "max": float(window["max_m"]),
+                    "mean": float(window["mean_m"]),
+                    "last": float(window["last_m"]),
+                    "occupancy_changes": int(window.get("occupancy_changes", 0)),
+                    "occupied": bool(window.get("occupied", False)),
+                }}, upsert=True))
+            except (KeyError, TypeError, ValueError):
+                logging.warning(f"Ungültiges Zeitfenster von {document['device']} verworfen")
+
+        return result
+
+STORAGES = {
+    "documents": DocumentStorage,
+    "timeseries": TimeSeriesStorage,
+    "buckets": BucketStorage,
+}
+
+def get_storage(name):
+    """
+    Speicherformat anhand seines Namens ("documents", "timeseries" oder
+    "buckets") erzeugen.
+    """
+    try:
+        return STORAGES[name]()
+    except KeyError:
+        raise ValueError(f"Unbekanntes Speicherformat: {name}")
+
+def batch_writes(batch, collections, storage, rollups=None):
+    """
+    Schreibvorgänge für einen Stapel von Dokumenten aus
+    `MongoDBHandler.to_documents()`, gemeinsam für den `MongoDBHandler` und den
+    `AsyncMongoDBHandler`. Parameter:
+        * collections: Dictionary mit der Collection je Name, mindestens für das
+          Speicherformat, die Zusammenfassungen, die Zeitfenster und die Rollups
+        * storage: Speicherformat der einzelnen Messwerte
+        * rollups: `Rollups`-Objekt oder `None` ohne Rollups (optional)
+
+    Rückgabewert ist eine Liste mit Tupeln aus der Collection und den
+    Schreibvorgängen für `bulk_write()`.
+    """
+    measurements = [document for document in batch if "data" in document]
+    summaries = [document for document in batch if "summary" in document]
+    windows = [document for document in batch if "window" in document]
+
+    writes = [
+        (collections[storage.collection], storage.operations(measurements)),
+        (collections[SummaryStorage.collection], SummaryStorage().operations(summaries)),
+        (collections[WindowStorage.collection], WindowStorage().operations(windows)),
+    ]
+
+    if rollups is not None:
+        for name, operations in rollups.operations(measurements).items():
+            writes.append((collections[name], operations))
+
+    return writes
+
+def parse_timestamp(data):
+    """
+    Zeitstempel eines Messwerts als Datum in UTC-Zeit ermitteln. Zeitstempel
+    ohne Zeitzone werden als lokale Zeit interpretiert.
+    """
+    return datetime.fromisoformat(data["datetime_iso"]).astimezone(timezone.utc)
+
+def as_utc(timestamp):
+    """
+    Datum aus der Datenbank mit Zeitzone UTC versehen. PyMongo liefert Daten
+    standardmäßig ohne Zeitzone, aber immer in UTC-Zeit.
+    """
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp.tzinfo is None else timestamp
+
+def time_range(start, end):
+    """
+    Bedingung für einen Zeitraum von `start` bis ausschließlich `end`, wobei
+    beide Grenzen fehlen dürfen.
+    """
+    period = {}
+
+    if start is not None:
+        period["$gte"] = start
+
+    if end is not None:
+        period["$lt"] = end
+
+    return period
+
+def to_data(document):
+    """
+    Gespeicherten Messwert mit Datum in das Dictionary umwandeln, das ein Device
+    sendet. Gegenstück zu `parse_timestamp()` und `parse_values()`.
+    """
+    data = {"distance_m": document["distance_m"], "datetime_iso": as_utc(document["timestamp"]).isoformat()}
+
+    if document.get("confidence") is not None:
+        data["confidence"] = document["confidence"]
+
+    return data
+
+def parse_values(data):
+    """
+    Abstand und, sofern vom Device gesendet, Konfidenz eines Messwerts als
+    Dictionary ermitteln.
+    """
+    values = {"distance_m": float(data["distance_m"])}
+
+    if data.get("confidence") is not None:
+        values["confidence"] = float(data["confidence"])
+
+    return values
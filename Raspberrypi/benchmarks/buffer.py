@@ -0,0 +1,88 @@
+"""
+Benchmark des Ringpuffers für Abstandsmessungen. Vergleicht die frühere Lösung
+(`deque` mit einem Dataclass-Objekt und ISO-Text je Messwert) mit dem
+spaltenweisen `MeasurementRing`. Gemessen werden mit `tracemalloc` der
+Speicherbedarf eines vollen Puffers sowie die beim Hinzufügen eines
+Messwerts reservierten Bytes. Aufruf im Verzeichnis `Raspberrypi`:
+
+    python -m benchmarks.buffer
+"""
+
+import time, timeit, tracemalloc
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from parkdistance.measurements import MeasurementRing
+
+@dataclass
+class DataclassMeasurement:
+    """
+    Frühere Darstellung eines Messwerts zum Vergleich.
+    """
+    distance_m: float
+    datetime_iso: str
+    confidence: float = None
+
+def deque_buffer(size):
+    buffer = deque(maxlen=size)
+
+    def append(i):
+        buffer.append(DataclassMeasurement(distance_m=0.5 + i % 100 / 1000, datetime_iso=datetime.now().isoformat(), confidence=1.0))
+
+    return buffer, append
+
+def ring_buffer(size):
+    buffer = MeasurementRing(size)
+
+    def append(i):
+        buffer.append(0.5 + i % 100 / 1000, time.time_ns() // 1000000, 1.0)
+
+    return buffer, append
+
+BUFFERS = {
+    "deque": deque_buffer,
+    "ring": ring_buffer,
+}
+
+def measure(factory, size, ticks):
+    """
+    Speicherbedarf des gefüllten Puffers in Bytes und durchschnittlich beim
+    Hinzufügen eines weiteren Messwerts reservierte Bytes.
+    """
+    tracemalloc.start()
+
+    before = tracemalloc.take_snapshot()
+    buffer, append = factory(size)
+
+    for i in range(size):
+        append(i)
+
+    filled = tracemalloc.take_snapshot()
+    memory = sum(stat.size_diff for stat in filled.compare_to(before, "filename"))
+
+    # Weitere Messwerte überschreiben nur ältere, daher zählt der Spitzenwert je Aufruf
+    allocated = 0
+
+    for i in range(ticks):
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        append(i)
+        allocated += tracemalloc.get_traced_memory()[1] - current
+
+    tracemalloc.stop()
+    return memory, allocated / ticks
+
+def main():
+    print(f"{'Puffer':<8} {'Messwerte':>10} {'Bytes':>12} {'Bytes/Wert':>11} {'Bytes/Tick':>11} {'µs/Tick':>8}")
+
+    for size in (10, 10000, 100000):
+        for name, factory in BUFFERS.items():
+            memory, allocated = measure(factory, size, 1000)
+
+            buffer, append = factory(size)
+            number, append_s = timeit.Timer(lambda: append(1)).autorange()
+
+            print(f"{name:<8} {size:>10} {memory:>12} {memory / size:>11.1f} {allocated:>11.1f} {append_s / number * 1e6:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+#! /usr/bin/env python
+from parkdistance.tools.fleet import main
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,54 @@
-import gpiozero, threading, time, logging
+import gpiozero, threading, logging
+
+from dataclasses import dataclass
 
 class LedBeeper:
     """
     Status-LED und Buzzer, die in Abhängigkeit von der gemessenen Entfernung
     unterschiedlich schnell einen periodischen Signalton ausgeben und blinken.
+
+    Aus der Alarmintensität wird ein `Pattern` berechnet, das festlegt, welche
+    Ausgänge an sind und ob sie blinken. Die eigentliche Ansteuerung übernimmt
+    ein Treiber, der nur dann etwas tun muss, wenn sich das Muster ändert:
+
+        * `PigpioPatternDriver`: Mit pigpio wird das Blinken als Waveform an den
+          pigpio-Daemon übergeben, der die Pins per DMA unabhängig vom Programm
+          schaltet.
+
+        * `ThreadPatternDriver`: Ohne pigpio schaltet ein Hintergrundthread die
+          Pins und schläft zwischen zwei Flanken.
     """
 
-    def __init__(self, led1_pin, led2_pin, buzzer_pin, distance_min_m=0.1, distance_max_m=1.0):
+    # Keine regelmäßigen Aufrufe, nur wenn sich einer dieser Parameter ändert
+    period = None
+    watch = ("current_distance_m", "silent", "alarm")
+
+    def __init__(self, led1_pin, led2_pin, buzzer_pin, distance_min_m=0.1, distance_max_m=1.0, driver=None, pin_factory=None):
         """
         Konstruktor. Parameter:
             * led1_pin: GPIO-Pin der roten LED
             * led2_pin: GPIO-Pin der gründen LED
             * buzzer_pin: GPIO-Pin des Buzzers
+            * driver: Treiber für die Ausgänge (optional, sonst automatisch)
+            * pin_factory: Pin-Factory von gpiozero (optional, sonst die globale)
         """
-        self._led1   = gpiozero.DigitalOutputDevice(pin=led1_pin)
-        self._led2   = gpiozero.DigitalOutputDevice(pin=led2_pin)
-        self._buzzer = gpiozero.DigitalOutputDevice(pin=buzzer_pin)
+        self._led1   = gpiozero.DigitalOutputDevice(pin=led1_pin, pin_factory=pin_factory)
+        self._led2   = gpiozero.DigitalOutputDevice(pin=led2_pin, pin_factory=pin_factory)
+        self._buzzer = gpiozero.DigitalOutputDevice(pin=buzzer_pin, pin_factory=pin_factory)
 
         self._intensity = 0
         self._distance_min_m = distance_min_m
         self._distance_max_m = distance_max_m
+        self._lock = threading.Lock()
 
         self.alarm  = False
         self.silent = False
 
-        self._blink_thread = threading.Thread(target=self._blink_thread_main)
-        self._blink_thread.start()
+        if driver is None:
+            driver = create_pattern_driver(self._led1, self._led2, self._buzzer)
+
+        self._driver = driver
+        self._driver.apply(Pattern.OFF)
 
     @property
     def intensity(self):
@@ -33,7 +56,8 @@ class LedBeeper:
         Property zum Auslesen der aktuellen Alarmintensität als Float.
         0 = Alarm aus ... 1 = Dauerton; dazwischen wiederholtes Piepsen.
         """
-        return self._intensity
+        with self._lock:
+            return self._intensity
 
     @intensity.setter
     def intensity(self, intensity):
@@ -47,75 +71,239 @@ class LedBeeper:
         elif intensity > 1:
             intensity = 1
 
-        self._intensity = intensity
+        with self._lock:
+            self._intensity = intensity
+            pattern = Pattern.create(intensity, self.alarm, self.silent)
 
-    def _blink_thread_main(self):
-        """
-        Hintergrundthread zum periodischen Ein- und Ausschalten der Ausgänge.
-        Ist leider etwas umständlich, aber mit Pulsweitemodulierten Pins können
-        nur Frequenzen wie 10 Hz, 20 Hz oder 40 Hz geschaltet werden. Wir wollen
-        aber variabel von 1x/Sekunde bis 10x/Sekunde blinken können.
-        """
-        while True:
-            if self.intensity < 0.1:
-                # Alles aus
-                self._led1.off()
-                self._led2.off()
-                self._buzzer.off()
-            elif self.intensity > 0.9:
-                # Crash oder Alarm: Alles an
-                if self.alarm:
-                    self._led1.on()
-                    self._led2.off()
-                else:
-                    self._led1.off()
-                    self._led2.on()
-
-                if not self.silent:
-                    self._buzzer.on()
-                else:
-                    self._buzzer.off()
-            else:
-                # Normale Messung: Periodisches Blinken/Piepsen
-                frequency = 15 * self.intensity
-                sleep_time_s = 1.0 / frequency
+        self._driver.apply(pattern)
 
-                self._led1.off()
-                self._led2.on()
-
-                if not self.silent:
-                    self._buzzer.on()
-                else:
-                    self._buzzer.off()
-
-                time.sleep(sleep_time_s)
-
-                self._led1.off()
-                self._led2.off()
-                self._buzzer.off()
-
-                time.sleep(sleep_time_s)
+    def close(self):
+        """
+        Alle Ausgänge ausschalten und den Treiber beenden.
+        """
+        self._driver.close()
 
     def __call__(self, device):
         """
-        Vom Device mehrmals je Sekunde aufgerufene Funktion, um mit den Sensoren
-        und Aktoren zu interagieren und die Device-Parameter zu beeinflussen.
-        Reagiert auf folgende Device-Parameter:
+        Vom Device bei jeder Änderung der folgenden Device-Parameter aufgerufene
+        Funktion, um die Ausgabe an den neuen Zustand anzupassen:
 
             * current_distance_m: Aktuell gemessener Abstand in Metern
             * silent: Tonausgabe unterdrücken (Boolean)
             * alarm: Vom Backend ausgelöster Alarm (Boolean)
         """
-        self.silent = device.parameters.get("silent", False)
-        self.alarm = device.parameters.get("alarm", False)
+        silent, alarm, distance_m = device.parameters.get_many("silent", "alarm", "current_distance_m")
+
+        self.silent = bool(silent)
+        self.alarm = bool(alarm)
 
         if self.alarm:
             self.intensity = 1
         else:
-            distance_m = device.parameters.get("current_distance_m", 9999)
-
-            if self._distance_min_m <= distance_m <= self._distance_max_m:
+            if distance_m is not None and self._distance_min_m <= distance_m <= self._distance_max_m:
                 self.intensity = 1.0 * (distance_m - self._distance_min_m) / (self._distance_max_m - self._distance_min_m)
                 self.intensity = 1 - self.intensity
             else:
                 self.intensity = 0.0
+
+@dataclass(frozen=True)
+class Pattern:
+    """
+    Zustand der Ausgänge. Ohne `half_period_s` leuchten bzw. tönen die Ausgänge
+    dauerhaft, ansonsten sind sie abwechselnd für `half_period_s` Sekunden an
+    und aus.
+    """
+    led1: bool
+    led2: bool
+    buzzer: bool
+    half_period_s: float = None
+
+    @classmethod
+    def create(cls, intensity, alarm, silent):
+        """
+        Muster für eine Alarmintensität berechnen. Bis 0.1 bleibt alles aus, ab
+        0.9 ist alles dauerhaft an, dazwischen wird mit 1.5 bis 13.5 Hz geblinkt.
+        """
+        if intensity < 0.1:
+            # Alles aus
+            return cls.OFF
+        elif intensity > 0.9:
+            # Crash oder Alarm: Alles an
+            return cls(led1=alarm, led2=not alarm, buzzer=not silent)
+        else:
+            # Normale Messung: Periodisches Blinken/Piepsen
+            frequency = 15 * intensity
+            return cls(led1=False, led2=True, buzzer=not silent, half_period_s=1.0 / frequency)
+
+Pattern.OFF = Pattern(led1=False, led2=False, buzzer=False)
+
+class ThreadPatternDriver:
+    """
+    Schaltet die Ausgänge in einem Hintergrundthread. Der Thread schläft bis zur
+    nächsten Flanke bzw. bei dauerhaft an- oder ausgeschalteten Ausgängen bis
+    zur nächsten Änderung des Musters, so dass er im Leerlauf keine Rechenzeit
+    benötigt. Damit sind auch Frequenzen möglich, die mit pulsweitenmodulierten
+    Pins nicht geschaltet werden können.
+    """
+
+    def __init__(self, led1, led2, buzzer):
+        """
+        Konstruktor. Parameter sind die drei gpiozero-Ausgänge.
+        """
+        self._outputs = (led1, led2, buzzer)
+        self._pattern = Pattern.OFF
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    def apply(self, pattern):
+        """
+        Neues Muster übernehmen. Ein unverändertes Muster weckt den Thread nicht.
+
+        THREADING: Darf in jedem Thread aufgerufen werden.
+        """
+        with self._condition:
+            if pattern == self._pattern:
+                return
+
+            self._pattern = pattern
+            self._condition.notify()
+
+    def close(self):
+        """
+        Thread beenden und alle Ausgänge ausschalten.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        self._thread.join()
+
+    def _thread_main(self):
+        """
+        Hintergrundthread zum periodischen Ein- und Ausschalten der Ausgänge.
+        """
+        phase_on = True
+
+        with self._condition:
+            while not self._closed:
+                pattern = self._pattern
+
+                if pattern.half_period_s is None or phase_on:
+                    self._write(pattern.led1, pattern.led2, pattern.buzzer)
+                else:
+                    self._write(False, False, False)
+
+                if pattern.half_period_s is None:
+                    phase_on = True
+                    self._condition.wait()
+                else:
+                    self._condition.wait(pattern.half_period_s)
+
+                    # Bei einer Änderung des Musters wieder mit der An-Phase beginnen
+                    phase_on = not phase_on if pattern == self._pattern else True
+
+            self._write(False, False, False)
+
+    def _write(self, *values):
+        for output, value in zip(self._outputs, values):
+            output.value = value
+
+class PigpioPatternDriver:
+    """
+    Übergibt das Blinkmuster als Waveform an den pigpio-Daemon, der die Pins
+    mit DMA-Timing unabhängig vom Programm schaltet. Das Programm muss nur bei
+    einer Änderung des Musters eine neue Waveform erzeugen. Setzt voraus, dass
+    gpiozero mit `PiGPIOFactory` verwendet wird.
+    """
+
+    def __init__(self, led1, led2, buzzer):
+        """
+        Konstruktor. Parameter sind die drei gpiozero-Ausgänge.
+        """
+        import pigpio
+
+        self._pigpio = pigpio
+        self._pi = gpiozero.Device.pin_factory.connection
+        self._outputs = (led1, led2, buzzer)
+        self._pins = [output.pin.number for output in self._outputs]
+        self._pattern = None
+        self._wave_id = None
+        self._lock = threading.Lock()
+
+    def apply(self, pattern):
+        """
+        Neues Muster übernehmen. Ein unverändertes Muster wird ignoriert.
+
+        THREADING: Darf in jedem Thread aufgerufen werden.
+        """
+        with self._lock:
+            if pattern == self._pattern:
+                return
+
+            self._pattern = pattern
+            self._stop_wave()
+
+            values = (pattern.led1, pattern.led2, pattern.buzzer)
+
+            if pattern.half_period_s is None:
+                for output, value in zip(self._outputs, values):
+                    output.value = value
+
+                return
+
+            mask = 0
+            all_pins = 0
+
+            for pin, value in zip(self._pins, values):
+                all_pins |= 1 << pin
+
+                if value:
+                    mask |= 1 << pin
+
+            half_period_us = int(pattern.half_period_s * 1000000)
+
+            # Alle drei Pins in jeder Phase schalten, damit kein Ausgang des
+            # vorigen Musters eingeschaltet bleibt
+            self._pi.wave_add_generic([
+                self._pigpio.pulse(mask, all_pins & ~mask, half_period_us),
+                self._pigpio.pulse(0, all_pins, half_period_us),
+            ])
+
+            self._wave_id = self._pi.wave_create()
+            self._pi.wave_send_repeat(self._wave_id)
+
+    def close(self):
+        """
+        Waveform beenden und alle Ausgänge ausschalten.
+        """
+        self.apply(Pattern.OFF)
+
+    def _stop_wave(self):
+        """
+        Laufende Waveform beenden und alle Ausgänge ausschalten, da sie in
+        der An-Phase angehalten worden sein kann.
+        """
+        if self._wave_id is not None:
+            self._pi.wave_tx_stop()
+            self._pi.wave_delete(self._wave_id)
+            self._wave_id = None
+
+            for output in self._outputs:
+                output.value = False
+
+def create_pattern_driver(led1, led2, buzzer):
+    """
+    Mit pigpio den `PigpioPatternDriver` verwenden, sonst den `ThreadPatternDriver`.
+    """
+    if hasattr(gpiozero.Device.pin_factory, "connection"):
+        try:
+            driver = PigpioPatternDriver(led1, led2, buzzer)
+            logging.info("Benutze pigpio-Waveforms für LED und Buzzer")
+            return driver
+        except:
+            logging.warning("pigpio-Waveforms nicht verfügbar, schalte LED und Buzzer per Thread")
+
+    return ThreadPatternDriver(led1, led2, buzzer)
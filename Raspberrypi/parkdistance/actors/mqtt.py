@@ -1,7 +1,11 @@
 # Vgl. https://pypi.org/project/paho-mqtt/
 
 import paho.mqtt.client as mqtt
-import dataclasses, json, logging, ssl
+import logging, ssl, threading, time
+from collections import deque
+from parkdistance import codec, metrics
+from parkdistance.report import ReportByException
+from parkdistance.window import WindowAggregator
 
 class MQTTHandler:
     """
@@ -11,7 +15,7 @@ class MQTTHandler:
     "Command and Control" genannt.
     """
 
-    def __init__(self, device, config):
+    def __init__(self, device, config, spool=None, client=None):
         """
         Konstruktor. Im zweiten Parameter muss ein Konfigurationsobjekt mit folgenden
         Properties übergeben werden:
@@ -24,18 +28,77 @@ class MQTTHandler:
             * tls_enable: Verschlüsselte Verbindung zulassen (optional)
             * topic_send: Topic zum Senden von Messwerten an das Backend
             * topic_recieve: Topic zum Empfangen von Befehlen aus dem Backend
+            * topic_command: Topic für Befehle nur an dieses Device (optional)
+            * topic_status: Topic für die Meldungen ONLINE und OFFLINE (optional)
+            * groups: Kommagetrennte Gruppen, deren Kommandos empfangen werden (optional)
+            * topic_group: Kommando-Topic einer Gruppe mit dem Platzhalter `{group}` (optional)
+            * topic_ack: Topic für die Bestätigung empfangener Kommandos (optional)
+            * batch_enable: Alle neuen Messwerte in einer Nachricht senden (optional)
+            * codec: Nachrichtenformat der Messwerte, "json" oder "binary" (optional)
+            * deadband: Nur Änderungen um mehr als so viele Meter senden (optional)
+            * heartbeat_interval: Mit `deadband` spätestens nach so vielen Sekunden
+              trotzdem einen Messwert senden (optional)
+            * window_interval: Statistik je Zeitfenster von so vielen Sekunden senden (optional)
+            * topic_window: Topic für die Statistiken der Zeitfenster (optional)
+            * window_only: Nur die Statistiken und keine einzelnen Messwerte senden (optional)
+            * occupied_distance: Abstand in Metern, bis zu dem der Platz belegt ist (optional)
 
         Der erste Parameter ist das `Device`-Objekt zu dem der Handler gehört. Wird
         benötigt, um in den MQTT-Threads auf das Device zugreifen zu können.
+
+        Optional kann im dritten Parameter ein `Spool` übergeben werden, in dem die
+        Messwerte bei fehlender Verbindung dauerhaft zwischengespeichert werden.
+        In diesem Fall werden zusätzlich folgende Properties ausgewertet:
+
+            * spool_drain_rate: Maximal nachgesendete Messwerte je Sekunde (optional)
+            * spool_max_inflight: Maximal unbestätigte Messwerte beim Nachsenden (optional)
+
+        Im vierten Parameter kann anstelle eines neuen `paho.mqtt.client.Client`
+        ein anderes Objekt mit derselben Schnittstelle übergeben werden, zum
+        Beispiel für eine Simulation ohne MQTT-Broker.
         """
         self._device = device
+        self._device.parameters.declare("alarm", bool, False)
         self._config = config
         self._connected = False
+        self._batch_enable = config.getboolean("batch_enable", False)
+        self._sent_count = 0
+        self._codec = codec.get_codec(config.get("codec", "json"))
+        self._groups = [group.strip() for group in config.get("groups", "").split(",") if group.strip()]
+        self._command_ids = deque(maxlen=100)
+
+        self._report = None
+        self._summaries = deque(maxlen=1000)
+
+        if config.get("deadband", ""):
+            self._report = ReportByException(float(config["deadband"]), float(config.get("heartbeat_interval", 300)))
+
+        self._window = None
+        self._windows = deque(maxlen=1000)
+        self._window_only = False
 
-        self._mqtt = mqtt.Client()
+        if config.get("window_interval", ""):
+            self._window = WindowAggregator(float(config["window_interval"]), float(config.get("occupied_distance", 0.5)))
+            self._window_only = config.getboolean("window_only", False)
+
+        self._spool = spool
+        self._spool_drain_rate = float(config.get("spool_drain_rate", 50))
+        self._spool_max_inflight = int(config.get("spool_max_inflight", 200))
+        self._spool_credit = 0.0
+        self._spool_last_drain_s = time.monotonic()
+        self._spool_inflight = {}
+        self._spool_rewind = False
+        self._lock = threading.RLock()
+
+        self._mqtt = client if client is not None else mqtt.Client()
         self._mqtt.on_connect    = self._on_connect
         self._mqtt.on_disconnect = self._on_disconnect
         self._mqtt.on_message    = self._on_message
+        self._mqtt.on_publish    = self._on_publish
+
+        # Meldet der Broker, sobald die Verbindung unerwartet abbricht
+        if config.get("topic_status", ""):
+            self._mqtt.will_set(config["topic_status"], payload=self._status_payload("OFFLINE"), qos=1, retain=True)
 
         logging.info(f"Stelle Verbindung zum MQTT-Server her: {config['host']}, Port {config['port']}")
         self._mqtt.connect(host=config["host"], port=int(config["port"]), keepalive=int(config["keepalive"]))
@@ -56,7 +119,8 @@ class MQTTHandler:
         Callback-Methode, die nach dem versuchten Verbindungsaufbau mit dem MQTT-Broker
         aufgerufen wird. Hier werden die überwachten Topics aboniert. Erfolgt hier und
         nicht im Konstruktor, damit die Abos bei einem erneuten Verbindungsaufbau nicht
-        verloren gehen.
+        verloren gehen. Mit `topic_status` meldet sich das Device zudem als online,
+        was die beim Verbindungsabbruch vom Broker gesendete Meldung OFFLINE ersetzt.
 
         THREADING: Diese Methode läuft im MQTT-Thread.
         """
@@ -76,6 +140,14 @@ class MQTTHandler:
             self._connected = True
             logging.info(f"Aboniere MQTT-Topic {self._config['topic_receive']}")
             self._mqtt.subscribe(self._config["topic_receive"])
+
+            # Gezielte Kommandos mit QoS 1, da sie bestätigt werden
+            for topic in self._command_topics():
+                logging.info(f"Aboniere MQTT-Topic {topic}")
+                self._mqtt.subscribe(topic, qos=1)
+
+            if self._config.get("topic_status", ""):
+                self._mqtt.publish(self._config["topic_status"], payload=self._status_payload("ONLINE"), qos=1, retain=True)
         else:
             self._connected = False
 
@@ -88,28 +160,59 @@ class MQTTHandler:
         """
         self._connected = False
 
+        # Unbestätigte Messwerte aus dem Zwischenspeicher später erneut senden
+        with self._lock:
+            self._spool_inflight.clear()
+            self._spool_rewind = True
+
+    def _on_publish(self, client, userdata, mid):
+        """
+        Callback-Methode, die aufgerufen wird, sobald der Broker den Empfang einer
+        Nachricht mit QoS 1 bestätigt hat. Die darin enthaltenen Messwerte können
+        dann aus dem Zwischenspeicher gelöscht werden.
+
+        THREADING: Diese Methode läuft im MQTT-Thread.
+        """
+        with self._lock:
+            ids = self._spool_inflight.pop(mid, None)
+
+        if ids:
+            self._spool.remove(ids)
+
     def _on_message(self, client, userdata, message):
         """
         Wertet ein über MQTT empfangenes Kommando zur Fernsteuerung des Devices aus
         und führt die jeweilige Aktion direkt aus.
 
+        Kommandos des `CommandService` im Backend besitzen eine `id`, die mit dem
+        Kommando `ACK` auf `topic_ack` bestätigt wird. Wiederholt das Backend ein
+        Kommando, weil die Bestätigung verloren ging, wird es nur erneut bestätigt,
+        aber nicht noch einmal ausgeführt.
+
         THREADING: Diese Methode läuft im MQTT-Thread.
         """
         logging.info(f"Empfange Kommando für dieses Device: {message.payload}")
 
-        payload = json.loads(message.payload)
+        payload = codec.decode(message.payload)
         command = payload.get("command", "").upper()
+        command_id = payload.get("id")
+
+        if command_id is not None:
+            self._acknowledge(command_id)
+
+            if command_id in self._command_ids:
+                return
+
+            self._command_ids.append(command_id)
 
         if command == "ALARM_ON":
             logging.warning("Alarm, alarm, es brennt ...")
             
-            self._device.parameters["alarm"] = True
-            self._device.parameters["silent"] = False
+            self._device.parameters.update(alarm=True, silent=False)
         elif command == "ALARM_OFF":
             logging.warning("Backend beendet den Alarm")
 
-            self._device.parameters["alarm"] = False
-            self._device.parameters["silent"] = False
+            self._device.parameters.update(alarm=False, silent=False)
 
     def __call__(self, device):
         """
@@ -117,18 +220,251 @@ class MQTTHandler:
         und Aktoren zu interagieren und die Device-Parameter zu beeinflussen.
         Sendet alle noch nicht versendeten Einträge aus `distance_measurement_ringbuffer`
         an das Backend.
+
+        Welche Einträge noch nicht versendet wurden, ergibt sich aus dem Vergleich
+        von `distance_measurement_count` mit der Anzahl bereits versendeter Messwerte.
+        Im Batch-Betrieb werden alle neuen Messwerte gemeinsam als Kommando
+        `MEASUREMENT_BATCH` gesendet, ansonsten einzeln als `MEASUREMENT`.
+
+        Mit einem `Spool` werden die Messwerte mit QoS 1 gesendet und bei fehlender
+        Verbindung zwischengespeichert. Solange der Zwischenspeicher nicht leer
+        ist, werden auch neue Messwerte dort angehängt, damit die Reihenfolge
+        erhalten bleibt.
+
+        Mit einem Totband werden nur geänderte Messwerte gesendet. Für die
+        zurückgehaltenen Messwerte wird vor dem nächsten gesendeten Messwert
+        eine Zusammenfassung als Kommando `MEASUREMENT_SUMMARY` gesendet. Fehlt
+        mit einem `Spool` die Verbindung, bleibt sie im Hauptspeicher und wird
+        nach dem Wiederaufbau vor den zwischengespeicherten Messwerten gesendet.
+
+        Mit `window_interval` wird zusätzlich nach jedem Zeitfenster eine
+        Statistik aller darin gemessenen Werte als Kommando `MEASUREMENT_WINDOW`
+        auf `topic_window` gesendet, mit `window_only` anstelle der einzelnen
+        Messwerte.
+        """
+        ringbuffer = device.parameters.get("distance_measurement_ringbuffer")
+        measurements = ()
+        count = self._sent_count
+
+        if ringbuffer is not None:
+            count = ringbuffer.count
+            measurements = ringbuffer.since(self._sent_count)
+
+            if count - self._sent_count > len(measurements):
+                logging.warning(f"{count - self._sent_count - len(measurements)} Messwerte wurden vor dem Versand überschrieben")
+
+        if self._window is not None:
+            self._aggregate(measurements)
+
+            if self._window_only:
+                measurements = ()
+
+        sections = [(None, measurements)]
+
+        if measurements and self._report is not None:
+            sections = self._report_by_exception(measurements)
+
+        for summary, measurements in sections:
+            if summary is not None:
+                self._summaries.append(summary)
+
+            # Zusammenfassungen vor den folgenden Messwerten senden
+            if self._summaries:
+                self._send_summaries()
+
+            if measurements:
+                if self._spool is None:
+                    self._publish_measurements(measurements)
+                elif self._connected and not len(self._spool):
+                    self._publish_measurements(measurements, qos=1)
+                else:
+                    self._spool.append(measurements)
+
+        metrics.SUMMARIES_PENDING.set(len(self._summaries))
+
+        self._sent_count = count
+
+        if self._windows:
+            self._send_windows()
+
+        metrics.WINDOWS_PENDING.set(len(self._windows))
+
+        if self._spool is not None:
+            self._drain_spool()
+
+    def _report_by_exception(self, measurements):
+        """
+        Nur die Messwerte zurückgeben, die sich gegenüber dem zuletzt gesendeten
+        Wert ausreichend geändert haben oder wegen des Heartbeats fällig sind.
+        Rückgabewert ist eine Liste von Abschnitten aus der Zusammenfassung der
+        davor zurückgehaltenen Messwerte oder `None` und den danach zu sendenden
+        Messwerten, damit jede Zusammenfassung an der richtigen Stelle landet.
+        """
+        now_s = time.monotonic()
+        result = [(None, [])]
+
+        for measurement in measurements:
+            measurement, summary = self._report.process(measurement, now_s)
+
+            if summary is not None:
+                result.append((summary, []))
+
+            if measurement is not None:
+                result[-1][1].append(measurement)
+
+        return result
+
+    def _aggregate(self, measurements):
+        """
+        Messwerte den Zeitfenstern hinzufügen und die Statistiken abgeschlossener
+        Fenster zum Senden vormerken.
+        """
+        for measurement in measurements:
+            window = self._window.add(measurement)
+
+            if window is not None:
+                self._windows.append(window)
+
+        window = self._window.expire(int(time.time() * 1000))
+
+        if window is not None:
+            self._windows.append(window)
+
+    def _send_summaries(self):
+        """
+        Vorgemerkte Zusammenfassungen zurückgehaltener Messwerte senden. Mit einem
+        `Spool` werden sie bei fehlender Verbindung bis zum nächsten Versuch im
+        Hauptspeicher behalten.
+        """
+        if self._spool is not None and not self._connected:
+            return
+
+        qos = 0 if self._spool is None else 1
+
+        while self._summaries:
+            self._publish({"command": "MEASUREMENT_SUMMARY", "data": self._summaries.popleft()}, qos)
+
+    def _send_windows(self):
         """
-        for measurement in device.parameters["distance_measurement_ringbuffer"]:
-            if hasattr(measurement, "_mqtt_sent"):
-                continue
+        Vorgemerkte Statistiken der Zeitfenster senden. Wie die Zusammenfassungen
+        werden sie mit einem `Spool` bei fehlender Verbindung im Hauptspeicher
+        behalten.
+        """
+        if self._spool is not None and not self._connected:
+            return
+
+        qos = 0 if self._spool is None else 1
+        topic = self._config.get("topic_window", "") or self._config["topic_send"]
+
+        while self._windows:
+            self._publish({"command": "MEASUREMENT_WINDOW", "data": self._windows.popleft()}, qos, topic)
+
+    def _drain_spool(self):
+        """
+        Zwischengespeicherte Messwerte mit begrenzter Rate nachsenden, solange eine
+        Verbindung zum Broker besteht. Die Messwerte werden mit QoS 1 gesendet und
+        erst nach der Bestätigung durch den Broker aus dem Zwischenspeicher gelöscht.
+        Die Anzahl gleichzeitig unbestätigter Messwerte ist begrenzt, damit der
+        Speicherbedarf auch nach langen Unterbrechungen konstant bleibt.
+        """
+        now_s = time.monotonic()
+        self._spool_credit = min(self._spool_credit + self._spool_drain_rate * (now_s - self._spool_last_drain_s), self._spool_max_inflight)
+        self._spool_last_drain_s = now_s
+
+        with self._lock:
+            rewind, self._spool_rewind = self._spool_rewind, False
+            inflight = sum(len(ids) for ids in self._spool_inflight.values())
+
+        metrics.INFLIGHT_MESSAGES.set(inflight)
+        metrics.SPOOL_LENGTH.set(len(self._spool))
+
+        if rewind:
+            self._spool.rewind()
+
+        if not self._connected or not len(self._spool):
+            self._spool.maybe_commit()
+            return
+
+        limit = int(min(self._spool_credit, self._spool_max_inflight - inflight))
+        rows = self._spool.read(limit)
+        self._spool_credit -= len(rows)
+
+        if rows:
+            logging.info(f"Sende {len(rows)} zwischengespeicherte Messwerte, {len(self._spool)} verbleibend")
 
-            self._mqtt.publish(
-                qos = 0,
-                topic = self._config["topic_send"],
-                payload = json.dumps({
+        chunks = [rows] if self._batch_enable else [[row] for row in rows]
+
+        for chunk in chunks:
+            with self._lock:
+                infos = self._publish_measurements([measurement for id, measurement in chunk], qos=1)
+                self._spool_inflight[infos[0].mid] = [id for id, measurement in chunk]
+
+        self._spool.maybe_commit()
+
+    def _publish_measurements(self, measurements, qos=0):
+        """
+        Sendet die übergebenen Messwerte an das Backend, je nach Konfiguration
+        gemeinsam oder einzeln. Rückgabewert ist eine Liste der gesendeten
+        Nachrichten.
+        """
+        if self._batch_enable:
+            return [self._publish({
+                "command": "MEASUREMENT_BATCH",
+                "data": [measurement.to_dict() for measurement in measurements],
+            }, qos)]
+        else:
+            return [
+                self._publish({
                     "command": "MEASUREMENT",
-                    "data": dataclasses.asdict(measurement),
-                })
-            )
+                    "data": measurement.to_dict(),
+                }, qos)
+                for measurement in measurements
+            ]
+
+    def _publish(self, message, qos=0, topic=None):
+        """
+        Sendet eine Nachricht an das Backend, ohne anderes Topic auf `topic_send`.
+        """
+        metrics.MESSAGES_PUBLISHED.labels(message["command"]).inc()
+
+        return self._mqtt.publish(
+            qos = qos,
+            topic = topic or self._config["topic_send"],
+            payload = self._codec.encode(message)
+        )
+
+    def _status_payload(self, command, data=None):
+        """
+        Meldung ONLINE oder OFFLINE für `topic_status` bzw. `ACK` für `topic_ack`.
+        Unabhängig vom Format der Messwerte immer als JSON, damit sie auch ohne
+        dieses lesbar bleibt.
+        """
+        message = {"command": command}
+
+        # Gruppen für den CommandService im Backend
+        if command == "ONLINE" and self._groups:
+            data = {"groups": self._groups}
+
+        if data is not None:
+            message["data"] = data
+
+        return codec.get_codec("json").encode(message)
+
+    def _command_topics(self):
+        """
+        Topics für Kommandos nur an dieses Device und an seine Gruppen.
+        """
+        topics = [self._config.get("topic_command", "")]
+
+        if self._config.get("topic_group", ""):
+            topics.extend(self._config["topic_group"].replace("{group}", group) for group in self._groups)
+
+        return [topic for topic in topics if topic]
+
+    def _acknowledge(self, command_id):
+        """
+        Empfang eines Kommandos mit der übergebenen `id` bestätigen.
+        """
+        if self._config.get("topic_ack", ""):
+            self._mqtt.publish(self._config["topic_ack"], payload=self._status_payload("ACK", {"id": command_id}), qos=1)
 
-            measurement._mqtt_sent = True
@@ -0,0 +1,180 @@
+"""
+Kodierung der zwischen Devices und Backend ausgetauschten MQTT-Nachrichten.
+
+Standardmäßig werden alle Nachrichten als JSON gesendet. Für Messwerte gibt
+es zusätzlich ein kompaktes Binärformat, das vor allem bei Mobilfunkverbindungen
+mit begrenztem Datenvolumen deutlich weniger Bytes benötigt und schneller zu
+verarbeiten ist. Der Empfänger erkennt das Format am ersten Byte der Nachricht,
+so dass Devices mit unterschiedlichen Formaten gleichzeitig betrieben werden
+können.
+
+Aufbau einer binären Nachricht (Little Endian):
+
+    * 1 Byte:  Kennung und Version des Binärformats (0xB1 oder 0xB2)
+    * 1 Byte:  Kommando (1 = MEASUREMENT, 2 = MEASUREMENT_BATCH)
+    * 2 Bytes: Anzahl der folgenden Messwerte
+    * Je Messwert 12 Bytes (0xB1) bzw. 13 Bytes (0xB2):
+        - 8 Bytes: Zeitstempel in Millisekunden seit 1970 (int64)
+        - 4 Bytes: Abstand in Metern (float32)
+        - Nur 0xB2, 1 Byte: Konfidenz des Messwerts, 0 bis 255 für 0 bis 1 (uint8)
+
+Version 0xB2 wird nur verwendet, wenn die Messwerte eine Konfidenz enthalten.
+Ansonsten wird weiterhin Version 0xB1 gesendet, so dass auch ältere Empfänger
+die Nachrichten verstehen.
+
+Diese Datei ist in den Paketen `parkdistance` und `simplelogger` identisch
+vorhanden und muss bei Änderungen in beiden Paketen angepasst werden.
+"""
+
+import json, struct
+from datetime import datetime, timezone
+
+BINARY_MARKER = 0xB1
+BINARY_MARKER_CONFIDENCE = 0xB2
+
+_HEADER = struct.Struct("<BBH")
+
+# Größte im Header darstellbare Anzahl Messwerte
+_MAX_RECORDS = 0xFFFF
+
+_RECORDS = {
+    BINARY_MARKER: struct.Struct("<qf"),
+    BINARY_MARKER_CONFIDENCE: struct.Struct("<qfB"),
+}
+
+_COMMAND_CODES = {
+    "MEASUREMENT": 1,
+    "MEASUREMENT_BATCH": 2,
+}
+
+_COMMAND_NAMES = {code: name for name, code in _COMMAND_CODES.items()}
+
+class JSONCodec:
+    """
+    Kodierung aller Nachrichten als JSON-Text.
+    """
+
+    name = "json"
+
+    def encode(self, message):
+        """
+        Nachricht (Dictionary) in Bytes umwandeln.
+        """
+        return json.dumps(message).encode()
+
+    def decode(self, payload):
+        """
+        Empfangene Bytes in eine Nachricht (Dictionary) umwandeln.
+        """
+        return json.loads(payload)
+
+class BinaryCodec:
+    """
+    Kodierung der Messwerte im kompakten Binärformat. Alle anderen Nachrichten
+    werden weiterhin als JSON kodiert.
+    """
+
+    name = "binary"
+
+    def encode(self, message):
+        """
+        Nachricht (Dictionary) in Bytes umwandeln. Mehr als 65535 Messwerte
+        passen nicht in den Header und müssen auf mehrere Nachrichten verteilt
+        werden.
+        """
+        command = message.get("command", "")
+
+        if not command in _COMMAND_CODES:
+            return JSON.encode(message)
+
+        data = message.get("data", {})
+
+        if command == "MEASUREMENT":
+            data = [data]
+
+        if len(data) > _MAX_RECORDS:
+            raise ValueError(f"Zu viele Messwerte für eine binäre Nachricht: {len(data)}")
+
+        with_confidence = any(d.get("confidence") is not None for d in data)
+        marker = BINARY_MARKER_CONFIDENCE if with_confidence else BINARY_MARKER
+        record = _RECORDS[marker]
+
+        payload = bytearray(_HEADER.size + record.size * len(data))
+        _HEADER.pack_into(payload, 0, marker, _COMMAND_CODES[command], len(data))
+
+        offset = _HEADER.size
+
+        for d in data:
+            timestamp_ms = int(datetime.fromisoformat(d["datetime_iso"]).timestamp() * 1000)
+
+            if with_confidence:
+                confidence = d.get("confidence")
+                confidence = 255 if confidence is None else round(min(max(confidence, 0), 1) * 255)
+                record.pack_into(payload, offset, timestamp_ms, d["distance_m"], confidence)
+            else:
+                record.pack_into(payload, offset, timestamp_ms, d["distance_m"])
+
+            offset += record.size
+
+        return bytes(payload)
+
+    def decode(self, payload):
+        """
+        Empfangene Bytes in eine Nachricht (Dictionary) umwandeln. Die Zeitstempel
+        werden dabei in UTC-Zeit umgerechnet.
+        """
+        try:
+            marker, command, count = _HEADER.unpack_from(payload, 0)
+            command = _COMMAND_NAMES[command]
+            record = _RECORDS[marker]
+            records = record.iter_unpack(memoryview(payload)[_HEADER.size:_HEADER.size + count * record.size])
+
+            data = []
+
+            for values in records:
+                d = {
+                    "distance_m": round(values[1], 4),
+                    "datetime_iso": datetime.fromtimestamp(values[0] / 1000, tz=timezone.utc).isoformat(timespec="milliseconds"),
+                }
+
+                if marker == BINARY_MARKER_CONFIDENCE:
+                    d["confidence"] = round(values[2] / 255, 2)
+
+                data.append(d)
+        except (struct.error, KeyError):
+            raise ValueError("Ungültige binäre Nachricht")
+
+        if len(data) != count:
+            raise ValueError("Unvollständige binäre Nachricht")
+
+        if command == "MEASUREMENT" and count != 1:
+            raise ValueError("Binäre Nachricht MEASUREMENT muss genau einen Messwert enthalten")
+
+        if command == "MEASUREMENT":
+            data = data[0]
+
+        return {"command": command, "data": data}
+
+JSON = JSONCodec()
+BINARY = BinaryCodec()
+
+CODECS = {codec.name: codec for codec in (JSON, BINARY)}
+
+def get_codec(name):
+    """
+    Codec anhand seines Namens ("json" oder "binary") ermitteln.
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unbekanntes Nachrichtenformat: {name}")
+
+def decode(payload):
+    """
+    Empfangene Nachricht unabhängig von ihrem Format dekodieren. Das Format
+    wird anhand des ersten Bytes erkannt.
+    """
+    if payload[:1] and payload[0] in _RECORDS:
+        return BINARY.decode(payload)
+    else:
+        return JSON.decode(payload)
@@ -1,14 +1,34 @@
-import time, traceback
+import heapq, threading, time, traceback
+from parkdistance import metrics
+from parkdistance.parameters import ParameterStore
 
 class Device:
     """
     Klasse zur Steuerung des Devices und seines Gesamtzustands. Beinhaltet die
-    Hauptschleife des Programms, in der mehrmals je Sekunde die Sensoren abgefragt
-    und die Deviceparameter entsprechend aktualisiert werden. Anhand dieser werden
-    dann die Aktoren angesteuert.
+    Hauptschleife des Programms, in der die Sensoren abgefragt und die Device-
+    parameter entsprechend aktualisiert werden. Anhand dieser werden dann die
+    Aktoren angesteuert.
 
-    Die Device-Parameter befinden sich im Dictionary `self.parameters`, das von
-    den Sensoren und Aktoren verwendet wird.
+    Die Device-Parameter befinden sich im `ParameterStore` `self.parameters`, der
+    von den Sensoren und Aktoren wie ein Dictionary verwendet werden kann.
+
+    Sensoren und Aktoren werden nicht mehr alle gemeinsam in einem festen Takt
+    aufgerufen. Stattdessen kann jedes Objekt selbst bestimmen, wann es aufgerufen
+    werden will:
+
+        * Attribut `period`: Aufruf alle N Sekunden. Fehlt das Attribut, wird die
+          Update-Frequenz der Hauptschleife verwendet. `None` bedeutet, dass das
+          Objekt nur bei Ereignissen aufgerufen wird.
+
+        * Attribut `watch`: Liste von Device-Parametern. Das Objekt wird sofort
+          aufgerufen, sobald sich einer dieser Parameter ändert.
+
+        * Methode `setup(device)`: Wird beim Hinzufügen zum Device aufgerufen, zum
+          Beispiel um Callbacks für Hardwareereignisse zu registrieren, die dann
+          mit `device.wake(self)` einen sofortigen Aufruf auslösen.
+
+    Zwischen zwei Aufrufen schläft die Hauptschleife, bis der nächste Aufruf
+    fällig ist oder ein Ereignis eintritt.
     """
 
     def __init__(self):
@@ -16,41 +36,143 @@ class Device:
         Konstruktor.
         """
         self._sensors_actors = []
-        self.parameters = {}
+        self._wakeups = set()
+        self._condition = threading.Condition()
+        self._order = {}
+        self._schedule = []
+        self._call_seconds = []
+        self._overruns = []
+        self.parameters = ParameterStore()
 
     def add_sensor_actor(self, sensor_actor):
         """
         Sensor oder Aktor dem Device hinzufügen, damit er in der Hauptschleife
-        des Devices periodisch abgefragt werden kann. Das übergebene Objekt
-        muss ein Callable sein, das als einzigen Parameter ein `Device`-Objekt
-        erwartet.
+        des Devices aufgerufen werden kann. Das übergebene Objekt muss ein
+        Callable sein, das als einzigen Parameter ein `Device`-Objekt erwartet.
+        Die Objekte werden immer in der Reihenfolge aufgerufen, in der sie
+        hinzugefügt wurden.
         """
         self._sensors_actors.append(sensor_actor)
-    
+
+        watch = getattr(sensor_actor, "watch", ())
+
+        if watch:
+            self.parameters.subscribe(lambda changes: self.wake(sensor_actor), keys=watch)
+
+        if hasattr(sensor_actor, "setup"):
+            sensor_actor.setup(self)
+
+    def wake(self, sensor_actor):
+        """
+        Sensor oder Aktor so bald wie möglich in der Hauptschleife aufrufen.
+
+        THREADING: Darf in jedem Thread aufgerufen werden.
+        """
+        with self._condition:
+            self._wakeups.add(sensor_actor)
+            self._condition.notify()
+
+    def start(self, update_frequency=2):
+        """
+        Zeitplan für die Aufrufe der Sensoren und Aktoren anlegen. Wird von
+        `loop_forever()` aufgerufen und muss nur dann selbst aufgerufen werden,
+        wenn das Device stattdessen mit `tick()` gesteuert wird. Die Update-
+        Frequenz gilt für alle Sensoren und Aktoren ohne eigenes Attribut `period`.
+        """
+        default_period_s = 1.0 / update_frequency
+        now_s = time.monotonic()
+
+        self._order = {sensor_actor: index for index, sensor_actor in enumerate(self._sensors_actors)}
+        self._schedule = []
+
+        names = [type(sensor_actor).__name__ for sensor_actor in self._sensors_actors]
+        self._call_seconds = [metrics.CALL_SECONDS.labels(name) for name in names]
+        self._overruns = [metrics.TICK_OVERRUNS.labels(name) for name in names]
+
+        for index, sensor_actor in enumerate(self._sensors_actors):
+            period_s = getattr(sensor_actor, "period", default_period_s)
+
+            if period_s is not None:
+                self._schedule.append((now_s, index, period_s))
+
+        heapq.heapify(self._schedule)
+
+    def next_deadline(self):
+        """
+        Zeitpunkt laut `time.monotonic()`, zu dem der nächste regelmäßige Aufruf
+        fällig ist, oder `None`, wenn es keine regelmäßigen Aufrufe gibt.
+        """
+        return self._schedule[0][0] if self._schedule else None
+
+    def tick(self):
+        """
+        Alle fälligen und durch Ereignisse aufgeweckten Sensoren und Aktoren
+        einmal aufrufen, ohne zu warten. Ermöglicht es, viele Devices in einem
+        gemeinsamen Thread zu betreiben, zum Beispiel in einer Simulation.
+        Rückgabewert ist wie bei `next_deadline()` der nächste fällige Zeitpunkt.
+        """
+        with self._condition:
+            due = {self._order[sensor_actor] for sensor_actor in self._wakeups}
+            self._wakeups.clear()
+
+        now_s = time.monotonic()
+        schedule = self._schedule
+
+        if schedule and schedule[0][0] <= now_s:
+            metrics.TICK_LATENESS.observe(now_s - schedule[0][0])
+
+        while schedule and schedule[0][0] <= now_s:
+            deadline_s, index, period_s = heapq.heappop(schedule)
+            due.add(index)
+
+            # Bei Verzug keine Aufrufe nachholen, sondern im Takt weitermachen
+            deadline_s += period_s
+
+            if deadline_s <= now_s:
+                deadline_s = now_s + period_s
+                self._overruns[index].inc()
+
+            heapq.heappush(schedule, (deadline_s, index, period_s))
+
+        # Logik der Sensoren und Aktoren ausführen
+        for index in sorted(due):
+            start_s = time.perf_counter()
+
+            try:
+                self._sensors_actors[index](self)
+            except KeyboardInterrupt:
+                raise
+            except:
+                traceback.print_exc()
+
+            self._call_seconds[index].observe(time.perf_counter() - start_s)
+
+        metrics.TICK_SECONDS.observe(time.monotonic() - now_s)
+        return self.next_deadline()
+
     def loop_forever(self, update_frequency=2):
         """
         Hauptschleife zur Steuerung des Devices. Muss im Hauptprogramm aufgerufen
-        werden, damit das Device periodisch seine Sensoren und Aktorek aufrufen
-        kann und diese ihre Logik ausführen.
-        """
-        max_sleep_time_s = 1.0 / update_frequency
-        actual_sleep_time_s = 0.0
-        prev_time_s = 0.0
-
-        while True:
-            # Variable Dauer abwarten, um die gewünschte Update-Frequenz zu erhalten
-            current_time_s = time.monotonic()
-            actual_sleep_time_s = max_sleep_time_s - (current_time_s - prev_time_s)
-            prev_time_s = current_time_s
-
-            if actual_sleep_time_s > 0:
-                time.sleep(actual_sleep_time_s)
-
-            # Logik der Sensoren und Aktoren ausführen
-            for sensor_actor in self._sensors_actors:
-                try:
-                    sensor_actor(self)
-                except KeyboardInterrupt:
-                    return
-                except:
-                    traceback.print_exc()
\ No newline at end of file
+        werden, damit das Device seine Sensoren und Aktoren aufrufen kann und diese
+        ihre Logik ausführen. Die Update-Frequenz gilt für alle Sensoren und Aktoren
+        ohne eigenes Attribut `period`.
+        """
+        self.start(update_frequency)
+
+        try:
+            while True:
+                # Bis zum nächsten fälligen Aufruf oder Ereignis schlafen
+                with self._condition:
+                    deadline_s = self.next_deadline()
+
+                    if not self._wakeups and deadline_s is None:
+                        self._condition.wait()
+                    elif not self._wakeups:
+                        timeout_s = deadline_s - time.monotonic()
+
+                        if timeout_s > 0:
+                            self._condition.wait(timeout_s)
+
+                self.tick()
+        except KeyboardInterrupt:
+            return
@@ -1,9 +1,11 @@
 import configparser, gpiozero, logging, os, time
+from parkdistance import metrics
 from parkdistance.device import Device
 from parkdistance.sensors.button import SilentButton
 from parkdistance.sensors.distance import DistanceSensor
 from parkdistance.actors.led_beeper import LedBeeper
 from parkdistance.actors.mqtt import MQTTHandler
+from parkdistance.spool import Spool
 
 def main():
     """
@@ -35,18 +37,47 @@ def main():
     config = configparser.ConfigParser(interpolation=None)
     config.read(configfile)
 
+    # Metriken für Prometheus bereitstellen
+    if config.getboolean("metrics", "enable", fallback=False):
+        metrics.start_http_server(config["metrics"])
+
+    # Zwischenspeicher für Messwerte bei fehlender Verbindung zum Backend
+    spool = None
+
+    if config.getboolean("spool", "enable", fallback=False):
+        spool = Spool(config["spool"])
+
     # Device, Sensoren und Aktoren konfigurieren
+    led_beeper = None
+
     try:
         device = Device()
+        led_beeper = LedBeeper(led1_pin=7, led2_pin=8, buzzer_pin=13)
 
         device.add_sensor_actor(SilentButton(pin=23, pull_up=True))
-        device.add_sensor_actor(DistanceSensor(trigger_pin=10, echo_pin=9, ringbuffer_size=10))
-        device.add_sensor_actor(LedBeeper(led1_pin=7, led2_pin=8, buzzer_pin=13))
-        device.add_sensor_actor(MQTTHandler(device, config["mqtt"]))
+        device.add_sensor_actor(DistanceSensor(
+            trigger_pin       = 10,
+            echo_pin          = 9,
+            ringbuffer_size   = config.getint("distance", "ringbuffer_size", fallback=10),
+            sample_rate       = config.getfloat("distance", "sample_rate", fallback=10),
+            report_interval_s = config.getfloat("distance", "report_interval", fallback=1.0),
+            window            = config.getint("distance", "window", fallback=9),
+            outlier_threshold = config.getfloat("distance", "outlier_threshold", fallback=3.0),
+            log_every         = config.getint("distance", "log_every", fallback=1),
+        ))
+        device.add_sensor_actor(led_beeper)
+        device.add_sensor_actor(MQTTHandler(device, config["mqtt"], spool))
 
         device.loop_forever(update_frequency=1)
     except KeyboardInterrupt:
         pass
+    finally:
+        # Eine laufende pigpio-Waveform würde sonst nach Programmende weiterblinken
+        if led_beeper is not None:
+            led_beeper.close()
+
+        if spool is not None:
+            spool.close()
 
     ## Alte Version ohne Entkopplung der Objekte durch die Device-Klasse.
     ## Für kleinere Anwendungen ist diese Version auch gut bzw. sogar
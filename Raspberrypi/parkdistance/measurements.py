@@ -0,0 +1,177 @@
+import array, math
+from datetime import datetime
+
+class DistanceMeasurement:
+    """
+    Wert einer einzelnen Abstandsmessung mit Zeitstempel und optionaler Konfidenz
+    zwischen 0 und 1. Der Zeitstempel wird in Millisekunden seit 1970 gespeichert
+    und erst bei Bedarf als ISO-Text formatiert.
+    """
+
+    __slots__ = ("distance_m", "timestamp_ms", "confidence")
+
+    def __init__(self, distance_m, timestamp_ms, confidence=None):
+        self.distance_m = distance_m
+        self.timestamp_ms = timestamp_ms
+        self.confidence = confidence
+
+    @classmethod
+    def from_iso(cls, distance_m, datetime_iso, confidence=None):
+        """
+        Messwert mit einem Zeitstempel im ISO-Format erzeugen.
+        """
+        return cls(distance_m, int(datetime.fromisoformat(datetime_iso).timestamp() * 1000), confidence)
+
+    @property
+    def datetime_iso(self):
+        """
+        Zeitstempel als ISO-Text in lokaler Zeit.
+        """
+        return datetime.fromtimestamp(self.timestamp_ms / 1000).isoformat(timespec="milliseconds")
+
+    def to_dict(self):
+        """
+        Messwert als Dictionary für den Versand an das Backend. Die Konfidenz
+        ist nur enthalten, wenn sie bekannt ist.
+        """
+        result = {"distance_m": self.distance_m, "datetime_iso": self.datetime_iso}
+
+        if self.confidence is not None:
+            result["confidence"] = self.confidence
+
+        return result
+
+    def __eq__(self, other):
+        if not isinstance(other, DistanceMeasurement):
+            return NotImplemented
+
+        return (self.distance_m, self.timestamp_ms, self.confidence) == (other.distance_m, other.timestamp_ms, other.confidence)
+
+    def __repr__(self):
+        return f"DistanceMeasurement(distance_m={self.distance_m!r}, datetime_iso={self.datetime_iso!r}, confidence={self.confidence!r})"
+
+class MeasurementRing:
+    """
+    Ringpuffer fester Größe für Abstandsmessungen. Statt einzelner Objekte je
+    Messwert werden Abstand, Zeitstempel und Konfidenz in drei parallelen
+    `array`-Spalten gespeichert, die einmalig reserviert werden. Ein Messwert
+    belegt dadurch nur 24 Bytes, und beim Hinzufügen entstehen keine neuen
+    Objekte. `DistanceMeasurement`-Objekte werden erst beim Lesen erzeugt.
+
+    Jeder Messwert erhält eine fortlaufende Nummer. `count` ist die Anzahl aller
+    jemals hinzugefügten Messwerte, so dass ein Leser mit `since()` alle seit
+    seinem letzten Zugriff neuen Messwerte abrufen kann, solange sie noch nicht
+    überschrieben wurden.
+
+    THREADING: Darf nur im Hauptthread des Devices verwendet werden.
+    """
+
+    def __init__(self, size):
+        """
+        Konstruktor. Parameter:
+            * size: Maximale Anzahl Messwerte
+        """
+        self._distances = array.array("d", bytes(8 * size))
+        self._timestamps = array.array("q", bytes(8 * size))
+        self._confidences = array.array("d", [math.nan]) * size
+        self._size = size
+        self.count = 0
+
+    @property
+    def maxlen(self):
+        """
+        Maximale Anzahl Messwerte.
+        """
+        return self._size
+
+    def __len__(self):
+        return min(self.count, self._size)
+
+    def append(self, distance_m, timestamp_ms, confidence=None):
+        """
+        Messwert hinzufügen und bei vollem Puffer den ältesten überschreiben.
+        """
+        index = self.count % self._size
+        self._distances[index] = distance_m
+        self._timestamps[index] = timestamp_ms
+        self._confidences[index] = math.nan if confidence is None else confidence
+        self.count += 1
+
+    def since(self, count):
+        """
+        Alle Messwerte ab der fortlaufenden Nummer `count`, soweit noch vorhanden.
+        """
+        return MeasurementSlice(self, max(count, self.count - len(self)), self.count)
+
+    def __iter__(self):
+        return iter(self.since(0))
+
+    def __getitem__(self, index):
+        length = len(self)
+
+        if index < 0:
+            index += length
+
+        if not 0 <= index < length:
+            raise IndexError("Index außerhalb des Ringpuffers")
+
+        return self._record((self.count - length + index) % self._size)
+
+    def _record(self, index):
+        confidence = self._confidences[index]
+
+        return DistanceMeasurement(
+            self._distances[index],
+            self._timestamps[index],
+            None if math.isnan(confidence) else confidence,
+        )
+
+class MeasurementSlice:
+    """
+    Ausschnitt aus einem `MeasurementRing` ohne Kopie der Daten. `columns()`
+    liefert die Spalten als `memoryview`, beim Iterieren entstehen die einzelnen
+    `DistanceMeasurement`-Objekte. Ein Ausschnitt ist nur gültig, bis der
+    Ringpuffer die enthaltenen Messwerte überschreibt.
+    """
+
+    def __init__(self, ring, start, stop):
+        """
+        Konstruktor. Parameter sind der Ringpuffer und der Bereich der
+        fortlaufenden Nummern.
+        """
+        self._ring = ring
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return max(self._stop - self._start, 0)
+
+    def __iter__(self):
+        size = self._ring._size
+
+        for count in range(self._start, self._stop):
+            yield self._ring._record(count % size)
+
+    def columns(self):
+        """
+        Spalten des Ausschnitts. Da der Ausschnitt über das Ende des Ringpuffers
+        hinausreichen kann, wird eine Liste mit bis zu zwei Abschnitten geliefert,
+        die jeweils ein Tupel aus `memoryview`s auf Abstände, Zeitstempel und
+        Konfidenzen sind.
+        """
+        if not len(self):
+            return []
+
+        ring = self._ring
+        first = self._start % ring._size
+        last = first + len(self)
+        ranges = [(first, last)] if last <= ring._size else [(first, ring._size), (0, last - ring._size)]
+
+        return [
+            (
+                memoryview(ring._distances)[begin:end],
+                memoryview(ring._timestamps)[begin:end],
+                memoryview(ring._confidences)[begin:end],
+            )
+            for begin, end in ranges
+        ]
@@ -0,0 +1,85 @@
+# Vgl. https://prometheus.github.io/client_python/
+
+import logging
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+class _NoMetric:
+    """
+    Ersatz für alle Metriken, wenn `prometheus_client` nicht installiert ist.
+    Alle Methoden tun nichts, so dass die Messpunkte im Code unverändert
+    bleiben können.
+    """
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+def counter(name, documentation, labels=()):
+    """
+    Zähler anlegen, der nur steigen kann.
+    """
+    return prometheus_client.Counter(name, documentation, labels) if prometheus_client else _NoMetric()
+
+def gauge(name, documentation, labels=()):
+    """
+    Messwert anlegen, der steigen und fallen kann.
+    """
+    return prometheus_client.Gauge(name, documentation, labels) if prometheus_client else _NoMetric()
+
+def histogram(name, documentation, labels=(), buckets=None):
+    """
+    Histogramm für Dauern oder Größen anlegen, optional mit eigenen Grenzen.
+    """
+    if not prometheus_client:
+        return _NoMetric()
+
+    if buckets is None:
+        return prometheus_client.Histogram(name, documentation, labels)
+
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+# Auf dem Raspberry Pi dauern die meisten Aufrufe nur Bruchteile einer Millisekunde
+_FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# Hauptschleife (Device)
+TICK_SECONDS      = histogram("parkdistance_tick_seconds", "Dauer eines Durchlaufs der Hauptschleife", buckets=_FAST_BUCKETS)
+TICK_LATENESS     = histogram("parkdistance_tick_lateness_seconds", "Verspätung eines Durchlaufs gegenüber dem fälligen Zeitpunkt", buckets=_FAST_BUCKETS)
+TICK_OVERRUNS     = counter("parkdistance_tick_overruns_total", "Wegen Verzug ausgelassene regelmäßige Aufrufe", ["sensor_actor"])
+CALL_SECONDS      = histogram("parkdistance_call_seconds", "Dauer eines Aufrufs je Sensor oder Aktor", ["sensor_actor"], buckets=_FAST_BUCKETS)
+
+# Sensoren
+SENSOR_READ_SECONDS = histogram("parkdistance_sensor_read_seconds", "Dauer einer Abfrage des Abstandssensors", buckets=_FAST_BUCKETS)
+
+# Versand an das Backend (MQTTHandler)
+MESSAGES_PUBLISHED = counter("parkdistance_messages_published_total", "Gesendete Nachrichten je Kommando", ["command"])
+SPOOL_LENGTH       = gauge("parkdistance_spool_length", "Zwischengespeicherte, noch nicht gesendete Messwerte")
+INFLIGHT_MESSAGES  = gauge("parkdistance_inflight_messages", "Gesendete, aber noch nicht bestätigte Nachrichten aus dem Zwischenspeicher")
+SUMMARIES_PENDING  = gauge("parkdistance_summaries_pending", "Noch nicht gesendete Zusammenfassungen zurückgehaltener Messwerte")
+WINDOWS_PENDING    = gauge("parkdistance_windows_pending", "Noch nicht gesendete Statistiken abgeschlossener Zeitfenster")
+
+def start_http_server(config):
+    """
+    HTTP-Schnittstelle für Prometheus in einem Hintergrundthread starten. Das
+    Konfigurationsobjekt enthält die Properties `host` und `port` (optional).
+    Die Metriken können dann unter `http://<host>:<port>/metrics` abgerufen
+    werden.
+    """
+    if not prometheus_client:
+        logging.warning("Metriken sind aktiviert, aber prometheus_client ist nicht installiert")
+        return
+
+    host, port = config.get("host", "0.0.0.0"), int(config.get("port", 9100))
+    logging.info(f"Starte Metrik-Schnittstelle auf {host}, Port {port}")
+    prometheus_client.start_http_server(port, addr=host)
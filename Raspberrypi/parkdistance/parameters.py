@@ -0,0 +1,227 @@
+import threading
+from collections.abc import MutableMapping
+
+class ParameterStore(MutableMapping):
+    """
+    Threadsicherer Speicher für die Device-Parameter. Verhält sich wie ein
+    Dictionary, so dass die Sensoren und Aktoren wie bisher mit
+    `device.parameters["key"]` darauf zugreifen können, bietet aber zusätzlich:
+
+        * Atomare Änderungen mehrerer Parameter mit `update()` und `modify()`
+        * Konsistentes Lesen mehrerer Parameter mit `get_many()` und `snapshot()`
+        * Benachrichtigung bei Änderungen mit `subscribe()`
+        * Versionsnummern, die bei jeder Änderung hochgezählt werden
+        * Optionale Festlegung von Typ und Vorgabewert mit `declare()`
+
+    Als Änderung zählt nur ein neuer Parameter oder ein anderer Wert. Das
+    erneute Setzen desselben Werts löst keine Benachrichtigung aus. Veränderungen
+    innerhalb eines Werts, wie das Anhängen an einen Ringpuffer, werden nicht
+    erkannt und müssen über einen zweiten Parameter wie einen Zähler angezeigt
+    werden.
+
+    THREADING: Alle Methoden dürfen in jedem Thread aufgerufen werden. Die
+    Callbacks laufen im Thread, der die Änderung vorgenommen hat, und zwar
+    erst nach Freigabe der internen Sperre.
+    """
+
+    def __init__(self):
+        """
+        Konstruktor.
+        """
+        self._values = {}
+        self._versions = {}
+        self._types = {}
+        self._subscriptions = []
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def declare(self, key, type_, default=None):
+        """
+        Typ und Vorgabewert eines Parameters festlegen. Neue Werte werden danach
+        in den Typ umgewandelt, falls sie ihn nicht bereits haben. `None` ist
+        immer erlaubt. Ein bereits vorhandener Wert bleibt unverändert, so dass
+        mehrere Sensoren und Aktoren denselben Parameter deklarieren können.
+        """
+        with self._lock:
+            self._types[key] = type_
+
+            if key in self._values:
+                return
+
+            changes = self._apply({key: default})
+
+        self._notify(changes)
+
+    @property
+    def version(self):
+        """
+        Versionsnummer aller Parameter. Wird bei jeder Änderung hochgezählt.
+        """
+        return self._version
+
+    def version_of(self, key):
+        """
+        Versionsnummer der letzten Änderung eines Parameters oder 0, falls es
+        ihn nicht gibt.
+        """
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._values[key]
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._values[key]
+            self._version += 1
+            self._versions.pop(key, None)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._values))
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __repr__(self):
+        return f"ParameterStore({self.snapshot()[1]!r})"
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+
+            changes = self._apply({key: default})
+            value = self._values[key]
+
+        self._notify(changes)
+        return value
+
+    def get_many(self, *keys, default=None):
+        """
+        Mehrere Parameter auf einmal auslesen. Da dies unter einer gemeinsamen
+        Sperre geschieht, passen die Werte immer zueinander. Rückgabewert ist
+        ein Tupel in der Reihenfolge der übergebenen Schlüssel.
+        """
+        with self._lock:
+            return tuple(self._values.get(key, default) for key in keys)
+
+    def snapshot(self):
+        """
+        Kopie aller Parameter. Rückgabewert ist ein Tupel aus der Versionsnummer
+        und einem Dictionary mit den Werten.
+        """
+        with self._lock:
+            return self._version, dict(self._values)
+
+    def update(self, values=(), **kwargs):
+        """
+        Mehrere Parameter in einem Schritt ändern. Andere Threads sehen entweder
+        alle oder keine der Änderungen. Die Abonnenten werden danach einmal mit
+        allen tatsächlich geänderten Parametern benachrichtigt.
+        """
+        with self._lock:
+            changes = self._apply(dict(values, **kwargs))
+
+        self._notify(changes)
+
+    def modify(self, key, function, default=None):
+        """
+        Parameter atomar anhand seines bisherigen Werts ändern. Die übergebene
+        Funktion erhält den bisherigen Wert bzw. `default` und liefert den neuen
+        Wert, der auch zurückgegeben wird.
+        """
+        with self._lock:
+            value = function(self._values.get(key, default))
+            changes = self._apply({key: value})
+            value = self._values[key]
+
+        self._notify(changes)
+        return value
+
+    def increment(self, key, amount=1):
+        """
+        Zahlenwert eines Parameters atomar hochzählen. Ein fehlender Parameter
+        zählt als 0. Rückgabewert ist der neue Wert.
+        """
+        return self.modify(key, lambda value: value + amount, 0)
+
+    def subscribe(self, callback, keys=None):
+        """
+        Callback registrieren, der nach jeder Änderung der genannten Parameter
+        bzw. ohne Angabe von `keys` nach jeder Änderung aufgerufen wird. Der
+        Callback erhält ein Dictionary mit den geänderten Parametern. Rückgabewert
+        ist ein Objekt für `unsubscribe()`.
+        """
+        subscription = (frozenset(keys) if keys is not None else None, callback)
+
+        with self._lock:
+            self._subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Mit `subscribe()` registrierten Callback wieder entfernen.
+        """
+        with self._lock:
+            self._subscriptions.remove(subscription)
+
+    def _apply(self, values):
+        """
+        Neue Werte übernehmen und die tatsächlich geänderten Parameter zurückgeben.
+        Darf nur unter der internen Sperre aufgerufen werden.
+        """
+        converted = {}
+
+        # Erst alle Werte umwandeln, damit ein Fehler nichts halb geändert zurücklässt
+        for key, value in values.items():
+            type_ = self._types.get(key)
+
+            if type_ is not None and value is not None and not isinstance(value, type_):
+                value = type_(value)
+
+            converted[key] = value
+
+        changes = {}
+
+        for key, value in converted.items():
+            if key in self._values and self._values[key] == value:
+                continue
+
+            self._values[key] = value
+            changes[key] = value
+
+        if changes:
+            self._version += 1
+
+            for key in changes:
+                self._versions[key] = self._version
+
+        return changes
+
+    def _notify(self, changes):
+        """
+        Abonnenten über die geänderten Parameter informieren. Darf nicht unter
+        der internen Sperre aufgerufen werden.
+        """
+        if not changes:
+            return
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for keys, callback in subscriptions:
+            if keys is None or not keys.isdisjoint(changes):
+                callback(changes)
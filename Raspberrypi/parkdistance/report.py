@@ -0,0 +1,64 @@
+class ReportByException:
+    """
+    Filter für die zu sendenden Messwerte: Ein Messwert wird nur gesendet, wenn
+    er sich um mehr als das Totband (`deadband_m`) vom zuletzt gesendeten Wert
+    unterscheidet oder seit dem letzten gesendeten Messwert das Heartbeat-
+    Intervall abgelaufen ist. Ein stehendes Auto erzeugt dadurch nur noch
+    alle paar Minuten eine Nachricht.
+
+    Die zurückgehaltenen Messwerte gehen dabei nicht verloren, sondern werden
+    zu einer Zusammenfassung mit Anzahl, Minimum, Maximum und Zeitraum
+    verdichtet, die vor dem nächsten gesendeten Messwert ausgegeben wird.
+    """
+
+    def __init__(self, deadband_m, heartbeat_s):
+        """
+        Konstruktor. Parameter:
+            * deadband_m: Mindeständerung in Metern für einen neuen Messwert
+            * heartbeat_s: Maximale Sekunden zwischen zwei gesendeten Messwerten
+        """
+        self._deadband_m = deadband_m
+        self._heartbeat_s = heartbeat_s
+        self._last_distance_m = None
+        self._last_time_s = None
+        self._summary = None
+
+    def process(self, measurement, time_s):
+        """
+        Messwert prüfen. Rückgabewert ist ein Tupel aus dem zu sendenden Messwert
+        oder `None` und der bis dahin aufgelaufenen Zusammenfassung oder `None`.
+        Die Zusammenfassung ist ein Dictionary mit den Schlüsseln `count`, `min_m`,
+        `max_m`, `start_iso` und `end_iso`.
+        """
+        distance_m = measurement.distance_m
+
+        send = (
+            self._last_distance_m is None
+            or abs(distance_m - self._last_distance_m) > self._deadband_m
+            or time_s - self._last_time_s >= self._heartbeat_s
+        )
+
+        if not send:
+            summary = self._summary
+
+            if summary is None:
+                self._summary = {
+                    "count": 1,
+                    "min_m": distance_m,
+                    "max_m": distance_m,
+                    "start_iso": measurement.datetime_iso,
+                    "end_iso": measurement.datetime_iso,
+                }
+            else:
+                summary["count"] += 1
+                summary["min_m"] = min(summary["min_m"], distance_m)
+                summary["max_m"] = max(summary["max_m"], distance_m)
+                summary["end_iso"] = measurement.datetime_iso
+
+            return None, None
+
+        summary, self._summary = self._summary, None
+        self._last_distance_m = distance_m
+        self._last_time_s = time_s
+
+        return measurement, summary
@@ -11,15 +11,20 @@ class SilentButton:
     PRESSED = 1
     HELD = 2
 
-    def __init__(self, pin, pull_up=False, bounce_time=0.3):
+    # Keine regelmäßigen Aufrufe, nur wenn der Button gedrückt wurde
+    period = None
+
+    def __init__(self, pin, pull_up=False, bounce_time=0.3, pin_factory=None):
         """
         Konstruktor. Parameter:
             * pin: GPIO-Pin des Buttons
             * pull_up: Aktivierung des internen Pull-Up-Widerstands
             * bouncetime: Entprellzeit des Buttons in Sekunden
+            * pin_factory: Pin-Factory von gpiozero (optional, sonst die globale)
         """
-        self._button = gpiozero.Button(pin=pin, pull_up=pull_up, bounce_time=bounce_time, hold_time=1.0)            
-        self._locked = False
+        self._button = gpiozero.Button(pin=pin, pull_up=pull_up, bounce_time=bounce_time, hold_time=1.0, pin_factory=pin_factory)
+        self._presses = 0
+        self._handled_presses = 0
 
     @property
     def value(self):
@@ -32,23 +37,34 @@ class SilentButton:
             return self.PRESSED
         else:
             return self.NOT_PRESSED
-    
+
+    def setup(self, device):
+        """
+        Registriert einen Callback für das Drücken des Buttons. Dieser wird von
+        gpiozero sofort bei der Flanke aufgerufen, so dass auch kurze Tastendrücke
+        zwischen zwei Durchläufen der Hauptschleife nicht verloren gehen.
+        """
+        device.parameters.declare("silent", bool, False)
+
+        def on_pressed():
+            # THREADING: Läuft im Thread von gpiozero
+            self._presses += 1
+            device.wake(self)
+
+        self._button.when_pressed = on_pressed
+
     def __call__(self, device):
         """
-        Vom Device mehrmals je Sekunde aufgerufene Funktion, um mit den Sensoren
-        und Aktoren zu interagieren und die Device-Parameter zu beeinflussen.
+        Vom Device nach jedem Drücken des Buttons aufgerufene Funktion, um mit den
+        Sensoren und Aktoren zu interagieren und die Device-Parameter zu beeinflussen.
         Steuert folgende Device-Paramater:
 
             *silent: Tonausgabe unterdrücken (Boolean)
         """
-        if not "silent" in device.parameters:
-            device.parameters["silent"] = False
+        presses = self._presses
 
-        if self.value == self.PRESSED:
-            if not self._locked:
-                self._locked = True
-                device.parameters["silent"] = not device.parameters["silent"]
-                logging.info(f"Silent-Button gedrückt! Setze silent={device.parameters['silent']}")
-        else:
-            self._locked = False
-        
\ No newline at end of file
+        if (presses - self._handled_presses) % 2:
+            silent = device.parameters.modify("silent", lambda silent: not silent, False)
+            logging.info(f"Silent-Button gedrückt! Setze silent={silent}")
+
+        self._handled_presses = presses
@@ -1,28 +1,78 @@
-import gpiozero, logging
+import gpiozero, logging, time
 
-from collections import deque
-from dataclasses import dataclass
-from datetime import datetime
+from parkdistance import metrics
+from parkdistance.measurements import MeasurementRing
+from parkdistance.sensors.filter import DistanceFilter
 
 class DistanceSensor:
     """
     Abstandssensor zum regelmäßigen Messen der Entfernung zum nächsten Hinderniss.
+
+    Der Sensor wird mehrmals je Sekunde abgefragt. Die Rohwerte durchlaufen einen
+    `DistanceFilter`, der Fehlmessungen verwirft und die übrigen Werte glättet.
+    Der gefilterte Wert steht dadurch sofort für die Anzeige zur Verfügung,
+    während an das Backend weiterhin nur im Abstand von `report_interval_s`
+    Sekunden ein Messwert übertragen wird.
     """
 
-    def __init__(self, trigger_pin, echo_pin, ringbuffer_size):
+    def __init__(self, trigger_pin, echo_pin, ringbuffer_size, sample_rate=10, report_interval_s=1.0, window=9, outlier_threshold=3.0, log_every=1):
         """
         Konstruktor. Parameter:
             * trigger_pin: GPIO-Pin des Trigger-Eingangs
             * echo_pin: GPIO-Pin des Echo-Ausgangs
+            * ringbuffer_size: Anzahl der zwischengespeicherten Messwerte
+            * sample_rate: Abfragen des Sensors je Sekunde
+            * report_interval_s: Sekunden zwischen zwei gespeicherten Messwerten
+            * window: Anzahl der für die Ausreißererkennung betrachteten Abfragen
+            * outlier_threshold: Erlaubte Abweichung vom Median in Standardabweichungen
+            * log_every: Nur jeden N-ten gespeicherten Messwert loggen, 0 = keinen
         """
-        self._sensor = gpiozero.DistanceSensor(trigger=trigger_pin, echo=echo_pin)
+        self._sensor = self._create_sensor(trigger_pin, echo_pin)
         self._ringbuffer_size = ringbuffer_size
-    
+        self._filter = DistanceFilter(window=window, outlier_threshold=outlier_threshold)
+        self._report_interval_s = report_interval_s
+        self._next_report_s = 0.0
+        self._log_every = log_every
+
+        self.period = 1.0 / sample_rate
+
+    def _create_sensor(self, trigger_pin, echo_pin):
+        """
+        Objekt zum Auslesen der Hardware erzeugen. Muss eine Property `distance`
+        mit dem Abstand in Metern besitzen. Kann für Simulationen überschrieben
+        werden.
+        """
+        # Glättung übernimmt der eigene Filter, gpiozero soll nur den letzten Wert liefern
+        return gpiozero.DistanceSensor(trigger=trigger_pin, echo=echo_pin, queue_len=1)
+
     def measure_distance(self):
         """
-        Durchführen einer Abstandsmessung. Rückgabe ist der gemessene Wert in Metern.
+        Durchführen einer Abstandsmessung. Rückgabe ist der gefilterte Wert in Metern.
+        """
+        distance_m, confidence = self._measure()
+        return distance_m
+
+    def _measure(self):
+        """
+        Sensor abfragen und den Rohwert durch den `DistanceFilter` schicken.
+        Rückgabe ist ein Tupel aus dem gefilterten Abstand in Metern und seiner
+        Konfidenz zwischen 0 und 1.
+        """
+        start_s = time.perf_counter()
+        raw_distance_m = self._sensor.distance
+        metrics.SENSOR_READ_SECONDS.observe(time.perf_counter() - start_s)
+
+        distance_m, confidence = self._filter.add(raw_distance_m)
+        return round(distance_m, 2), round(confidence, 2)
+
+    def setup(self, device):
+        """
+        Deklariert die von diesem Sensor gesteuerten Device-Parameter.
         """
-        return round(self._sensor.distance, 2)
+        device.parameters.setdefault("distance_measurement_ringbuffer", MeasurementRing(self._ringbuffer_size))
+        device.parameters.declare("distance_measurement_count", int, 0)
+        device.parameters.declare("current_distance_m", float)
+        device.parameters.declare("distance_confidence", float)
 
     def __call__(self, device):
         """
@@ -31,27 +81,31 @@ class DistanceSensor:
         Steuert folgende Device-Paramater:
 
             * distance_measurement_ringbuffer: Letzte N Abstandsmessungen mit Zeitstempel
-            * current_distance_m: Aktuell gemessener Abstand in Metern
+            * distance_measurement_count: Anzahl aller bisherigen Abstandsmessungen
+            * current_distance_m: Aktuell gemessener, gefilterter Abstand in Metern
+            * distance_confidence: Konfidenz des aktuellen Abstands zwischen 0 und 1
         """
+        distance_m, confidence = self._measure()
+
+        # Aktuellen Messwert bei jeder Abfrage für schnelle Reaktionen ablegen
+        device.parameters.update(current_distance_m=distance_m, distance_confidence=confidence)
+
+        now_s = time.monotonic()
+
+        if now_s < self._next_report_s:
+            return
+
+        # Im Rückstand, etwa beim ersten Aufruf, ab jetzt neu takten statt nachzuholen
+        if now_s >= self._next_report_s + self._report_interval_s:
+            self._next_report_s = now_s + self._report_interval_s
+        else:
+            self._next_report_s += self._report_interval_s
+
         # Letzte N Messungen zwischenspeichern
-        measurement = DistanceMeasurement(
-            distance_m   = self.measure_distance(),
-            datetime_iso = datetime.now().isoformat()
-        )
-
-        if not "distance_measurement_ringbuffer" in device.parameters:
-            device.parameters["distance_measurement_ringbuffer"] = deque(maxlen=self._ringbuffer_size)
-        
-        device.parameters["distance_measurement_ringbuffer"].append(measurement)
-
-        # Aktuellen Messwert für leichteren Zugriff separat ablegen
-        device.parameters["current_distance_m"] = measurement.distance_m
-        logging.info(f"Gemessener Abstand: {measurement.distance_m} m")
-
-@dataclass
-class DistanceMeasurement:
-    """
-    Wert einer einzelnen Abstandsmessung mit Zeitstempel.
-    """
-    distance_m: float
-    datetime_iso: str
+        ringbuffer = device.parameters["distance_measurement_ringbuffer"]
+        ringbuffer.append(distance_m, time.time_ns() // 1000000, confidence)
+
+        device.parameters["distance_measurement_count"] = ringbuffer.count
+
+        if self._log_every and ringbuffer.count % self._log_every == 0:
+            logging.info(f"Gemessener Abstand: {distance_m} m (Konfidenz {confidence})")
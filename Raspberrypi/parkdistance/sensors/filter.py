@@ -0,0 +1,127 @@
+import array
+
+class SampleRing:
+    """
+    Ringpuffer fester Größe für Zahlenwerte. Der Speicher wird einmalig als
+    `array` reserviert, so dass beim Hinzufügen keine neuen Objekte entstehen.
+    """
+
+    def __init__(self, size):
+        """
+        Konstruktor. Parameter:
+            * size: Maximale Anzahl Werte
+        """
+        self._values = array.array("d", bytes(8 * size))
+        self._size = size
+        self._count = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        """
+        Wert hinzufügen und bei vollem Puffer den ältesten Wert überschreiben.
+        """
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+
+    def samples(self):
+        """
+        Alle enthaltenen Werte in beliebiger Reihenfolge.
+        """
+        return self._values[:self._count]
+
+def median(values):
+    """
+    Median einer nicht leeren Folge von Zahlen.
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2:
+        return values[middle]
+    else:
+        return (values[middle - 1] + values[middle]) / 2
+
+class KalmanFilter:
+    """
+    Eindimensionaler Kalman-Filter für einen Wert, der sich nur langsam ändert.
+    Jede Messung verschiebt die Schätzung umso stärker, je unsicherer die
+    bisherige Schätzung im Vergleich zur Messung ist.
+    """
+
+    def __init__(self, process_noise, measurement_noise):
+        """
+        Konstruktor. Parameter:
+            * process_noise: Varianz der Änderung des Werts zwischen zwei Messungen
+            * measurement_noise: Varianz einer einzelnen Messung
+        """
+        self._q = process_noise
+        self._r = measurement_noise
+        self.estimate = None
+        self.variance = None
+
+    def update(self, value):
+        """
+        Schätzung um eine neue Messung ergänzen und die neue Schätzung zurückgeben.
+        """
+        if self.estimate is None:
+            self.estimate = value
+            self.variance = self._r
+        else:
+            variance = self.variance + self._q
+            gain = variance / (variance + self._r)
+
+            self.estimate += gain * (value - self.estimate)
+            self.variance = (1 - gain) * variance
+
+        return self.estimate
+
+class DistanceFilter:
+    """
+    Filter für die Rohwerte des Ultraschallsensors. Einzelne Fehlmessungen durch
+    verirrte Echos werden anhand des Medians und der mittleren absoluten
+    Abweichung (MAD) der letzten Messungen erkannt und verworfen. Die übrigen
+    Messungen werden mit einem Kalman-Filter geglättet.
+
+    Zusätzlich wird eine Konfidenz zwischen 0 und 1 ermittelt: Der Anteil der
+    letzten Messungen, die zum gefilterten Wert passen.
+    """
+
+    def __init__(self, window=9, outlier_threshold=3.0, tolerance_m=0.02, process_noise=1e-3, measurement_noise=4e-4):
+        """
+        Konstruktor. Parameter:
+            * window: Anzahl der für Median und MAD betrachteten Messungen
+            * outlier_threshold: Erlaubte Abweichung vom Median in Vielfachen der Standardabweichung
+            * tolerance_m: Abweichung in Metern, die nie als Ausreißer gilt
+            * process_noise: Varianz der Abstandsänderung zwischen zwei Messungen
+            * measurement_noise: Varianz einer einzelnen Messung
+        """
+        self._ring = SampleRing(window)
+        self._kalman = KalmanFilter(process_noise, measurement_noise)
+        self._outlier_threshold = outlier_threshold
+        self._tolerance_m = tolerance_m
+
+    def add(self, distance_m):
+        """
+        Neue Messung verarbeiten. Rückgabewert ist ein Tupel aus dem gefilterten
+        Abstand und der Konfidenz.
+        """
+        self._ring.append(distance_m)
+        samples = self._ring.samples()
+
+        center = median(samples)
+        deviations = [abs(sample - center) for sample in samples]
+
+        # 1.4826 * MAD entspricht bei normalverteilten Messwerten der Standardabweichung
+        limit = max(self._outlier_threshold * 1.4826 * median(deviations), self._tolerance_m)
+
+        if abs(distance_m - center) <= limit or len(samples) < 3:
+            self._kalman.update(distance_m)
+
+        estimate = self._kalman.estimate if self._kalman.estimate is not None else center
+        confidence = sum(1 for sample in samples if abs(sample - estimate) <= limit) / len(samples)
+
+        return estimate, confidence
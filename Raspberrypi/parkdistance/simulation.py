@@ -0,0 +1,416 @@
+"""
+Simulation des Devices ohne Raspberry Pi. Die GPIO-Pins werden durch die
+Mock-Pins von gpiozero ersetzt, der Abstandssensor liefert Werte aus einem
+simulierten Parkvorgang, der Button kann per Methodenaufruf gedrückt werden und
+LED und Buzzer merken sich nur das zuletzt angezeigte Muster.
+
+Für Lasttests können mit `Fleet` tausende Devices in einem einzigen Thread
+betrieben werden. Statt je Device eine eigene Verbindung zum MQTT-Broker
+aufzubauen, teilen sie sich einen `LoopbackBroker`, der die Nachrichten
+entweder nur im Prozess zählt oder über eine einzige Verbindung an einen
+echten Broker weiterreicht.
+"""
+
+# Vgl. https://gpiozero.readthedocs.io/en/stable/api_pins.html#mock-pins
+
+import paho.mqtt.client as mqtt
+import configparser, gpiozero, heapq, itertools, logging, random, threading, time
+from gpiozero.pins.mock import MockFactory
+from parkdistance.device import Device
+from parkdistance.sensors.button import SilentButton
+from parkdistance.sensors.distance import DistanceSensor
+from parkdistance.actors.led_beeper import LedBeeper, Pattern
+from parkdistance.actors.mqtt import MQTTHandler
+
+def use_mock_pins():
+    """
+    gpiozero auf simulierte Pins umstellen. Muss vor dem Erzeugen der Sensoren
+    und Aktoren aufgerufen werden.
+    """
+    gpiozero.Device.pin_factory = MockFactory()
+
+class ParkingProfile:
+    """
+    Simulierter Abstand während wiederholter Parkvorgänge: Der Stellplatz ist
+    zunächst frei, dann nähert sich ein Auto, steht eine Weile und fährt wieder
+    weg. Die Messwerte sind leicht verrauscht und enthalten gelegentlich
+    Fehlmessungen durch verirrte Echos.
+    """
+
+    def __init__(self, cycle_s=60, parked_m=0.3, max_distance_m=1.0, noise_m=0.005, echo_rate=0.02, seed=None):
+        """
+        Konstruktor. Parameter:
+            * cycle_s: Dauer eines Parkvorgangs in Sekunden
+            * parked_m: Abstand des geparkten Autos in Metern
+            * max_distance_m: Abstand bei freiem Stellplatz (Messbereich des Sensors)
+            * noise_m: Standardabweichung des Messrauschens in Metern
+            * echo_rate: Anteil der Fehlmessungen
+            * seed: Startwert des Zufallsgenerators (optional)
+        """
+        self._rng = random.Random(seed)
+        self._cycle_s = cycle_s
+        self._parked_m = parked_m
+        self._max_distance_m = max_distance_m
+        self._noise_m = noise_m
+        self._echo_rate = echo_rate
+        self._offset_s = self._rng.uniform(0, cycle_s)
+
+    def __call__(self, time_s):
+        """
+        Simulierter Messwert zum übergebenen Zeitpunkt in Sekunden.
+        """
+        if self._rng.random() < self._echo_rate:
+            return self._rng.uniform(0.02, self._max_distance_m)
+
+        phase = (time_s + self._offset_s) % self._cycle_s / self._cycle_s
+        free_m, parked_m = self._max_distance_m, self._parked_m
+
+        if phase < 0.2:
+            distance_m = free_m
+        elif phase < 0.35:
+            distance_m = free_m - (free_m - parked_m) * (phase - 0.2) / 0.15
+        elif phase < 0.85:
+            distance_m = parked_m
+        else:
+            distance_m = parked_m + (free_m - parked_m) * (phase - 0.85) / 0.15
+
+        distance_m += self._rng.gauss(0, self._noise_m)
+        return min(max(distance_m, 0.0), self._max_distance_m)
+
+class _SimulatedRanger:
+    """
+    Ersatz für `gpiozero.DistanceSensor`, der seine Werte aus einem Profil liest.
+    """
+
+    def __init__(self, profile):
+        self._profile = profile
+
+    @property
+    def distance(self):
+        return self._profile(time.monotonic())
+
+class SimulatedDistanceSensor(DistanceSensor):
+    """
+    `DistanceSensor` mit simulierten Messwerten aus einem `ParkingProfile`.
+    Filterung und Weitergabe der Messwerte laufen genauso wie auf dem Device.
+    """
+
+    def __init__(self, profile=None, ringbuffer_size=10, **kwargs):
+        """
+        Konstruktor. Im ersten Parameter kann ein eigenes Profil übergeben werden,
+        also eine Funktion, die für einen Zeitpunkt den Abstand liefert. Die
+        übrigen Parameter entsprechen denen des `DistanceSensor`.
+        """
+        self._profile = profile if profile is not None else ParkingProfile()
+        super().__init__(trigger_pin=None, echo_pin=None, ringbuffer_size=ringbuffer_size, **kwargs)
+
+    def _create_sensor(self, trigger_pin, echo_pin):
+        return _SimulatedRanger(self._profile)
+
+class SimulatedSilentButton(SilentButton):
+    """
+    `SilentButton` an einem simulierten Pin, der mit `press()` gedrückt werden
+    kann. Setzt ohne eigene `MockFactory` voraus, dass vorher `use_mock_pins()`
+    aufgerufen wurde.
+    """
+
+    def __init__(self, pin=23, pin_factory=None):
+        super().__init__(pin=pin, pull_up=True, bounce_time=None, pin_factory=pin_factory)
+
+    def press(self):
+        """
+        Button einmal kurz drücken und wieder loslassen.
+        """
+        self._button.pin.drive_low()
+        self._button.pin.drive_high()
+
+class _SimulatedPatternDriver:
+    """
+    Ersatz für den Treiber des `LedBeeper`, der das Muster nur speichert, statt
+    die Ausgänge in einem eigenen Thread blinken zu lassen.
+    """
+
+    def __init__(self):
+        self.pattern = Pattern.OFF
+
+    def apply(self, pattern):
+        self.pattern = pattern
+
+    def close(self):
+        self.pattern = Pattern.OFF
+
+class SimulatedLedBeeper(LedBeeper):
+    """
+    `LedBeeper` an simulierten Pins, der das aktuelle Muster von LEDs und Buzzer
+    in `pattern` bereitstellt. Setzt ohne eigene `MockFactory` voraus, dass
+    vorher `use_mock_pins()` aufgerufen wurde.
+    """
+
+    def __init__(self, led1_pin=7, led2_pin=8, buzzer_pin=13, pin_factory=None, **kwargs):
+        super().__init__(led1_pin, led2_pin, buzzer_pin, driver=_SimulatedPatternDriver(), pin_factory=pin_factory, **kwargs)
+
+    @property
+    def pattern(self):
+        """
+        Zuletzt angezeigtes `Pattern`.
+        """
+        return self._driver.pattern
+
+class LoopbackBroker:
+    """
+    Einfacher MQTT-Broker im selben Prozess für simulierte Devices. Jedes Device
+    erhält mit `client()` ein eigenes Client-Objekt mit der Schnittstelle von
+    `paho.mqtt.client.Client`, das dem `MQTTHandler` übergeben werden kann.
+
+    Ohne weiteren Parameter werden die gesendeten Nachrichten nur gezählt und
+    an die Funktion `sink` übergeben. Wird ein verbundener paho-Client als
+    `upstream` übergeben, werden alle Nachrichten über diese eine Verbindung an
+    einen echten Broker weitergereicht und dessen Nachrichten an die Devices
+    verteilt.
+
+    THREADING: `flush()` und die Methoden der Clients dürfen nur im Thread der
+    Simulation aufgerufen werden.
+    """
+
+    def __init__(self, sink=None, upstream=None):
+        """
+        Konstruktor. Parameter:
+            * sink: Funktion, die für jede gesendete Nachricht mit Topic und
+              Payload aufgerufen wird (optional)
+            * upstream: Verbundener paho-Client für einen echten Broker (optional)
+        """
+        self._sink = sink
+        self._upstream = upstream
+        self._clients = []
+        self._acks = []
+        self._upstream_mids = {}
+        self._mids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.published = 0
+        self.published_bytes = 0
+
+        if upstream is not None:
+            upstream.on_message = lambda client, userdata, message: self.deliver(message.topic, message.payload)
+            upstream.on_publish = self._on_upstream_publish
+
+    def client(self):
+        """
+        Neuen Client für ein simuliertes Device erzeugen.
+        """
+        client = LoopbackClient(self)
+        self._clients.append(client)
+        return client
+
+    def deliver(self, topic, payload):
+        """
+        Nachricht an alle Clients verteilen, die das Topic aboniert haben.
+        """
+        message = mqtt.MQTTMessage(topic=topic.encode())
+        message.payload = payload
+
+        for client in self._clients:
+            if client.on_message is not None and any(mqtt.topic_matches_sub(sub, topic) for sub in client.subscriptions):
+                client.on_message(client, None, message)
+
+    def flush(self):
+        """
+        Ausstehende Bestätigungen für Nachrichten mit QoS 1 ausliefern.
+        """
+        with self._lock:
+            acks, self._acks = self._acks, []
+
+        for client, mid in acks:
+            if client.on_publish is not None:
+                client.on_publish(client, None, mid)
+
+    def _publish(self, client, topic, payload, qos):
+        self.published += 1
+        self.published_bytes += len(payload)
+
+        if self._sink is not None:
+            self._sink(topic, payload)
+
+        if self._upstream is not None:
+            with self._lock:
+                info = self._upstream.publish(topic=topic, payload=payload, qos=qos)
+                self._upstream_mids[info.mid] = client
+                return info
+
+        info = mqtt.MQTTMessageInfo(next(self._mids))
+
+        if qos > 0:
+            with self._lock:
+                self._acks.append((client, info.mid))
+
+        return info
+
+    def _subscribe(self, topic):
+        if self._upstream is not None:
+            self._upstream.subscribe(topic)
+
+    def _on_upstream_publish(self, client, userdata, mid):
+        """
+        Bestätigung des echten Brokers an den Client des Devices weiterreichen.
+
+        THREADING: Diese Methode läuft im MQTT-Thread.
+        """
+        with self._lock:
+            client = self._upstream_mids.pop(mid, None)
+
+            if client is not None:
+                self._acks.append((client, mid))
+
+class LoopbackClient:
+    """
+    Client eines `LoopbackBroker` mit dem für den `MQTTHandler` benötigten Teil
+    der Schnittstelle von `paho.mqtt.client.Client`.
+    """
+
+    def __init__(self, broker):
+        self._broker = broker
+        self.subscriptions = []
+        self.will = None
+
+        self.on_connect    = None
+        self.on_disconnect = None
+        self.on_message    = None
+        self.on_publish    = None
+
+    def connect(self, host=None, port=None, keepalive=None):
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+        self._broker._subscribe(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        return self._broker._publish(self, topic, payload, qos)
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self.will = (topic, payload, qos)
+
+    def fail(self):
+        """
+        Verbindungsabbruch simulieren: Der Broker sendet den "Last Will" des
+        Clients und der Client erfährt vom Abbruch.
+        """
+        if self.will is not None:
+            self._broker._publish(self, *self.will)
+
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, 1)
+
+    def tls_set(self, **kwargs):
+        pass
+
+    def tls_insecure_set(self, value):
+        pass
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def loop_start(self):
+        pass
+
+class Fleet:
+    """
+    Viele simulierte Devices, die sich einen Thread und einen `LoopbackBroker`
+    teilen. Jedes Device besteht wie auf dem Raspberry Pi aus einem
+    `SimulatedSilentButton`, einem `SimulatedDistanceSensor`, einem
+    `SimulatedLedBeeper` und einem `MQTTHandler`. Da jedes Device dieselben
+    Pins verwendet, erhält es eine eigene `MockFactory`. Die Devices werden über
+    `Device.tick()` jeweils genau dann aufgerufen, wenn bei ihnen etwas fällig
+    ist.
+    """
+
+    def __init__(self, count, config, broker, sensor_options=None, seed=None, groups=0):
+        """
+        Konstruktor. Parameter:
+            * count: Anzahl der Devices
+            * config: Konfiguration des `MQTTHandler` (Abschnitt `[mqtt]`), wobei
+              `{device}` in allen Topics außer `topic_receive` und `topic_group`
+              durch die Nummer des Devices ersetzt wird
+            * broker: `LoopbackBroker` für alle Devices
+            * sensor_options: Weitere Parameter für den `SimulatedDistanceSensor`
+            * seed: Startwert der Zufallsgeneratoren (optional)
+            * groups: Anzahl Gruppen `group0`, `group1`, ..., auf die die Devices
+              reihum verteilt werden (optional)
+        """
+        rng = random.Random(seed)
+
+        self._broker = broker
+        self._sensor_options = sensor_options or {}
+        self._config = configparser.ConfigParser(interpolation=None)
+        self.devices = []
+
+        for index in range(count):
+            # Jedes Device sendet auf einem eigenen Topic
+            section = f"device{index}"
+            self._config.read_dict({section: dict(config)})
+            for key in ("topic_send", "topic_command", "topic_status", "topic_ack", "topic_window"):
+                if key in config:
+                    self._config[section][key] = config[key].replace("{device}", str(index))
+
+            if groups:
+                self._config[section]["groups"] = f"group{index % groups}"
+
+            self.devices.append(self._create_device(index, self._config[section], rng.random()))
+
+    def _create_device(self, index, config, seed):
+        """
+        Ein simuliertes Device mit der übergebenen Konfiguration des `MQTTHandler`
+        und dem Startwert für sein `ParkingProfile` erzeugen. Kann überschrieben
+        werden, um den Devices weitere Sensoren und Aktoren hinzuzufügen.
+        """
+        pins = MockFactory()
+
+        device = Device()
+        device.add_sensor_actor(SimulatedSilentButton(pin_factory=pins))
+        device.add_sensor_actor(SimulatedDistanceSensor(ParkingProfile(seed=seed), **self._sensor_options))
+        device.add_sensor_actor(SimulatedLedBeeper(pin_factory=pins))
+        device.add_sensor_actor(MQTTHandler(device, config, client=self._broker.client()))
+        return device
+
+    def run(self, duration_s, update_frequency=1):
+        """
+        Alle Devices für die angegebene Dauer betreiben. Rückgabewert ist die
+        Anzahl der Aufrufe von `Device.tick()`.
+        """
+        end_s = time.monotonic() + duration_s
+        schedule = []
+
+        for index, device in enumerate(self.devices):
+            device.start(update_frequency)
+            schedule.append((device.next_deadline(), index))
+
+        heapq.heapify(schedule)
+        ticks = 0
+
+        while schedule:
+            deadline_s, index = schedule[0]
+
+            if deadline_s >= end_s:
+                break
+
+            sleep_time_s = deadline_s - time.monotonic()
+
+            if sleep_time_s > 0:
+                self._broker.flush()
+                time.sleep(sleep_time_s)
+
+            deadline_s = self.devices[index].tick()
+            ticks += 1
+
+            if deadline_s is None:
+                heapq.heappop(schedule)
+            else:
+                heapq.heapreplace(schedule, (deadline_s, index))
+
+        self._broker.flush()
+        logging.info(f"{ticks} Aufrufe von {len(self.devices)} Devices in {duration_s} s")
+        return ticks
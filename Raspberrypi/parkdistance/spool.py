@@ -0,0 +1,172 @@
+import logging, sqlite3, threading, time
+from parkdistance.measurements import DistanceMeasurement
+
+class Spool:
+    """
+    Dauerhafter Zwischenspeicher für Messwerte, die wegen einer unterbrochenen
+    Verbindung zum MQTT-Broker nicht gesendet werden konnten. Die Messwerte
+    landen in einer SQLite-Datenbank auf der SD-Karte und überstehen somit
+    auch einen Neustart des Devices.
+
+    Um die SD-Karte zu schonen, werden neue und gelöschte Messwerte zunächst im
+    Hauptspeicher gesammelt und nur alle paar Sekunden gemeinsam in einer
+    Transaktion geschrieben. Zusätzlich läuft die Datenbank im WAL-Modus, bei
+    dem jede Transaktion nur am Ende einer Logdatei angehängt wird.
+
+    THREADING: Alle Methoden außer `remove()` dürfen nur im Hauptthread des
+    Devices aufgerufen werden. `remove()` darf auch im MQTT-Thread laufen.
+    """
+
+    def __init__(self, config):
+        """
+        Konstruktor. Im ersten Parameter muss ein Konfigurationsobjekt mit folgenden
+        Properties übergeben werden:
+
+            * path: Pfad der Datenbankdatei
+            * commit_interval: Sekunden zwischen zwei Schreibvorgängen (optional)
+            * max_rows: Maximale Anzahl gespeicherter Messwerte (optional)
+        """
+        self._commit_interval_s = float(config.get("commit_interval", 30))
+        self._max_rows = int(config.get("max_rows", 1000000))
+
+        self._db = sqlite3.connect(config["path"])
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS measurements (
+                id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                distance_m   REAL NOT NULL,
+                datetime_iso TEXT NOT NULL,
+                confidence   REAL
+            )
+        """)
+
+        # Ältere Datenbanken ohne Konfidenz ergänzen
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(measurements)")]
+
+        if not "confidence" in columns:
+            self._db.execute("ALTER TABLE measurements ADD COLUMN confidence REAL")
+
+        self._db.commit()
+
+        self._inserts = []
+        self._deletes = []
+        self._lock = threading.Lock()
+        self._last_commit_s = time.monotonic()
+        self._read_id = 0
+
+        self._rows = self._db.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+
+        if self._rows:
+            logging.info(f"Zwischenspeicher enthält noch {self._rows} ungesendete Messwerte")
+
+    def __len__(self):
+        """
+        Anzahl der noch nicht bestätigten Messwerte.
+        """
+        return self._rows
+
+    def append(self, measurements):
+        """
+        Messwerte zum Zwischenspeicher hinzufügen.
+        """
+        self._inserts.extend((m.distance_m, m.datetime_iso, m.confidence) for m in measurements)
+        self._rows += len(measurements)
+        self.maybe_commit()
+
+    def read(self, limit):
+        """
+        Bis zu `limit` der nächsten, noch nicht gelesenen Messwerte auslesen.
+        Rückgabewert ist eine Liste mit Tupeln aus der ID und dem Messwert.
+        Die Messwerte bleiben gespeichert, bis sie mit `remove()` entfernt
+        werden.
+        """
+        if limit <= 0:
+            return []
+
+        result = self._select(limit)
+
+        if len(result) < limit and self._inserts:
+            # Noch nicht geschriebene Messwerte werden erst beim Lesen gespeichert
+            self.commit()
+            result += self._select(limit - len(result))
+
+        return result
+
+    def remove(self, ids):
+        """
+        Vom Broker bestätigte Messwerte aus dem Zwischenspeicher entfernen.
+
+        THREADING: Darf auch im MQTT-Thread aufgerufen werden.
+        """
+        with self._lock:
+            self._deletes.extend(ids)
+            self._rows -= len(ids)
+
+    def rewind(self):
+        """
+        Nach einem Verbindungsabbruch wieder beim ältesten Messwert mit dem
+        Lesen beginnen, um auch die nicht mehr bestätigten Messwerte erneut
+        zu senden.
+        """
+        self.commit()
+        self._read_id = 0
+
+    def maybe_commit(self):
+        """
+        Gesammelte Änderungen schreiben, wenn seit dem letzten Schreibvorgang
+        genug Zeit vergangen ist.
+        """
+        if time.monotonic() - self._last_commit_s >= self._commit_interval_s:
+            self.commit()
+
+    def commit(self):
+        """
+        Alle gesammelten Änderungen in einer Transaktion schreiben. Enthält der
+        Zwischenspeicher danach zu viele Messwerte, werden die ältesten Messwerte
+        verworfen.
+        """
+        with self._lock:
+            deletes, self._deletes = self._deletes, []
+
+        inserts, self._inserts = self._inserts, []
+        self._last_commit_s = time.monotonic()
+
+        if not inserts and not deletes:
+            return
+
+        with self._db:
+            self._db.executemany("INSERT INTO measurements (distance_m, datetime_iso, confidence) VALUES (?, ?, ?)", inserts)
+            self._db.executemany("DELETE FROM measurements WHERE id = ?", ((i,) for i in deletes))
+
+            count = self._db.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+            overflow = count - self._max_rows
+
+            if overflow > 0:
+                logging.warning(f"Zwischenspeicher voll, verwerfe die {overflow} ältesten Messwerte")
+                self._db.execute("DELETE FROM measurements WHERE id IN (SELECT id FROM measurements ORDER BY id LIMIT ?)", (overflow,))
+                count -= overflow
+
+        with self._lock:
+            self._rows = count - len(self._deletes)
+
+    def close(self):
+        """
+        Gesammelte Änderungen schreiben und die Datenbank schließen.
+        """
+        self.commit()
+        self._db.close()
+
+    def _select(self, limit):
+        """
+        Nächste Messwerte aus der Datenbank lesen und die Leseposition weiterschieben.
+        """
+        rows = self._db.execute(
+            "SELECT id, distance_m, datetime_iso, confidence FROM measurements WHERE id > ? ORDER BY id LIMIT ?",
+            (self._read_id, limit)
+        ).fetchall()
+
+        if rows:
+            self._read_id = rows[-1][0]
+
+        return [(id, DistanceMeasurement.from_iso(d, t, c)) for id, d, t, c in rows]
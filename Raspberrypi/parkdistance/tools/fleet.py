@@ -0,0 +1,89 @@
+# Vgl. https://pypi.org/project/paho-mqtt/
+
+import argparse, configparser, time
+
+def main(argv=None):
+    """
+    Simulation vieler Devices ohne Raspberry Pi. Alle Devices laufen in einem
+    einzigen Thread mit simulierten Sensoren und senden ihre Messwerte über
+    einen `LoopbackBroker`. Ohne `--host` bleiben die Nachrichten im Prozess
+    und es wird nur gemessen, wie viel Rechenzeit und Datenvolumen die Devices
+    erzeugen. Mit `--host` werden alle Nachrichten über eine Verbindung an einen
+    echten MQTT-Broker weitergereicht, zum Beispiel für einen Lasttest des
+    SimpleLoggers:
+
+        python fleet.py --devices 1000 --duration 60 --host localhost
+    """
+    parser = argparse.ArgumentParser(description="Simulation vieler Devices")
+    parser.add_argument("--devices", type=int, default=100, help="Anzahl simulierter Devices")
+    parser.add_argument("--duration", type=float, default=10, help="Dauer der Simulation in Sekunden")
+    parser.add_argument("--sample-rate", type=float, default=10, help="Abfragen des Sensors je Sekunde")
+    parser.add_argument("--report-interval", type=float, default=1.0, help="Sekunden zwischen zwei gesendeten Messwerten")
+    parser.add_argument("--host", default="", help="Hostname eines echten MQTT-Brokers (optional)")
+    parser.add_argument("--port", type=int, default=1883, help="Port des MQTT-Brokers")
+    parser.add_argument("--topic-send", default="wahlmodul-iot/sim-{device}/measurements", help="Topic der Messwerte, {device} wird ersetzt")
+    parser.add_argument("--topic-receive", default="wahlmodul-iot/broadcast", help="Topic der Alarm-Broadcasts")
+    parser.add_argument("--codec", default="json", help="Nachrichtenformat der Messwerte: json oder binary")
+    parser.add_argument("--batch", action="store_true", help="Neue Messwerte gemeinsam in einer Nachricht senden")
+    parser.add_argument("--deadband", default="", help="Totband in Metern, leer = alle Messwerte senden")
+    parser.add_argument("--window", default="", help="Statistik je Zeitfenster von so vielen Sekunden senden, leer = keine")
+    parser.add_argument("--window-only", action="store_true", help="Nur die Statistiken und keine einzelnen Messwerte senden")
+    parser.add_argument("--seed", type=int, default=None, help="Startwert der Zufallsgeneratoren")
+    args = parser.parse_args(argv)
+
+    from parkdistance.simulation import use_mock_pins, Fleet, LoopbackBroker
+    use_mock_pins()
+
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_dict({"mqtt": {
+        "host":            args.host or "loopback",
+        "port":            args.port,
+        "keepalive":       60,
+        "topic_send":      args.topic_send,
+        "topic_receive":   args.topic_receive,
+        "batch_enable":    args.batch,
+        "codec":           args.codec,
+        "deadband":        args.deadband,
+        "window_interval": args.window,
+        "window_only":     args.window_only,
+        "topic_window":    args.topic_send.rsplit("/", 1)[0] + "/windows",
+    }})
+
+    upstream = None
+
+    if args.host:
+        import paho.mqtt.client as mqtt
+
+        upstream = mqtt.Client()
+        upstream.connect(host=args.host, port=args.port)
+        upstream.loop_start()
+
+    broker = LoopbackBroker(upstream=upstream)
+
+    fleet = Fleet(
+        count          = args.devices,
+        config         = config["mqtt"],
+        broker         = broker,
+        sensor_options = {"sample_rate": args.sample_rate, "report_interval_s": args.report_interval},
+        seed           = args.seed,
+    )
+
+    print(f"{args.devices} Devices, {args.sample_rate} Abfragen/s, Messwert alle {args.report_interval} s, {args.duration} s")
+
+    start_s = time.monotonic()
+    start_cpu_s = time.process_time()
+    ticks = fleet.run(args.duration, update_frequency=args.sample_rate)
+    cpu_time_s = time.process_time() - start_cpu_s
+    total_time_s = time.monotonic() - start_s
+
+    if upstream is not None:
+        upstream.loop_stop()
+        upstream.disconnect()
+
+    print(f"Aufrufe:            {ticks} in {total_time_s:.1f} s ({ticks / total_time_s:.0f}/s)")
+    print(f"Gesendet:           {broker.published} Nachrichten ({broker.published / total_time_s:.0f}/s)")
+
+    if broker.published:
+        print(f"Nachrichtengröße:   {broker.published_bytes / broker.published:.1f} Bytes")
+
+    print(f"Rechenzeit:         {cpu_time_s:.2f} s ({100 * cpu_time_s / total_time_s:.0f} % eines Kerns)")
@@ -0,0 +1,116 @@
+from datetime import datetime, timezone
+
+class WindowAggregator:
+    """
+    Verdichtung der Messwerte zu Statistiken über feste, lückenlos
+    aneinandergereihte Zeitfenster ("Tumbling Windows") von `interval_s`
+    Sekunden. Statt jedes einzelnen Messwerts wird je Fenster nur eine
+    Zusammenfassung mit Anzahl, Minimum, Maximum, Mittelwert, letztem Wert und
+    der Anzahl der Wechsel zwischen frei und belegt gesendet.
+
+    Die Fenster beginnen immer bei einem Vielfachen von `interval_s` seit 1970,
+    so dass die Fenster aller Devices im Backend zusammenpassen. Die Werte werden
+    beim Hinzufügen fortlaufend aktualisiert, der Speicherbedarf ist daher
+    unabhängig von der Anzahl der Messwerte je Fenster. Ein Fenster ohne
+    Messwerte ergibt keine Zusammenfassung.
+
+    Ein Stellplatz gilt als belegt, wenn der Abstand höchstens `occupied_m`
+    Meter beträgt. Der Zustand wird über die Fenstergrenzen hinweg verfolgt,
+    so dass auch ein Wechsel zwischen zwei Fenstern gezählt wird.
+    """
+
+    def __init__(self, interval_s, occupied_m):
+        """
+        Konstruktor. Parameter:
+            * interval_s: Länge eines Fensters in Sekunden
+            * occupied_m: Abstand in Metern, bis zu dem der Platz belegt ist
+        """
+        self._interval_ms = max(1, int(interval_s * 1000))
+        self._occupied_m = occupied_m
+        self._occupied = None
+        self._closed_ms = None
+        self._start_ms = None
+
+        self._count = 0
+        self._min_m = 0.0
+        self._max_m = 0.0
+        self._sum_m = 0.0
+        self._last_m = 0.0
+        self._changes = 0
+
+    def add(self, measurement):
+        """
+        Messwert hinzufügen. Rückgabewert ist die Zusammenfassung des vorigen
+        Fensters, wenn der Messwert bereits in ein neues Fenster fällt, ansonsten
+        `None`. Messwerte aus einem bereits abgeschlossenen Fenster, etwa nach
+        einer Zeitumstellung, werden ignoriert.
+        """
+        timestamp_ms = measurement.timestamp_ms
+
+        if self._closed_ms is not None and timestamp_ms < self._closed_ms:
+            return None
+
+        window = None
+
+        if self._start_ms is not None and timestamp_ms >= self._start_ms + self._interval_ms:
+            window = self._close()
+
+        distance_m = measurement.distance_m
+        occupied = distance_m <= self._occupied_m
+
+        if self._occupied is not None and occupied != self._occupied:
+            self._changes += 1
+
+        self._occupied = occupied
+
+        if self._start_ms is None:
+            self._start_ms = timestamp_ms - timestamp_ms % self._interval_ms
+            self._count = 1
+            self._min_m = self._max_m = self._sum_m = distance_m
+        else:
+            self._count += 1
+            self._min_m = min(self._min_m, distance_m)
+            self._max_m = max(self._max_m, distance_m)
+            self._sum_m += distance_m
+
+        self._last_m = distance_m
+        return window
+
+    def expire(self, now_ms):
+        """
+        Zusammenfassung des aktuellen Fensters zurückgeben, wenn es zum
+        übergebenen Zeitpunkt in Millisekunden seit 1970 bereits abgelaufen
+        ist, ansonsten `None`. Damit wird ein Fenster auch dann rechtzeitig
+        gesendet, wenn danach keine Messwerte mehr eintreffen.
+        """
+        if self._start_ms is None or now_ms < self._start_ms + self._interval_ms:
+            return None
+
+        return self._close()
+
+    def _close(self):
+        """
+        Aktuelles Fenster abschließen und als Dictionary mit den Schlüsseln
+        `start_iso`, `end_iso`, `count`, `min_m`, `max_m`, `mean_m`, `last_m`,
+        `occupancy_changes` und `occupied` zurückgeben. Beginn und Ende werden
+        mit Zeitzone in UTC angegeben, damit das Backend sie unabhängig von der
+        Zeitzone des Devices und ohne Sprung bei der Zeitumstellung zuordnet.
+        """
+        end_ms = self._start_ms + self._interval_ms
+
+        window = {
+            "start_iso": datetime.fromtimestamp(self._start_ms / 1000, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "end_iso": datetime.fromtimestamp(end_ms / 1000, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "count": self._count,
+            "min_m": self._min_m,
+            "max_m": self._max_m,
+            "mean_m": round(self._sum_m / self._count, 4),
+            "last_m": self._last_m,
+            "occupancy_changes": self._changes,
+            "occupied": self._occupied,
+        }
+
+        self._closed_ms = end_ms
+        self._start_ms = None
+        self._changes = 0
+        return window